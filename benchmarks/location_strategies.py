@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Compare location strategies (by default galloping_expand against
+one_line_then_expand) on synthetic files: a license from the license
+directory embedded, under a random comment prefix, between random runs of
+lines taken from the Python standard library.
+
+For each strategy, prints the region scores it computed, its total time,
+its mean region score, and in how many files it found the same region as
+the first strategy.  Run from the top of the repository:
+
+    python benchmarks/location_strategies.py --files 48
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from license_identifier import location_identifier  # noqa: E402
+from license_identifier import prep  # noqa: E402
+from license_identifier import util  # noqa: E402
+
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), '..')
+DEFAULT_LICENSE_DIR = os.path.join(BASE_DIR, 'license_identifier', 'data',
+                                   'license_dir')
+DEFAULT_LICENSES = ['MIT', 'BSD-3-Clause', 'Apache-2.0', 'GPL-2.0', 'MPL-2.0',
+                    'ISC', 'Zlib', 'BSL-1.0']
+DEFAULT_STRATEGIES = ['galloping_expand', 'one_line_then_expand']
+COMMENT_PREFIXES = ['# ', '// ', ' * ', '-- ', ';; ', '']
+MAX_CODE_LINES = 300
+
+
+def main():
+    args = _parse_args(sys.argv[1:])
+    rng = random.Random(args.seed)
+    code_lines = _code_lines(args.code_dir)
+
+    cases = []
+    for i in range(args.files):
+        name = args.licenses[i % len(args.licenses)]
+        lic = prep.License.from_filepath(
+            os.path.join(args.license_dir, name + '.txt'))
+        cases.append((lic, _embed(lic, code_lines, rng)))
+
+    results = [_run(strategy, cases) for strategy in args.strategies]
+
+    baseline_regions = results[0][3]
+    print("{:<24}{:>12}{:>10}{:>12}{:>14}".format(
+        "strategy", "evaluations", "time (s)", "mean score", "same region"))
+    for strategy, (evaluations, elapsed, scores, regions) in zip(
+            args.strategies, results):
+        same = sum(region == baseline_region for region, baseline_region
+                   in zip(regions, baseline_regions))
+        print("{:<24}{:>12}{:>10.1f}{:>12.3f}{:>14}".format(
+            strategy, evaluations, elapsed, sum(scores) / len(scores),
+            "{}/{}".format(same, len(regions))))
+
+
+def _parse_args(argv):
+    aparse = argparse.ArgumentParser(
+        description="Benchmark location strategies on synthetic files")
+    aparse.add_argument("--files", type=int, default=48,
+                        help="Number of synthetic files")
+    aparse.add_argument("--seed", type=int, default=0)
+    aparse.add_argument("--license_dir", default=DEFAULT_LICENSE_DIR)
+    aparse.add_argument("--licenses", nargs='+', default=DEFAULT_LICENSES,
+                        help="Names of the licenses to embed, in turn")
+    aparse.add_argument("--strategies", nargs='+',
+                        default=DEFAULT_STRATEGIES,
+                        help="Strategies to compare; the others are "
+                             "compared to the first")
+    aparse.add_argument("--code_dir", default=os.path.dirname(os.__file__),
+                        help="Directory of the Python files to take code "
+                             "lines from")
+
+    return aparse.parse_args(argv)
+
+
+def _code_lines(code_dir):
+    lines = []
+    for filename in sorted(os.listdir(code_dir)):
+        if filename.endswith('.py'):
+            file_lines, _ = util.read_lines_offsets(
+                os.path.join(code_dir, filename))
+            lines.extend(line for line in file_lines if line.strip())
+    return lines
+
+
+def _embed(lic, code_lines, rng):
+    """The lines of a file with the license between runs of code lines."""
+    def code():
+        start = rng.randrange(len(code_lines))
+        return code_lines[start:start + rng.randint(0, MAX_CODE_LINES)]
+
+    prefix = rng.choice(COMMENT_PREFIXES)
+    return code() + [prefix + line for line in lic.lines] + code()
+
+
+def _run(strategy, cases):
+    finder = location_identifier.Location_Finder(strategy=strategy)
+    evaluations = 0
+    elapsed = 0.0
+    scores = []
+    regions = []
+    for lic, lines in cases:
+        # Region scores are cached on the file, so each run needs its own
+        src = prep.Source.from_lines(lines)
+        start = time.time()
+        result = finder.main_process(lic, src)
+        elapsed += time.time() - start
+        evaluations += src.file_cache.region_score_misses
+        scores.append(result.score)
+        regions.append((result.start_line, result.end_line))
+
+    return evaluations, elapsed, scores, regions
+
+
+if __name__ == '__main__':
+    main()
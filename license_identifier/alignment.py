@@ -0,0 +1,185 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Token sequence alignment backends for the edit-weighted similarity.
+
+'difflib' is difflib.SequenceMatcher with autojunk off, which the scores
+have always been defined by.  'hunt_szymanski' computes a longest common
+subsequence of the token ids instead.  That is often a different (never
+shorter) alignment than difflib's greedy longest-block recursion, so its
+scores are close to but not identical to the default ones.
+"""
+
+import bisect
+import difflib
+
+
+DIFFLIB = 'difflib'
+HUNT_SZYMANSKI = 'hunt_szymanski'
+ALIGNERS = [DIFFLIB, HUNT_SZYMANSKI]
+DEFAULT_ALIGNER = DIFFLIB
+
+
+def check_aligner(aligner):
+    unrecognized = 'Unrecognized aligner: {}'.format(aligner)
+
+    assert aligner in ALIGNERS, unrecognized
+
+    return aligner
+
+
+def get_opcodes(a, b, aligner=DEFAULT_ALIGNER):
+    """
+    Return difflib-style (tag, i1, i2, j1, j2) opcodes turning the token
+    list a into the token list b.
+    """
+    if check_aligner(aligner) == DIFFLIB:
+        matcher = difflib.SequenceMatcher(isjunk=None, a=a, b=b,
+                                          autojunk=False)
+        return matcher.get_opcodes()
+
+    index = TokenIndex(b)
+    return opcodes_from_blocks(
+        hunt_szymanski_blocks(index.token_ids(a), index), len(a), len(b))
+
+
+class TokenIndex(object):
+    """
+    Integer ids for the tokens of one sequence (typically a license's), and
+    where each id occurs in it.  Built once and aligned against many
+    sequences.
+    """
+
+    def __init__(self, tokens):
+        self.ids = {}
+        self.positions = []
+        for j, token in enumerate(tokens):
+            token_id = self.ids.get(token)
+            if token_id is None:
+                token_id = self.ids[token] = len(self.positions)
+                self.positions.append([])
+            self.positions[token_id].append(j)
+
+        # Hunt-Szymanski visits the positions of each token last to first
+        for positions in self.positions:
+            positions.reverse()
+
+    def token_ids(self, tokens):
+        """Return the ids of tokens; None for tokens that never occur."""
+        ids_get = self.ids.get
+        return [ids_get(token) for token in tokens]
+
+
+def hunt_szymanski_blocks(a_ids, index):
+    """
+    Return the (i, j, size) matching blocks of a longest common subsequence
+    of a_ids and the indexed sequence, in increasing order.
+    """
+    scan = HuntSzymanskiScan(index)
+    scan.extend(a_ids)
+    return scan.blocks()
+
+
+class HuntSzymanskiScan(object):
+    """
+    Longest common subsequence of a growing sequence and an indexed one.
+
+    The scan goes through the first sequence in order, so it can be
+    extended at the end without starting over.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.length = 0
+        # thresholds[k] is the smallest position in b at which a common
+        # subsequence of length k + 1 can end; links[k] is the last match
+        # of such a subsequence, chained to its predecessor
+        self.thresholds = []
+        self.links = []
+
+    def extend(self, a_ids):
+        positions = self.index.positions
+        thresholds = self.thresholds
+        links = self.links
+        for i, token_id in enumerate(a_ids, self.length):
+            if token_id is None:
+                continue
+            for j in positions[token_id]:
+                k = bisect.bisect_left(thresholds, j)
+                if k == len(thresholds):
+                    thresholds.append(j)
+                    links.append(None)
+                elif j >= thresholds[k]:
+                    continue
+                thresholds[k] = j
+                links[k] = (i, j, links[k - 1] if k else None)
+        self.length += len(a_ids)
+
+    def blocks(self):
+        pairs = []
+        link = self.links[-1] if self.links else None
+        while link is not None:
+            pairs.append(link[:2])
+            link = link[2]
+        pairs.reverse()
+
+        blocks = []
+        for i, j in pairs:
+            if blocks and blocks[-1][0] + blocks[-1][2] == i and \
+                    blocks[-1][1] + blocks[-1][2] == j:
+                blocks[-1][2] += 1
+            else:
+                blocks.append([i, j, 1])
+
+        return [tuple(block) for block in blocks]
+
+
+def opcodes_from_blocks(blocks, len_a, len_b):
+    """
+    Turn increasing (i, j, size) matching blocks into opcodes, the way
+    difflib.SequenceMatcher.get_opcodes does.
+    """
+    i = j = 0
+    opcodes = []
+    for ai, bj, size in list(blocks) + [(len_a, len_b, 0)]:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+
+    return opcodes
@@ -0,0 +1,105 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import difflib
+
+import pytest
+
+from . import alignment
+
+
+def test_check_aligner():
+    assert alignment.check_aligner("difflib") == "difflib"
+    assert alignment.check_aligner("hunt_szymanski") == "hunt_szymanski"
+    with pytest.raises(AssertionError):
+        alignment.check_aligner("myers")
+
+
+def test_difflib_opcodes():
+    a = "x a b c y d".split()
+    b = "a b z c d d".split()
+    matcher = difflib.SequenceMatcher(isjunk=None, a=a, b=b, autojunk=False)
+
+    assert alignment.get_opcodes(a, b) == matcher.get_opcodes()
+
+
+def test_token_index():
+    index = alignment.TokenIndex("a b a c".split())
+
+    assert index.token_ids("c a x".split()) == [2, 0, None]
+    assert index.positions == [[2, 0], [1], [3]]
+
+
+def test_hunt_szymanski_blocks():
+    index = alignment.TokenIndex("a e b c d".split())
+    a_ids = index.token_ids("b c d a e".split())
+    assert alignment.hunt_szymanski_blocks(a_ids, index) == [(0, 2, 3)]
+
+    index = alignment.TokenIndex("a b c a b".split())
+    a_ids = index.token_ids("x a b a b y".split())
+    assert alignment.hunt_szymanski_blocks(a_ids, index) == \
+        [(1, 0, 2), (3, 3, 2)]
+
+    assert alignment.hunt_szymanski_blocks([], index) == []
+    assert alignment.hunt_szymanski_blocks([None], index) == []
+
+
+def test_hunt_szymanski_scan_extend():
+    index = alignment.TokenIndex("a b c d".split())
+    a_ids = index.token_ids("a x c d b".split())
+
+    scan = alignment.HuntSzymanskiScan(index)
+    scan.extend(a_ids[:2])
+    assert scan.blocks() == [(0, 0, 1)]
+    scan.extend(a_ids[2:])
+    assert scan.length == 5
+    assert scan.blocks() == alignment.hunt_szymanski_blocks(a_ids, index)
+
+
+def test_hunt_szymanski_opcodes():
+    a = "x a b c y d".split()
+    b = "a b z c d d".split()
+    opcodes = alignment.get_opcodes(a, b, "hunt_szymanski")
+
+    assert opcodes == [
+        ("delete", 0, 1, 0, 0),
+        ("equal", 1, 3, 0, 2),
+        ("insert", 3, 3, 2, 3),
+        ("equal", 3, 4, 3, 4),
+        ("delete", 4, 5, 4, 4),
+        ("equal", 5, 6, 4, 5),
+        ("insert", 6, 6, 5, 6),
+    ]
+
+
+def test_opcodes_from_blocks():
+    assert alignment.opcodes_from_blocks([], 0, 0) == []
+    assert alignment.opcodes_from_blocks([], 2, 0) == [("delete", 0, 2, 0, 0)]
+    assert alignment.opcodes_from_blocks([(0, 1, 2)], 2, 3) == \
+        [("insert", 0, 0, 0, 1), ("equal", 0, 2, 1, 3)]
@@ -11,6 +11,7 @@ import json
 
 from future.utils import iteritems
 
+from . import alignment
 from . import license_identifier
 from . import match_summary
 from . import util
@@ -47,6 +48,7 @@ def main():
         input_path=args.input_path,
         context_length=args.context,
         location_strategy=args.location_strategy,
+        location_aligner=args.location_aligner,
         cpu_count=args.cpu_count,
         penalty_only_source=args.penalty_only_source,
         penalty_only_license=args.penalty_only_license,
@@ -55,7 +57,13 @@ def main():
         keep_fraction_of_best=args.keep_fraction_of_best,
         run_in_parallel=not args.single_thread,
         original_matched_text_flag=args.matched_text_without_context,
-        include_license_metadata=args.include_license_metadata
+        include_license_metadata=args.include_license_metadata,
+        vectorized_scoring=args.vectorized_scoring,
+        use_keyword_gate=args.keyword_gate,
+        parallel_region_search=args.parallel_region_search,
+        whole_file_fast_path=args.whole_file_fast_path,
+        header_lines=args.header_lines,
+        header_kb=args.header_kb
     )
 
     results = lid.analyze()
@@ -81,7 +89,8 @@ def _parse_args(args):
     aparse.add_argument(
         "-P", "--pickle_file_path",
         help="Specify the name of the pickle file where license template "
-             "library will be saved.",
+             "library will be saved. Names ending in .lidlib use the "
+             "compact binary library format.",
         default=None)
     aparse.add_argument(
         "-I", "--input_path",
@@ -114,6 +123,12 @@ def _parse_args(args):
         "--location_strategy", help=argparse.SUPPRESS)
     aparse.add_argument(
         "--location_similarity", help=argparse.SUPPRESS)
+    aparse.add_argument(
+        "--location_aligner",
+        help="Token alignment used to locate license regions: 'difflib' "
+             "(default) or 'hunt_szymanski', a longest common subsequence "
+             "alignment that can score slightly differently",
+        choices=alignment.ALIGNERS, default=None)
     aparse.add_argument(
         "--penalty_only_source", help=argparse.SUPPRESS, type=float)
     aparse.add_argument(
@@ -128,8 +143,48 @@ def _parse_args(args):
         "--include_license_metadata", help="Add license source metadata",
         default=False
     )
+    aparse.add_argument(
+        "--vectorized_scoring",
+        help="Score candidate licenses with NumPy (requires numpy)",
+        action='store_true', default=False)
+    aparse.add_argument(
+        "--keyword_gate",
+        help="Skip files that contain none of the license library's trigger "
+             "phrases without scoring them",
+        action='store_true', default=False)
+    aparse.add_argument(
+        "--parallel_region_search",
+        help="Search for the license regions of a file's top candidates in "
+             "parallel, using up to --cpu_count processes started once per "
+             "run.  Needs --single_thread, where files are analyzed one at "
+             "a time",
+        action='store_true', default=False)
+    aparse.add_argument(
+        "--whole_file_fast_path",
+        help="Match a file that has the text of a library license as a "
+             "whole without searching it for license regions.  A near copy "
+             "is matched this way only in a file named like LICENSE or "
+             "COPYING",
+        action='store_true', default=False)
+    aparse.add_argument(
+        "--header_lines",
+        help="Only analyze the first this many lines of each file, unless a "
+             "license found there runs up to the end of them or the file is "
+             "named like a license file (LICENSE, COPYING, NOTICE)",
+        default=None, type=int)
+    aparse.add_argument(
+        "--header_kb",
+        help="Only analyze the first this many KB of each file, in the same "
+             "way as --header_lines",
+        default=None, type=int)
+
+    args = aparse.parse_args(args)
+    if args.parallel_region_search and not args.single_thread and \
+            args.input_path is not None:
+        # Files are analyzed in pool workers, which cannot start pools
+        aparse.error("--parallel_region_search needs --single_thread")
 
-    return aparse.parse_args(args)
+    return args
 
 
 def _output_results(results, format_, path, original_matched_text_flag,
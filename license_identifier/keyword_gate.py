@@ -0,0 +1,137 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Cheap pre-filter that skips sources with no license-like text.
+
+The trigger phrases come from the license library: for every license, the
+trigrams it shares with the most other licenses (the generic legal wording
+such as "permission is hereby granted" or "without warranty of"), plus a few
+seed phrases.  A source that contains none of them is not worth tokenizing
+and scoring against the whole library.
+"""
+
+import heapq
+import re
+
+from future.utils import iteritems
+
+
+SEED_PHRASES = (
+    'copyright',
+    'licensed under',
+    'permission is hereby granted',
+    'spdx-license-identifier',
+)
+PHRASES_PER_LICENSE = 5
+
+# Trigrams made only of short words ("it will be", "this is a") are common in
+# any English text, code comments included, so they make poor triggers.
+MIN_LONGEST_WORD = 5
+
+# Words of a phrase may be separated by whitespace and, as in NGrams, by any
+# punctuation-only words, such as the " * " of a wrapped comment block.
+_WORD_SEPARATOR = r'\s+(?:[^\w\s]+\s+)*'
+
+
+def trigger_phrases(n_gram_index, per_license=PHRASES_PER_LICENSE):
+    """
+    Pick the trigger phrases for a library: the `per_license` trigrams of
+    each license that appear in the most licenses (skipping those with no
+    word of at least MIN_LONGEST_WORD characters), plus SEED_PHRASES.
+    Phrases are lower case, with words separated by single spaces.
+    """
+    TRIGRAM = 2
+    most_shared = [[] for _ in n_gram_index.names]
+
+    vocabulary = n_gram_index.vocabulary
+    for key, licenses in n_gram_index.iter_postings(TRIGRAM):
+        gram = vocabulary.decode(key, TRIGRAM + 1)
+        if max(len(word) for word in gram) < MIN_LONGEST_WORD:
+            continue
+
+        shared_by = len(licenses)
+        for position in licenses:
+            heap = most_shared[position]
+            if len(heap) < per_license:
+                heapq.heappush(heap, (shared_by, gram))
+            elif shared_by > heap[0][0]:
+                heapq.heapreplace(heap, (shared_by, gram))
+
+    phrases = set(SEED_PHRASES)
+    for heap in most_shared:
+        for _, gram in heap:
+            # n-gram words are stored most recent first
+            phrases.add(u' '.join(reversed(gram)).lower())
+
+    return sorted(phrases)
+
+
+class KeywordGate(object):
+    """
+    Matches all trigger phrases with a single compiled regular expression.
+    The phrases are merged into a character trie first, so the scan does
+    not slow down as the number of phrases grows.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = phrases
+
+        trie = dict()
+        for phrase in phrases:
+            node = trie
+            for char in phrase.lower():
+                node = node.setdefault(char, dict())
+            node[''] = None
+
+        self._regex = re.compile(_trie_pattern(trie), re.UNICODE)
+
+    def matches(self, lines):
+        """Check whether any trigger phrase occurs in the given lines."""
+        text = u'\n'.join(lines).lower()
+        return self._regex.search(text) is not None
+
+
+def _trie_pattern(node):
+    if '' in node:
+        # Enough for a match; longer phrases sharing this prefix add nothing
+        return ''
+
+    alternatives = []
+    for char, child in sorted(iteritems(node)):
+        if char == ' ':
+            char_pattern = _WORD_SEPARATOR
+        else:
+            char_pattern = re.escape(char)
+        alternatives.append(char_pattern + _trie_pattern(child))
+
+    if len(alternatives) == 1:
+        return alternatives[0]
+
+    return '(?:{})'.format('|'.join(alternatives))
@@ -0,0 +1,77 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+from . import keyword_gate
+from . import n_gram_index as ngi
+from . import n_grams as ng
+
+
+license_lines = [
+    ("L0", ["Permission to redistribute the Software"]),
+    ("L1", ["Permission to redistribute the Software", "or modify it"]),
+    ("L2", ["it is what it is"]),
+]
+
+
+def make_index():
+    return ngi.NGramIndex.from_license_n_grams(
+        (name, ng.NGrams(lines)) for name, lines in license_lines)
+
+
+def test_trigger_phrases():
+    phrases = keyword_gate.trigger_phrases(make_index(), per_license=1)
+
+    for seed in keyword_gate.SEED_PHRASES:
+        assert seed in phrases
+    # The trigram shared by the most licenses wins
+    assert "permission to redistribute" in phrases
+    assert "redistribute the software" not in phrases
+    # Trigrams of short words only are never used
+    assert "it is what" not in phrases
+    assert phrases == sorted(phrases)
+
+
+def test_matches():
+    gate = keyword_gate.KeywordGate(
+        ["permission is hereby granted", "copyright", "copy of the"])
+
+    assert gate.matches(["/* Permission is", " * hereby\tGRANTED */"])
+    assert gate.matches(["Copyright 2017"])
+    assert gate.matches(["a copy of the"])
+    assert gate.matches(["# copy", "# of -- the"])
+    assert not gate.matches(["permission is granted", "copy of a"])
+    assert not gate.matches(["copy of-the"])
+    assert not gate.matches([])
+
+
+def test_matches_special_characters():
+    gate = keyword_gate.KeywordGate(["(c) 2017", "a.b"])
+
+    assert gate.matches(["(C)  2017"])
+    assert not gate.matches(["c 2017", "axb"])
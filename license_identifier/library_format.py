@@ -0,0 +1,616 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Compact, versioned binary format for a LicenseLibrary.
+
+A library file is a fixed header followed by a table of named sections, each
+holding a flat little-endian array (or a UTF-8 / JSON blob).  All strings are
+interned into one vocabulary, license tokens are stored as vocabulary ids and
+the n-gram tables are stored as sorted arrays of packed integer keys with a
+parallel array of counts.  Loading a library therefore only maps the file
+and slices the buffer; individual licenses are decoded the first time they
+are looked up.
+"""
+
+import array
+import bisect
+import json
+import mmap
+import struct
+import sys
+from collections import OrderedDict
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+from . import n_gram_index as ngi
+from . import n_grams as ng
+from . import prep
+from .n_grams import pack_key, unpack_key
+
+
+# The format relies on memoryview.cast and 64-bit ('Q') arrays, which Python
+# 2 lacks; there, libraries are only saved and loaded as pickles
+AVAILABLE = sys.version_info >= (3, 3)
+
+MAGIC = b'LIDLIB\x00\x00'
+# Version 3 added the trigger phrases and text digests to the metadata
+FORMAT_VERSION = 3
+FILE_EXTENSION = '.lidlib'
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<24sQQ')
+_ALIGNMENT = 8
+
+_UINT32 = 'I'
+_UINT64 = 'Q'
+
+_NGRAM_LEVELS = ('unigram', 'bigram', 'trigram')
+
+# Number of licenses whose region data (lines, tokens and token positions)
+# is kept decoded; None keeps every license that has been looked up.
+DEFAULT_MAX_CACHED_LICENSES = 64
+
+
+class LibraryFormatError(Exception):
+    pass
+
+
+def is_library_file(filename):
+    """Check whether a file starts with the binary library magic."""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _check_available():
+    if not AVAILABLE:
+        raise LibraryFormatError(
+            "The binary license library format needs Python 3; use a "
+            "pickled library instead")
+
+
+def dump(library, filename):
+    _check_available()
+    with open(filename, 'wb') as f:
+        f.write(_encode(library))
+
+
+def load(filename, max_cached_licenses=DEFAULT_MAX_CACHED_LICENSES):
+    """
+    Map a library file read-only.  The mapping is backed by the OS page
+    cache, so every process that loads the same file shares its memory.
+    """
+    _check_available()
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return decode(buf, max_cached_licenses)
+
+
+def _encode(library):
+    vocab = ng.Vocabulary()
+
+    names = []
+    text_chunks = []
+    text_index = array.array(_UINT32, [0])
+    line_index = array.array(_UINT32, [0])
+    line_lengths = array.array(_UINT32)
+    offsets_by_line = array.array(_UINT32)
+    token_index = array.array(_UINT32, [0])
+    token_ids = array.array(_UINT32)
+    token_spans = array.array(_UINT32)
+    line_token_counts = array.array(_UINT32)
+
+    n_gram_tables = [_NGramTableWriter(n + 1) for n in range(3)]
+
+    for name, lic in library.licenses.items():
+        names.append([name, lic.filepath])
+
+        text = u''.join(lic.lines).encode('utf-8')
+        text_chunks.append(text)
+        text_index.append(text_index[-1] + len(text))
+
+        line_lengths.extend(len(line) for line in lic.lines)
+        line_index.append(line_index[-1] + len(lic.lines))
+        offsets_by_line.extend(lic.offsets_by_line)
+
+        token_ids.extend(vocab.intern(token) for token in lic.tokens)
+        token_index.append(len(token_ids))
+        for positions in lic.token_positions_by_line:
+            line_token_counts.append(len(positions))
+            for start, end in positions:
+                token_spans.append(start)
+                token_spans.append(end)
+
+        _add_n_grams(n_gram_tables, lic.n_grams, vocab)
+
+    _add_n_grams(n_gram_tables, library.universe_n_grams, vocab)
+
+    meta = {'licenses': names,
+            'trigger_phrases': list(library.trigger_phrases),
+            'text_digests': library.text_digests}
+
+    sections = [
+        ('meta', json.dumps(meta).encode('utf-8')),
+        ('vocabulary', u'\n'.join(vocab.words).encode('utf-8')),
+        ('text', b''.join(text_chunks)),
+        ('text_index', text_index),
+        ('line_index', line_index),
+        ('line_lengths', line_lengths),
+        ('offsets_by_line', offsets_by_line),
+        ('token_index', token_index),
+        ('token_ids', token_ids),
+        ('token_spans', token_spans),
+        ('line_token_counts', line_token_counts),
+    ]
+    for level, table in zip(_NGRAM_LEVELS, n_gram_tables):
+        sections.extend(table.sections(level))
+        sections.extend(table.posting_sections(level, len(names)))
+
+    return _pack_sections(sections)
+
+
+def _add_n_grams(tables, n_grams, vocab):
+    word_ids = _FileWordIds(n_grams.vocabulary, vocab)
+    for table, counter in zip(tables, ngi.counters(n_grams)):
+        table.add(counter, word_ids)
+
+
+class _FileWordIds(dict):
+    """Maps the word ids of an NGrams vocabulary to those of the file."""
+
+    def __init__(self, vocabulary, vocab):
+        self.vocabulary = vocabulary
+        self.vocab = vocab
+
+    def __missing__(self, word_id):
+        file_id = self.vocab.intern(self.vocabulary.words[word_id])
+        self[word_id] = file_id
+        return file_id
+
+
+class _NGramTableWriter(object):
+    """Accumulates one n-gram level for every license (plus the universe)."""
+
+    def __init__(self, n):
+        self.n = n
+        self.index = array.array(_UINT32, [0])
+        self.keys = array.array(_UINT64)
+        self.counts = array.array(_UINT32)
+
+    def add(self, counter, word_ids):
+        if self.n == 1:
+            packed = [(word_ids[key], count)
+                      for key, count in counter.items() if count > 0]
+        else:
+            packed = [(pack_key(word_ids[word_id]
+                                for word_id in unpack_key(key, self.n)),
+                       count)
+                      for key, count in counter.items() if count > 0]
+        packed.sort()
+
+        self.keys.extend(key for key, _ in packed)
+        self.counts.extend(count for _, count in packed)
+        self.index.append(len(self.keys))
+
+    def sections(self, level):
+        return [(level + '_index', self.index),
+                (level + '_keys', self.keys),
+                (level + '_counts', self.counts)]
+
+    def posting_sections(self, level, num_licenses):
+        """
+        Invert the tables of the first `num_licenses` entries into postings
+        sorted by key (see n_gram_index.NGramIndex).
+        """
+        totals = array.array(_UINT32)
+        entries = []
+        for position in range(num_licenses):
+            start, end = self.index[position], self.index[position + 1]
+            totals.append(sum(self.counts[start:end]))
+            entries.extend(zip(self.keys[start:end],
+                               [position] * (end - start),
+                               self.counts[start:end]))
+        entries.sort()
+
+        keys = array.array(_UINT64)
+        index = array.array(_UINT32)
+        licenses = array.array(_UINT32)
+        counts = array.array(_UINT32)
+        for key, position, count in entries:
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                index.append(len(licenses))
+            licenses.append(position)
+            counts.append(count)
+        index.append(len(licenses))
+
+        return [(level + '_totals', totals),
+                (level + '_post_keys', keys),
+                (level + '_post_index', index),
+                (level + '_post_licenses', licenses),
+                (level + '_post_counts', counts)]
+
+
+def _pack_sections(sections):
+    payloads = []
+    for name, data in sections:
+        if isinstance(data, array.array):
+            if sys.byteorder != 'little':  # pragma: no cover
+                data = array.array(data.typecode, data)
+                data.byteswap()
+            data = data.tobytes()
+        payloads.append((name, data))
+
+    offset = _HEADER.size + _SECTION.size * len(payloads)
+    table = []
+    for name, data in payloads:
+        offset = _align(offset)
+        table.append(_SECTION.pack(name.encode('ascii'), offset, len(data)))
+        offset += len(data)
+
+    out = [_HEADER.pack(MAGIC, FORMAT_VERSION, len(payloads))]
+    out.extend(table)
+    position = _HEADER.size + _SECTION.size * len(payloads)
+    for name, data in payloads:
+        padding = _align(position) - position
+        out.append(b'\x00' * padding)
+        out.append(data)
+        position += padding + len(data)
+
+    return b''.join(out)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def decode(buf, max_cached_licenses=DEFAULT_MAX_CACHED_LICENSES):
+    """Build a LicenseLibrary backed by the given library file contents."""
+    _check_available()
+    reader = _Reader(buf)
+
+    licenses = LazyLicenses(reader, max_cached_licenses)
+    universe_n_grams = LazyNGrams(reader, len(licenses))
+
+    return prep.LicenseLibrary(licenses=licenses,
+                               universe_n_grams=universe_n_grams,
+                               n_gram_index=PackedNGramIndex(reader),
+                               trigger_phrases=reader.trigger_phrases,
+                               text_digests=reader.text_digests)
+
+
+class _Reader(object):
+
+    def __init__(self, buf):
+        self.buf = memoryview(buf)
+
+        magic, version, count = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise LibraryFormatError("Not a license library file")
+        if version != FORMAT_VERSION:
+            raise LibraryFormatError(
+                "Unsupported license library format version {} "
+                "(expected {}); rebuild the library from its license "
+                "directory".format(version, FORMAT_VERSION))
+
+        self.sections = {}
+        for i in range(count):
+            name, offset, size = _SECTION.unpack_from(
+                self.buf, _HEADER.size + i * _SECTION.size)
+            name = name.rstrip(b'\x00').decode('ascii')
+            self.sections[name] = self.buf[offset:offset + size]
+
+        meta = json.loads(self.blob('meta').decode('utf-8'))
+        self.names = [name for name, _ in meta['licenses']]
+        self.filepaths = [filepath for _, filepath in meta['licenses']]
+        self.trigger_phrases = meta['trigger_phrases']
+        self.text_digests = meta['text_digests']
+        self.vocabulary = ng.Vocabulary(
+            self.blob('vocabulary').decode('utf-8').split(u'\n'))
+
+        self.text = self.sections['text']
+        self.text_index = self.array('text_index', _UINT32)
+        self.line_index = self.array('line_index', _UINT32)
+        self.line_lengths = self.array('line_lengths', _UINT32)
+        self.offsets_by_line = self.array('offsets_by_line', _UINT32)
+        self.token_index = self.array('token_index', _UINT32)
+        self.token_ids = self.array('token_ids', _UINT32)
+        self.token_spans = self.array('token_spans', _UINT32)
+        self.line_token_counts = self.array('line_token_counts', _UINT32)
+
+        self.n_gram_tables = [
+            (self.array(level + '_index', _UINT32),
+             self.array(level + '_keys', _UINT64),
+             self.array(level + '_counts', _UINT32))
+            for level in _NGRAM_LEVELS]
+
+    def blob(self, name):
+        return self.sections[name].tobytes()
+
+    def array(self, name, typecode):
+        section = self.sections[name]
+        if sys.byteorder != 'little':  # pragma: no cover
+            result = array.array(typecode, section.tobytes())
+            result.byteswap()
+            return result
+        return section.cast(typecode)
+
+    def license(self, i, n_grams):
+        line_start, line_end = self.line_index[i], self.line_index[i + 1]
+
+        text = self.text[self.text_index[i]:self.text_index[i + 1]]
+        text = text.tobytes().decode('utf-8')
+        lines = []
+        char_index = 0
+        for length in self.line_lengths[line_start:line_end]:
+            lines.append(text[char_index:char_index + length])
+            char_index += length
+
+        # Each license has one more line offset than it has lines
+        offsets_by_line = list(
+            self.offsets_by_line[line_start + i:line_end + i + 1])
+
+        vocabulary = self.vocabulary.words
+        token_start, token_end = self.token_index[i], self.token_index[i + 1]
+        tokens = [vocabulary[token_id]
+                  for token_id in self.token_ids[token_start:token_end]]
+
+        spans = array.array(
+            _UINT32, self.token_spans[2 * token_start:2 * token_end])
+        line_starts = array.array(_UINT32, [0])
+        for count in self.line_token_counts[line_start:line_end]:
+            line_starts.append(line_starts[-1] + count)
+        token_positions_by_line = prep.TokenSpans(spans, line_starts)
+
+        return prep.License(name=self.names[i],
+                            filepath=self.filepaths[i],
+                            lines=lines,
+                            offsets_by_line=offsets_by_line,
+                            tokens=tokens,
+                            token_positions_by_line=token_positions_by_line,
+                            n_grams=n_grams)
+
+    def n_grams(self, i):
+        """
+        The n-gram tables of license i (or of the universe).  Their keys are
+        those of the library vocabulary, so nothing needs decoding.
+        """
+        result = ng.NGrams(vocabulary=self.vocabulary)
+
+        for counter, counts in zip(ngi.counters(result),
+                                   self.packed_counts(i)):
+            counter.update(dict(counts.items()))
+
+        return result
+
+    def packed_counts(self, i):
+        """The n-gram tables of license i (or of the universe), in place."""
+        result = []
+        for index, keys, counts in self.n_gram_tables:
+            start, end = index[i], index[i + 1]
+            result.append(PackedCounts(keys[start:end], counts[start:end]))
+
+        return result
+
+
+class PackedNGramIndex(ngi.NGramIndex):
+    """NGramIndex that searches the sorted posting arrays of a library."""
+
+    def __init__(self, reader):
+        self._reader = reader
+        self.names = reader.names
+        self.vocabulary = reader.vocabulary
+        self.totals = []
+        self._keys = []
+        self._index = []
+        self.posting_licenses = []
+        self.posting_counts = []
+
+        for level in _NGRAM_LEVELS:
+            self.totals.append(reader.array(level + '_totals', _UINT32))
+            self._keys.append(reader.array(level + '_post_keys', _UINT64))
+            self._index.append(reader.array(level + '_post_index', _UINT32))
+            self.posting_licenses.append(
+                reader.array(level + '_post_licenses', _UINT32))
+            self.posting_counts.append(
+                reader.array(level + '_post_counts', _UINT32))
+
+    def posting_range(self, level, key):
+        keys = self._keys[level]
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return None
+
+        return self._index[level][i], self._index[level][i + 1]
+
+    def _license_intersector(self, src_n_grams, n_grams_of):
+        # Scan the license's packed tables directly, so that its n-grams are
+        # not decoded and kept for every license that gets scored
+        src_counters = ngi.counters(src_n_grams)
+
+        def intersect(level, position):
+            index, keys, counts = self._reader.n_gram_tables[level]
+            start, end = index[position], index[position + 1]
+            by_key = src_counters[level]
+
+            size = 0
+            for key, lic_count in zip(keys[start:end], counts[start:end]):
+                count = by_key.get(key)
+                if count:
+                    size += count if count < lic_count else lic_count
+            return size
+
+        return intersect
+
+    def iter_postings(self, level):
+        index = self._index[level]
+        licenses = self.posting_licenses[level]
+        for i, key in enumerate(self._keys[level]):
+            yield key, licenses[index[i]:index[i + 1]]
+
+    def __reduce__(self):
+        # Like LazyNGrams, copies are plain (dictionary based) indexes
+        postings = []
+        for level, index in enumerate(self._index):
+            postings.append(dict(
+                (key, (index[i], index[i + 1]))
+                for i, key in enumerate(self._keys[level])))
+
+        return ngi.NGramIndex, (
+            list(self.names),
+            [array.array(_UINT32, totals) for totals in self.totals],
+            postings,
+            [array.array(_UINT32, licenses)
+             for licenses in self.posting_licenses],
+            [array.array(_UINT32, counts)
+             for counts in self.posting_counts],
+            self.vocabulary)
+
+
+class PackedCounts(Mapping):
+    """
+    Read-only counts of one n-gram table of a library, looked up by
+    bisecting its sorted keys in the library buffer.  Unlike a Counter, it
+    takes no memory of its own, and processes that map the same file share
+    it.
+    """
+
+    def __init__(self, keys, counts):
+        self._keys = keys
+        self._counts = counts
+
+    def get(self, key, default=None):
+        keys = self._keys
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return default
+        return self._counts[i]
+
+    def __getitem__(self, key):
+        count = self.get(key)
+        if count is None:
+            raise KeyError(key)
+        return count
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def items(self):
+        return zip(self._keys, self._counts)
+
+    def values(self):
+        return self._counts
+
+
+class LazyNGrams(ng.NGrams):
+    """
+    NGrams whose counters are PackedCounts over the library buffer, so
+    neither the universe nor a license is ever decoded into Counters.
+    """
+
+    def __init__(self, reader, i):
+        self._reader = reader
+        self._entry = i
+        self.vocabulary = reader.vocabulary
+        self.unigram_count, self.bigram_count, self.trigram_count = \
+            reader.packed_counts(i)
+
+    def __reduce__(self):
+        # Buffer views cannot be pickled or deep-copied, so hand over the
+        # plain, decoded NGrams instead.
+        n_grams = self._reader.n_grams(self._entry)
+        return _plain_n_grams, (n_grams.unigram_count, n_grams.bigram_count,
+                                n_grams.trigram_count, self.vocabulary)
+
+
+def _plain_n_grams(unigram_count, bigram_count, trigram_count, vocabulary):
+    result = ng.NGrams(vocabulary=vocabulary)
+    result.unigram_count = unigram_count
+    result.bigram_count = bigram_count
+    result.trigram_count = trigram_count
+    return result
+
+
+class LazyLicenses(Mapping):
+    """
+    Read-only, ordered mapping of license name to License, decoded from the
+    library buffer on demand.
+
+    Candidate selection needs the n-grams of every license, which are read
+    in place (see LazyNGrams).  The region data is only needed for the few
+    licenses that become candidates; at most `max_cached_licenses` of those
+    are kept, least recently used first out.
+    """
+
+    def __init__(self, reader,
+                 max_cached_licenses=DEFAULT_MAX_CACHED_LICENSES):
+        self._reader = reader
+        self._positions = dict((name, i)
+                               for i, name in enumerate(reader.names))
+        self._n_grams = [LazyNGrams(reader, i)
+                         for i in range(len(reader.names))]
+        self._decoded = OrderedDict()
+        self.max_cached_licenses = max_cached_licenses
+
+    def n_grams(self, name):
+        """The n-grams of a license, without decoding its region data."""
+        return self._n_grams[self._positions[name]]
+
+    def __getitem__(self, name):
+        lic = self._decoded.pop(name, None)
+        if lic is None:
+            i = self._positions[name]
+            lic = self._reader.license(i, self._n_grams[i])
+
+        self._decoded[name] = lic
+        if self.max_cached_licenses is not None and \
+                len(self._decoded) > self.max_cached_licenses:
+            self._decoded.popitem(last=False)
+
+        return lic
+
+    def __iter__(self):
+        return iter(self._reader.names)
+
+    def __len__(self):
+        return len(self._reader.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __reduce__(self):
+        # As with LazyNGrams, copies get a plain, fully decoded mapping
+        return OrderedDict, (list(self.items()),)
@@ -0,0 +1,235 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import copy
+import os
+import pickle
+
+import pytest
+
+from . import library_format
+from . import n_grams as ng
+from . import prep
+
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+needs_binary_format = pytest.mark.skipif(
+    not library_format.AVAILABLE,
+    reason="The binary library format needs Python 3")
+
+
+def make_library():
+    return prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(["  ab c,d.  ", "\t", "   ef   "], name="L1"),
+        prep.License.from_lines([u"caf\xe9 \u4f60\u597d", "x y z"],
+                                name="L2"),
+        prep.License.from_lines([], name="L3"),
+    ])
+
+
+def assert_same_n_grams(a, b):
+    assert a.word_counts() == b.word_counts()
+
+
+def assert_same_library(a, b):
+    assert list(a.licenses.keys()) == list(b.licenses.keys())
+    for name in a.licenses:
+        lic_a, lic_b = a.licenses[name], b.licenses[name]
+        assert lic_a.name == lic_b.name
+        assert lic_a.filepath == lic_b.filepath
+        assert lic_a.lines == lic_b.lines
+        assert lic_a.offsets_by_line == lic_b.offsets_by_line
+        assert lic_a.tokens == lic_b.tokens
+        assert lic_a.token_positions_by_line == \
+            lic_b.token_positions_by_line
+        assert_same_n_grams(lic_a.n_grams, lic_b.n_grams)
+    assert_same_n_grams(a.universe_n_grams, b.universe_n_grams)
+    assert list(a.trigger_phrases) == list(b.trigger_phrases)
+    assert a.text_digests == b.text_digests
+
+
+@needs_binary_format
+def test_round_trip(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+
+    library.serialize(filename)
+    assert library_format.is_library_file(filename)
+
+    loaded = prep.LicenseLibrary.deserialize(filename)
+    assert isinstance(loaded, prep.LicenseLibrary)
+    assert_same_library(library, loaded)
+    assert list(loaded.licenses["L1"].get_ignored_strings()) == \
+        list(library.licenses["L1"].get_ignored_strings())
+
+
+@needs_binary_format
+def test_round_trip_license_dir(tmpdir):
+    license_dir = os.path.join(BASE_DIR, "data", "test", "license")
+    library = prep.LicenseLibrary.from_path(license_dir)
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+
+    library.serialize(filename)
+    assert_same_library(library, prep.LicenseLibrary.deserialize(filename))
+
+
+@needs_binary_format
+def test_round_trip_n_gram_index(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    for lines in (["ab c,d.", "x y"], [u"caf\xe9 x y z"], ["unknown"]):
+        src_ng = ng.NGrams()
+        src_ng.parse_text_list_items(
+            lines, universe_ng=library.universe_n_grams)
+        expected = library.n_gram_index.similarities(src_ng)
+        assert loaded.n_gram_index.similarities(src_ng) == expected
+        assert copy.deepcopy(loaded.n_gram_index).similarities(src_ng) == \
+            expected
+
+
+def test_pickle_fallback(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib.pickle"))
+
+    library.serialize(filename)
+    assert not library_format.is_library_file(filename)
+    assert_same_library(library, prep.LicenseLibrary.deserialize(filename))
+
+
+def test_binary_format_unavailable(tmpdir, monkeypatch):
+    monkeypatch.setattr(library_format, "AVAILABLE", False)
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+
+    with pytest.raises(library_format.LibraryFormatError):
+        make_library().serialize(filename)
+
+
+@needs_binary_format
+def test_loaded_library_can_be_copied(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    assert_same_library(library, copy.deepcopy(loaded))
+    assert_same_library(library, pickle.loads(pickle.dumps(loaded)))
+
+
+@needs_binary_format
+def test_rejects_other_versions(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+
+    with open(filename, 'rb') as f:
+        contents = bytearray(f.read())
+    contents[len(library_format.MAGIC)] += 1
+
+    with pytest.raises(library_format.LibraryFormatError):
+        library_format.decode(bytes(contents))
+
+
+@needs_binary_format
+def test_region_data_loaded_on_demand(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = library_format.load(filename, max_cached_licenses=1)
+
+    # Candidate selection only touches the n-grams
+    for name, n_grams in loaded.license_n_grams():
+        assert_same_n_grams(library.licenses[name].n_grams, n_grams)
+    assert len(loaded.licenses._decoded) == 0
+
+    assert loaded.licenses["L1"].lines == library.licenses["L1"].lines
+    assert loaded.licenses["L2"].lines == library.licenses["L2"].lines
+    assert list(loaded.licenses._decoded.keys()) == ["L2"]
+
+    # The n-grams outlive the decoded region data
+    assert loaded.licenses["L1"].n_grams is loaded.licenses.n_grams("L1")
+
+
+@needs_binary_format
+def test_n_grams_of(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    assert_same_n_grams(loaded.n_grams_of("L2"), library.n_grams_of("L2"))
+    assert not loaded.licenses._decoded
+
+
+@needs_binary_format
+def test_n_grams_read_in_place(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    universe = loaded.universe_n_grams
+    for counter, expected in zip(universe._counters(),
+                                 library.universe_n_grams._counters()):
+        assert isinstance(counter, library_format.PackedCounts)
+        assert len(counter) == len(expected)
+    assert universe.word_counts() == library.universe_n_grams.word_counts()
+
+    key = universe.vocabulary.key("ab")
+    assert universe.unigram_count.get(key) == 1
+    assert universe.unigram_count[key] == 1
+    assert universe.unigram_count.get(-1, 0) == 0
+    assert -1 not in universe.unigram_count
+
+    src = prep.Source.from_lines(["ab c,d.", "x y"])
+    for name in library.licenses:
+        assert loaded.n_grams_of(name).measure_similarity(
+            src.n_grams(universe_ng=universe)) == \
+            library.n_grams_of(name).measure_similarity(
+                src.n_grams(universe_ng=library.universe_n_grams))
+
+
+@needs_binary_format
+def test_top_candidates(tmpdir):
+    library = make_library()
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    for lines in (["ab c,d.", "x y"], [u"caf\xe9 x y z"], ["unknown"]):
+        src_ng = ng.NGrams()
+        src_ng.parse_text_list_items(
+            lines, universe_ng=library.universe_n_grams)
+        expected = library.n_gram_index.top_candidates(
+            src_ng, library.n_grams_of, 0.0, 0.5)
+        assert loaded.n_gram_index.top_candidates(
+            src_ng, loaded.n_grams_of, 0.0, 0.5) == expected
+    assert not loaded.licenses._decoded
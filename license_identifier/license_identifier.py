@@ -27,14 +27,15 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-import copy
 import logging
 import multiprocessing
 import os
+import re
+import tempfile
 import threading
 import yaml
 from collections import OrderedDict
-from contextlib import closing
+from contextlib import closing, contextmanager
 
 import ntpath
 from future.utils.surrogateescape import register_surrogateescape
@@ -43,9 +44,11 @@ from future.utils import iteritems
 import comment_filter
 from comment_filter import language
 
+from . import keyword_gate
+from . import library_format
 from . import location_identifier
 from . import match_summary
-from . import n_grams
+from . import n_gram_matrix
 from . import prep
 from . import util
 from .licenses import date_updated_license_dir, spdx_version
@@ -57,11 +60,42 @@ base_dir = os.path.dirname(__file__)
 DEFAULT_THRESHOLD = 0.06
 DEFAULT_PICKLED_LIBRARY_FILE = os.path.join(base_dir, 'data',
                                             'license_n_gram_lib.pickle')
+DEFAULT_LIBRARY_FILE = os.path.join(base_dir, 'data',
+                                    'license_n_gram_lib.lidlib')
 CUSTOM_LICENSE_METADATA_FILE = os.path.join(base_dir, 'data', 'custom_license.yml')
 EXCEPTIONS_DIR = os.path.join(base_dir, 'data', 'license_dir', 'exceptions')
 DEFAULT_KEEP_FRACTION_OF_BEST = 0.9
 RANK_SCALE = (0.06, 0.08, 0.1, 0.5, 1.0)
 
+# Names of files that hold license text, such as LICENSE, COPYING.txt or
+# MIT-LICENSE.md.  With any other extension, as in license.py or notice.c,
+# the file is source code.
+LICENSE_FILE_NAME = re.compile(
+    r'(^|[-_.])(licen[cs]es?|copying|notice)([-_.]|$)', re.IGNORECASE)
+LICENSE_FILE_EXTENSIONS = ('.txt', '.md', '.rst')
+# Only letters make an extension, so that LICENSE-2.0 has none
+FILE_EXTENSION = re.compile(r'\.[a-z]+$', re.IGNORECASE)
+
+# With the whole-file fast path, a license file (by LICENSE_FILE_NAME)
+# without the exact text of a license is still matched as a whole when its
+# best candidate scores at least WHOLE_FILE_MIN_SCORE and its whole text at
+# least WHOLE_FILE_MIN_SIMILARITY under the location similarity.  Other
+# files need the exact text, so that code around a license is left out.
+WHOLE_FILE_MIN_SCORE = 0.95
+WHOLE_FILE_MIN_SIMILARITY = 0.95
+
+# With header scanning, the whole file is analyzed after all when a license
+# found in its header ends within HEADER_ESCALATION_LINES lines of the last
+# line of the header that has any words, when it scores below
+# HEADER_PARTIAL_SCORE and so may be only the start of the license, or when
+# the file is named like a license file
+HEADER_ESCALATION_LINES = 3
+HEADER_PARTIAL_SCORE = 0.9
+# A license cut off by the header scores too low to be a result, so the
+# region of the best candidate is looked for as well, but only if its score
+# reaches this fraction of the threshold
+HEADER_CANDIDATE_FRACTION = 0.5
+
 license_library = None
 lock = threading.Lock()
 
@@ -85,7 +119,7 @@ def _init_global_license_library(license_library_input, pickle_file_path=None, l
     elif license_dir is None:
         # Use pickled library
         if pickle_file_path is None:
-            pickle_file_path = DEFAULT_PICKLED_LIBRARY_FILE
+            pickle_file_path = _default_library_file()
         if not license_library:
             license_library = _init_pickled_library(pickle_file_path)
     else:
@@ -96,12 +130,46 @@ def _init_global_license_library(license_library_input, pickle_file_path=None, l
     return license_library
 
 
+def _default_library_file():
+    # Prefer the binary library; the pickle is kept as a fallback
+    if library_format.AVAILABLE and os.path.exists(DEFAULT_LIBRARY_FILE):
+        return DEFAULT_LIBRARY_FILE
+    return DEFAULT_PICKLED_LIBRARY_FILE
+
+
 def _init_pickled_library(pickle_file_path):
-    _logger.info("Loading pickled license library "
+    _logger.info("Loading serialized license library "
                  "from {}".format(pickle_file_path))
     return prep.LicenseLibrary.deserialize(pickle_file_path)
 
 
+# For multi-processing, map a shared binary library file in each process
+# (or, on Python 2, unpickle a shared pickle file)
+def _init_shared_license_library(library_file):
+    global license_library
+    _logger.info("Mapping shared license library {}".format(library_file))
+    license_library = prep.LicenseLibrary.deserialize(library_file)
+
+    return license_library
+
+
+@contextmanager
+def _temporary_library_file(library):
+    """
+    Write a library to a temporary binary library file (a pickle file on
+    Python 2) for the lifetime of the context.
+    """
+    suffix = library_format.FILE_EXTENSION if library_format.AVAILABLE \
+        else '.pickle'
+    fd, library_file = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        library.serialize(library_file)
+        yield library_file
+    finally:
+        os.remove(library_file)
+
+
 def _init_using_lic_dir(license_dir):
     _logger.info("Loading license library from {}".format(license_dir))
     return prep.LicenseLibrary.from_path(license_dir)
@@ -122,6 +190,7 @@ class LicenseIdentifier:
                  cpu_count=multiprocessing.cpu_count(),
                  location_strategy=None,
                  location_similarity=None,
+                 location_aligner=None,
                  penalty_only_source=None,
                  penalty_only_license=None,
                  punct_weight=None,
@@ -129,7 +198,13 @@ class LicenseIdentifier:
                  pickle_file_path=None,
                  run_in_parallel=True,
                  original_matched_text_flag=False,
-                 include_license_metadata=False):
+                 include_license_metadata=False,
+                 vectorized_scoring=False,
+                 use_keyword_gate=False,
+                 parallel_region_search=False,
+                 whole_file_fast_path=False,
+                 header_lines=None,
+                 header_kb=None):
 
         self.threshold = threshold
         self.context_length = context_length
@@ -138,6 +213,7 @@ class LicenseIdentifier:
         self.cpu_count = cpu_count
         self.location_strategy = location_strategy
         self.location_similarity = location_similarity
+        self.location_aligner = location_aligner
         self.penalty_only_source = penalty_only_source
         self.penalty_only_license = penalty_only_license
         self.punct_weight = punct_weight
@@ -148,12 +224,33 @@ class LicenseIdentifier:
         self.pickle_file_path = pickle_file_path
         self.license_dir = license_dir
         self.input_license_library = license_library
+        self.vectorized_scoring = vectorized_scoring
+        self._n_gram_matrix = None
+        self.use_keyword_gate = use_keyword_gate
+        self._keyword_gate = None
+        self.parallel_region_search = parallel_region_search
+        self._region_pool = None
+        self.whole_file_fast_path = whole_file_fast_path
+        self.header_lines = header_lines
+        self.header_kb = header_kb
 
         if self.run_in_parallel:
             self.license_library = None
         else:
             self.license_library = _init_global_license_library(self.input_license_library, self.pickle_file_path, self.license_dir)
 
+    def __getstate__(self):
+        # Instances are pickled along with every task sent to a worker pool,
+        # and workers get the library from their pool initializer instead
+        state = self.__dict__.copy()
+        state['license_library'] = None
+        state['input_license_library'] = None
+        state['_n_gram_matrix'] = None
+        state['_keyword_gate'] = None
+        state['_region_pool'] = None
+
+        return state
+
     def _check_keep_fraction_of_best(self, keep_fraction_of_best):
         assert keep_fraction_of_best >= 0.0
         assert keep_fraction_of_best <= 1.0
@@ -191,17 +288,78 @@ class LicenseIdentifier:
 
         return output
 
+    @contextmanager
+    def _pool_initializer(self):
+        """
+        Yield the (initializer, initargs) for a worker pool.  Workers attach
+        to a binary library file, which the OS shares between processes, so
+        neither pool startup nor per-worker memory grows with the library.
+        Only a pickle file (the only format on Python 2) still has to be
+        unpickled by every worker.
+        """
+        if self.input_license_library is None and self.license_dir is None:
+            library_file = self.pickle_file_path
+            if library_file is None:
+                library_file = _default_library_file()
+
+            if os.path.exists(library_file) and \
+                    library_format.is_library_file(library_file):
+                yield _init_shared_license_library, [library_file]
+            else:
+                yield _init_global_license_library, \
+                    [None, self.pickle_file_path, None]
+            return
+
+        # Build (or take) the library once, then share it through a file
+        library = self.license_library
+        if library is None:
+            library = _init_global_license_library(
+                self.input_license_library, self.pickle_file_path,
+                self.license_dir)
+        with _temporary_library_file(library) as library_file:
+            yield _init_shared_license_library, [library_file]
+
+    @contextmanager
+    def _region_search_pool(self):
+        """
+        With parallel_region_search, keep a worker pool for the region
+        searches open for the lifetime of the context, so that a run starts
+        it (and shares the library with it) once rather than for every file.
+        Nested contexts use the pool of the outermost one.
+        """
+        if not self.parallel_region_search or \
+                self._region_pool is not None or \
+                multiprocessing.current_process().daemon:
+            # Pool workers are daemons, which cannot start pools of their
+            # own, so the searches run in parallel only outside of one
+            yield
+            return
+
+        with self._pool_initializer() as (initializer, initargs):
+            with closing(multiprocessing.Pool(
+                    processes=self.cpu_count,
+                    initializer=initializer,
+                    initargs=initargs)) as pool:
+                self._region_pool = pool
+                try:
+                    yield
+                finally:
+                    self._region_pool = None
+
     def apply_function_on_all_files(self, function_ptr, filenames):
         if self.run_in_parallel:
-            with closing(multiprocessing.Pool(processes=self.cpu_count, initializer=_init_global_license_library, initargs=[copy.deepcopy(self.license_library), self.pickle_file_path, self.license_dir])) as \
-                    pool:
-                output = self._apply_function_on_all_files(pool.apply_async,
-                                                           function_ptr,
-                                                           filenames)
+            with self._pool_initializer() as (initializer, initargs):
+                with closing(multiprocessing.Pool(
+                        processes=self.cpu_count,
+                        initializer=initializer,
+                        initargs=initargs)) as pool:
+                    output = self._apply_function_on_all_files(
+                        pool.apply_async, function_ptr, filenames)
         else:
             self.license_library = _init_global_license_library(self.license_library, self.pickle_file_path, self.license_dir)
-            output = self._apply_function_on_all_files(apply_sync,
-                                                       function_ptr, filenames)
+            with self._region_search_pool():
+                output = self._apply_function_on_all_files(
+                    apply_sync, function_ptr, filenames)
 
         if output and self.include_license_metadata:
             output = self.add_license_metadata(output)
@@ -218,29 +376,197 @@ class LicenseIdentifier:
         """
         Find licenses within a source file (or within a subset of a file).
         """
-        source_file = prep.Source.from_filepath(filepath)
+        with self._region_search_pool():
+            if self.header_lines is not None or self.header_kb is not None:
+                results = self._analyze_file_header(filepath)
+                if results is not None:
+                    return results
+
+            if not self.use_keyword_gate:
+                return self._analyze_whole_source(
+                    prep.Source.from_filepath(filepath))
+
+            # Check the gate before paying for tokenization
+            lines, offsets_by_line = util.read_lines_offsets(filepath)
+            if not self._passes_keyword_gate(lines):
+                return []
+
+            source_file = prep.Source.from_lines_and_offsets(
+                lines, offsets_by_line, filepath)
+
+            return self._analyze_whole_source(source_file)
+
+    def _analyze_file_header(self, filepath):
+        """
+        Find licenses within the first header_lines lines or header_kb KB
+        of a source file.  Return None if the whole file needs analyzing
+        instead: if it is named like a license file, or if a license found
+        in the header may go on past it.
+        """
+        if _is_license_file_name(filepath):
+            return None
+
+        max_bytes = None if self.header_kb is None else self.header_kb * 1024
+        lines, offsets_by_line, truncated = util.read_header_lines_offsets(
+            filepath, self.header_lines, max_bytes)
+        header = prep.Source.from_lines_and_offsets(
+            lines, offsets_by_line, filepath, truncated)
+        results = self.analyze_source(header)
+
+        if truncated and self._runs_past_header(header, results):
+            return None
+
+        return results
+
+    def _runs_past_header(self, header, results):
+        """
+        Whether a license in the header may go on past it: whether a result
+        scores below HEADER_PARTIAL_SCORE, or whether a result, or else the
+        region of a best candidate scoring below the threshold, ends within
+        HEADER_ESCALATION_LINES lines of the last line of the header with
+        any words.  Blank lines or bare comment markers at the end of the
+        header do not hide a license that goes on past it.
+        """
+        line_starts = header.token_line_starts()
+        word_lines = [ind for ind in range(len(header.lines))
+                      if line_starts[ind + 1] > line_starts[ind]]
+        if not word_lines:
+            return False
+
+        last_line_ind = word_lines[-1] + 1 - HEADER_ESCALATION_LINES
+        if any(result['end_line_ind'] >= last_line_ind or
+               result['score'] < HEADER_PARTIAL_SCORE
+               for result in results):
+            return True
+
+        if self.use_keyword_gate and \
+                not self._passes_keyword_gate(header.lines):
+            return False
 
-        return self.analyze_source(source_file)
+        candidates = self._candidates(
+            header, self.threshold * HEADER_CANDIDATE_FRACTION, 1.0)
+        if not candidates or max(candidates.values()) <= 0.0:
+            return False
+
+        best_region = self.find_license_region(
+            self.license_library.licenses[next(iter(candidates))], header)
+
+        return header.relative_line_index(best_region.end_line) >= \
+            last_line_ind
 
     def analyze_source(self, source):
+        if self.use_keyword_gate and \
+                not self._passes_keyword_gate(source.lines):
+            return []
+
+        return self._analyze_whole_source(source)
+
+    def _analyze_whole_source(self, source):
+        with self._region_search_pool():
+            results = self._analyze_source(source)
+
+        file_cache = source.file_cache
+        _logger.debug("Region scores for {}: {} reused, {} computed".format(
+            source.filepath, file_cache.region_score_hits,
+            file_cache.region_score_misses))
+
+        return results
+
+    def _passes_keyword_gate(self, lines):
+        trigger_phrases = self.license_library.trigger_phrases
+        if self._keyword_gate is None or \
+                self._keyword_gate.phrases is not trigger_phrases:
+            self._keyword_gate = keyword_gate.KeywordGate(trigger_phrases)
+
+        return self._keyword_gate.matches(lines)
+
+    def _analyze_source(self, source):
         if len(source.lines) == 0:
             return []
 
+        whole_file = self.whole_file_fast_path and source.is_whole_file()
+        if whole_file:
+            # A file with the text of a library license needs no scoring
+            matched_license = self.license_library.text_digests.get(
+                source.text_digest())
+            if matched_license is not None:
+                return [self._match_whole_file(source, matched_license)]
+
         # Consider only the top matching licenses
         top_candidates = self.get_top_candidates(source)
         if len(top_candidates) == 0:
             return []
 
+        if whole_file and _is_license_file_name(source.filepath):
+            matched_license = self._whole_file_candidate(top_candidates,
+                                                         source)
+            if matched_license is not None:
+                return [self._match_whole_file(
+                    source, matched_license, top_candidates[matched_license])]
+
         # Search for best matching region for each of the top candidates
-        region_results = []
-        for license_name, original_score in iteritems(top_candidates):
-            license = self.license_library.licenses[license_name]
-            result = self.find_license_region(license, source)
-            region_results.append((license_name, original_score, result))
+        region_results = self._find_candidate_regions(top_candidates, source)
 
         matched_license, orig_score, best_region = \
             max(region_results, key=lambda x: x[2].score)
 
+        results = [self._match_summary(source, matched_license, orig_score,
+                                       best_region)]
+
+        source_above = source.subset(
+            0, source.relative_line_index(best_region.start_line))
+        source_below = source.subset(
+            source.relative_line_index(best_region.end_line),
+            len(source.lines))
+
+        # The keyword gate is for whole files: the rest of a file that
+        # passed it is searched whether or not it has a trigger phrase
+        results_above = self._analyze_whole_source(source_above)
+        results_below = self._analyze_whole_source(source_below)
+
+        results.extend(results_above)
+        results.extend(results_below)
+        results.sort(key=lambda x: -x['region_score'])
+
+        return results
+
+    def _whole_file_candidate(self, top_candidates, source):
+        """
+        Return the top candidate that the whole source matches closely
+        enough to skip the region search, or None.
+        """
+        matched_license, orig_score = max(iteritems(top_candidates),
+                                          key=lambda x: x[1])
+        if orig_score < WHOLE_FILE_MIN_SCORE:
+            return None
+
+        lic = self.license_library.licenses[matched_license]
+        region_scorer = self._location_finder().similarity_obj.region_scorer(
+            lic, source)
+        if region_scorer.score(0, len(source.lines)) < \
+                WHOLE_FILE_MIN_SIMILARITY:
+            return None
+
+        return matched_license
+
+    def _match_whole_file(self, source, matched_license, orig_score=None):
+        """Summarize a match of the license covering the whole source."""
+        if orig_score is None:
+            src_ng = source.n_grams(
+                universe_ng=self.license_library.universe_n_grams)
+            orig_score = self.license_library.n_grams_of(
+                matched_license).measure_similarity(src_ng)
+
+        # No region search: the region is the whole source
+        loc_finder = self._location_finder(strategy='full_text_only')
+        whole_region = loc_finder.main_process(
+            self.license_library.licenses[matched_license], source)
+
+        return self._match_summary(source, matched_license, orig_score,
+                                   whole_region)
+
+    def _match_summary(self, source, matched_license, orig_score,
+                       best_region):
         try:
             orig_rank = self.get_rank(orig_score)
         except ScoreOutOfRange:
@@ -277,22 +603,7 @@ class LicenseIdentifier:
         if not self.original_matched_text_flag:
             summary.pop('original_region')
 
-        results = [summary]
-
-        source_above = source.subset(
-            0, source.relative_line_index(best_region.start_line))
-        source_below = source.subset(
-            source.relative_line_index(best_region.end_line),
-            len(source.lines))
-
-        results_above = self.analyze_source(source_above)
-        results_below = self.analyze_source(source_below)
-
-        results.extend(results_above)
-        results.extend(results_below)
-        results.sort(key=lambda x: -x['region_score'])
-
-        return results
+        return summary
 
     @staticmethod
     def get_rank(my_score):
@@ -309,22 +620,35 @@ class LicenseIdentifier:
                     return index+1
 
     def get_top_candidates(self, source):
-        # First, compute n-grams for all lines in the source file
-        src_ng = n_grams.NGrams()
-        src_ng.parse_text_list_items(
-            source.lines,
+        return self._candidates(source, self.threshold,
+                                self.keep_fraction_of_best)
+
+    def _candidates(self, source, threshold, keep_fraction_of_best):
+        # First, take the n-grams of the source's lines from the per-line
+        # records of the file, which recursing into subsets of the file
+        # reuses rather than parsing the lines again
+        src_ng = source.n_grams(
             universe_ng=self.license_library.universe_n_grams)
 
+        index = self.license_library.n_gram_index
+        if not self.vectorized_scoring:
+            # Score only the licenses that can make the cut
+            candidates = index.top_candidates(
+                src_ng, self.license_library.n_grams_of, threshold,
+                keep_fraction_of_best)
+
+            return OrderedDict((index.names[position], score)
+                               for position, score in candidates)
+
         # Measure n-gram similarity relative to all licenses in the library
-        similarities = OrderedDict()
-        for license_name, lic in iteritems(self.license_library.licenses):
-            similarity_score = lic.n_grams.measure_similarity(src_ng)
-            similarities[license_name] = similarity_score
+        similarities = OrderedDict(
+            zip(index.names, self._n_gram_matrix_for(index).similarities(
+                src_ng)))
 
         # Filter out low-scoring licenses
         best_score = max(similarities.values())
-        current_threshold = max(self.threshold,
-                                best_score * self.keep_fraction_of_best)
+        current_threshold = max(threshold,
+                                best_score * keep_fraction_of_best)
 
         top_candidates = OrderedDict()
         for license_name, score in iteritems(similarities):
@@ -333,19 +657,53 @@ class LicenseIdentifier:
 
         return top_candidates
 
+    def _n_gram_matrix_for(self, index):
+        if self._n_gram_matrix is None or \
+                self._n_gram_matrix.index is not index:
+            self._n_gram_matrix = n_gram_matrix.NGramMatrix(index)
+
+        return self._n_gram_matrix
+
+    def _find_candidate_regions(self, top_candidates, source):
+        """
+        Return (license name, original score, location result) for each of
+        the top candidates, in order.
+        """
+        if self._region_pool is not None and len(top_candidates) > 1:
+            # Workers get a copy of the source, without the region scores
+            # cached on its file
+            results = [
+                self._region_pool.apply_async(_find_license_region,
+                                              [self, license_name, source])
+                for license_name in top_candidates]
+            results = [result.get() for result in results]
+        else:
+            results = [
+                self.find_license_region(
+                    self.license_library.licenses[license_name], source)
+                for license_name in top_candidates]
+
+        return [(license_name, original_score, result)
+                for (license_name, original_score), result
+                in zip(iteritems(top_candidates), results)]
+
     def find_license_region(self, lic, src):
+        return self._location_finder().main_process(lic, src)
+
+    def _location_finder(self, **overrides):
         # Pass along only the location args that were explicitly specified
         loc_args_raw = dict(context_lines=self.context_length,
                             strategy=self.location_strategy,
                             similarity=self.location_similarity,
+                            aligner=self.location_aligner,
                             penalty_only_source=self.penalty_only_source,
                             penalty_only_license=self.penalty_only_license,
                             punct_weight=self.punct_weight)
+        loc_args_raw.update(overrides)
 
         loc_args = {k: v for k, v in iteritems(loc_args_raw) if v is not None}
-        loc_finder = location_identifier.Location_Finder(**loc_args)
 
-        return loc_finder.main_process(lic, src)
+        return location_identifier.Location_Finder(**loc_args)
 
     def postprocess_strip_off_code(self, results):
         return PostProcessor(self.threshold).strip_off_code(results)
@@ -452,6 +810,20 @@ class PostProcessor(object):
         return results
 
 
+def _is_license_file_name(filepath):
+    if filepath is None:
+        return False
+
+    name = os.path.basename(filepath)
+    extension = FILE_EXTENSION.search(name)
+    if extension is not None:
+        if extension.group().lower() not in LICENSE_FILE_EXTENSIONS:
+            return False
+        name = name[:extension.start()]
+
+    return LICENSE_FILE_NAME.search(name) is not None
+
+
 def _analyze_file(lid, input_path):
     # for multi-processing always ensure the lid instance is using the global instance
     # for the particular process it is running in
@@ -459,6 +831,12 @@ def _analyze_file(lid, input_path):
     return lid.analyze_file(input_path)
 
 
+def _find_license_region(lid, license_name, src):
+    lid.license_library = license_library
+    return lid.find_license_region(license_library.licenses[license_name],
+                                   src)
+
+
 class SyncResult(object):
     """Mimic the interface of multiprocessing.pool.AsyncResult"""
 
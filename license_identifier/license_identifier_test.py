@@ -29,6 +29,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import csv
+import multiprocessing
 import random
 import string
 from collections import Counter, OrderedDict
@@ -49,6 +50,7 @@ from . import location_identifier
 from . import match_summary
 from . import n_grams as ng
 from . import prep
+from . import util
 
 
 text_list = ['one', 'two', 'three', 'four']
@@ -335,6 +337,32 @@ def test_analyze_input_path():
     assert len(result[files[5]]) == 0
 
 
+def test_analyze_input_path_parallel():
+    expected = lcs_id_obj.analyze_input_path(input_path=input_dir)
+
+    lid = license_identifier.LicenseIdentifier(
+        license_dir=license_dir,
+        threshold=threshold,
+        cpu_count=2)
+    assert lid.analyze_input_path(input_path=input_dir) == expected
+
+    lid = license_identifier.LicenseIdentifier(
+        license_library=prep.LicenseLibrary.from_path(license_dir),
+        threshold=threshold,
+        cpu_count=2)
+    assert lid.analyze_input_path(input_path=input_dir) == expected
+
+
+def test_pickled_instance_omits_library():
+    lid = license_identifier.LicenseIdentifier(
+        license_library=prep.LicenseLibrary.from_path(license_dir),
+        run_in_parallel=False)
+    state = lid.__getstate__()
+    assert state['license_library'] is None
+    assert state['input_license_library'] is None
+    assert lid.license_library is not None
+
+
 def test_find_license_region():
     lic = lcs_id_obj.license_library.licenses['test_license']
     src_fp = join(BASE_DIR, 'data', 'test', 'data', 'test1.py')
@@ -482,6 +510,74 @@ def test_analyze_file_multiple_licenses():
     assert result[2]["end_line_ind"] == 6
 
 
+def test_top_candidates_of_subset():
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(["a b c d"], name="L0"),
+        prep.License.from_lines(["e f g h"], name="L1"),
+    ])
+    lid = license_identifier.LicenseIdentifier(
+        license_library=lib, threshold=0.001, run_in_parallel=False)
+
+    lines = ["a b", "c d", "x", "e f", "g", "h"]
+    src = prep.Source.from_lines(lines)
+    assert list(lid.get_top_candidates(src)) == ['L0', 'L1']
+    for start_line, end_line in [(0, 2), (1, 4), (2, 6), (3, 6)]:
+        assert lid.get_top_candidates(src.subset(start_line, end_line)) == \
+            lid.get_top_candidates(
+                prep.Source.from_lines(lines[start_line:end_line]))
+
+
+def test_parallel_region_search(tmpdir):
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(["a b c d e f"], name="L0"),
+        prep.License.from_lines(["a b c d e g"], name="L1"),
+        prep.License.from_lines(["a b c d h i"], name="L2"),
+    ])
+    src = prep.Source.from_lines(
+        ["x", "a b", "c d", "e f", "y", "a b c", "d e g", "z"])
+
+    expected = license_identifier.LicenseIdentifier(
+        license_library=lib,
+        threshold=0.001,
+        location_similarity="edit_weighted",
+        keep_fraction_of_best=0.1,
+        run_in_parallel=False).analyze_source(src)
+    assert [summary["matched_license"] for summary in expected] == \
+        ['L0', 'L1']
+
+    lid = license_identifier.LicenseIdentifier(
+        license_library=lib,
+        threshold=0.001,
+        location_similarity="edit_weighted",
+        keep_fraction_of_best=0.1,
+        run_in_parallel=False,
+        parallel_region_search=True,
+        cpu_count=2)
+    assert lid.analyze_source(src) == expected
+
+    # A run starts one pool, and shares the library with it once
+    filepaths = []
+    for i in range(3):
+        filepath = str(tmpdir.join("src{}.txt".format(i)))
+        with open(filepath, "w") as f:
+            f.write("\n".join(src.lines) + "\n")
+        filepaths.append(filepath)
+    with patch.object(multiprocessing, 'Pool',
+                      wraps=multiprocessing.Pool) as pool, \
+            patch.object(license_identifier, '_temporary_library_file',
+                         wraps=license_identifier._temporary_library_file) \
+            as library_file:
+        results = lid.analyze_files(filepaths)
+    assert pool.call_count == 1
+    assert library_file.call_count == 1
+    assert lid._region_pool is None
+    for filepath in filepaths:
+        assert [(summary["matched_license"], summary["region_score"])
+                for summary in results[filepath]] == \
+            [(summary["matched_license"], summary["region_score"])
+             for summary in expected]
+
+
 def test_analyze_file_near_ties():
     fp = join(BASE_DIR, 'data', 'test', 'near_tie', 'data', 'source')
     near_tie_license_dir = join(BASE_DIR, 'data', 'test', 'near_tie',
@@ -588,3 +684,185 @@ def test_encode_as_utf8_doesnt_raise_exception_py2():
     encoded_region = license_identifier.PostProcessor(0.06).\
         encode_as_utf8(license_region)
     assert encoded_region == u'This is some license text with é and Ж and ױ and ㅎ and 你'
+
+
+def test_vectorized_scoring():
+    pytest.importorskip("numpy")
+    lid = license_identifier.LicenseIdentifier(license_dir=license_dir,
+                                               threshold=threshold,
+                                               run_in_parallel=False,
+                                               vectorized_scoring=True)
+    src = prep.Source.from_lines(["a", "one two three four", "b"])
+
+    assert lid.get_top_candidates(src) == \
+        lcs_id_obj.get_top_candidates(src)
+    assert lid._n_gram_matrix is not None
+
+
+def test_keyword_gate():
+    lid = license_identifier.LicenseIdentifier(license_dir=license_dir,
+                                               threshold=threshold,
+                                               run_in_parallel=False,
+                                               use_keyword_gate=True)
+    src = prep.Source.from_lines(["a", "one two three four", "b"])
+    assert lid.analyze_source(src) == lcs_id_obj.analyze_source(src)
+
+    src = prep.Source.from_lines(["a", "one two four", "b"])
+    assert lid.analyze_source(src) == []
+
+    fp = join(input_dir, 'test0.py')
+    assert lid.analyze_file(fp) == lcs_id_obj.analyze_file(fp)
+
+
+def test_keyword_gate_whole_file_only():
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(["one two three four five six"], name="L0"),
+        prep.License.from_lines(["seven eight nine ten"], name="L1"),
+    ])
+    lib = lib._replace(trigger_phrases=["one two three"])
+    src = prep.Source.from_lines(
+        ["one two three four five six", "x", "seven eight nine ten"])
+
+    expected = license_identifier.LicenseIdentifier(
+        license_library=lib, threshold=0.01,
+        run_in_parallel=False).analyze_source(src)
+    assert [result["matched_license"] for result in expected] == \
+        ["L0", "L1"]
+
+    # A match in a part of the file without a trigger phrase is kept
+    lid = license_identifier.LicenseIdentifier(
+        license_library=lib, threshold=0.01, run_in_parallel=False,
+        use_keyword_gate=True)
+    assert lid.analyze_source(src) == expected
+    assert lid.analyze_source(src.subset(2, 3)) == []
+
+
+def test_whole_file_fast_path():
+    lic_lines = ["w{} w{} w{}".format(i, i + 1, i + 2)
+                 for i in range(0, 60, 3)]
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(lic_lines, name="L0"),
+        prep.License.from_lines(["i j k l"], name="L1"),
+    ])
+    lid = license_identifier.LicenseIdentifier(
+        license_library=lib, threshold=0.001, run_in_parallel=False,
+        whole_file_fast_path=True)
+    lid_search = license_identifier.LicenseIdentifier(
+        license_library=lib, threshold=0.001, run_in_parallel=False)
+
+    # The text of a license is matched without scoring any candidate
+    src = prep.Source.from_lines(["", "# " + " ".join(lic_lines), ""])
+    with patch.object(lid, 'get_top_candidates') as get_top_candidates:
+        result = lid.analyze_source(src)
+    assert not get_top_candidates.called
+    assert len(result) == 1
+    assert result[0]["matched_license"] == "L0"
+    assert result[0]["score"] == 1.0
+    assert result[0]["start_line_ind"] == 0
+    assert result[0]["end_line_ind"] == 3
+
+    # A near copy in a license file is matched as a whole, without a region
+    # search
+    lines, offsets_by_line = util.get_lines_and_line_offsets(
+        [line + "\n" for line in lic_lines + ["x"]])
+    src = prep.Source.from_lines_and_offsets(lines, offsets_by_line,
+                                             "LICENSE.txt")
+    with patch.object(lid, '_find_candidate_regions') as find_regions:
+        result = lid.analyze_source(src)
+    assert not find_regions.called
+    assert len(result) == 1
+    assert result[0]["matched_license"] == "L0"
+    assert result[0]["start_line_ind"] == 0
+    assert result[0]["end_line_ind"] == 21
+    assert lid_search.analyze_source(src)[0]["end_line_ind"] == 20
+
+    # In any other file, the code around a license is left out
+    src = prep.Source.from_lines_and_offsets(lines, offsets_by_line, "a.py")
+    assert lid.analyze_source(src) == lid_search.analyze_source(src)
+    assert lid.analyze_source(src)[0]["end_line_ind"] == 20
+
+    # Anything else is searched as before
+    src = prep.Source.from_lines(["y"] * 30 + lic_lines[:10] + ["i j k l"])
+    assert lid.analyze_source(src) == lid_search.analyze_source(src)
+
+
+@pytest.mark.parametrize("filepath, expected", [
+    ("LICENSE", True),
+    ("a/COPYING.txt", True),
+    ("MIT-LICENSE.md", True),
+    ("license-2.0", True),
+    ("NOTICE.rst", True),
+    ("licenses", True),
+    ("license.py", False),
+    ("notice.c", False),
+    ("copying.h", False),
+    ("licenses_test.py", False),
+    ("licensed.txt", False),
+    ("a.py", False),
+    (None, False),
+])
+def test_is_license_file_name(filepath, expected):
+    assert license_identifier._is_license_file_name(filepath) == expected
+
+
+def test_header_scan(tmpdir):
+    lic_lines = ["w{} w{} w{}".format(i, i + 1, i + 2)
+                 for i in range(0, 60, 3)]
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(lic_lines, name="L0")])
+    code = ["x{} = {}".format(i, i) for i in range(50)]
+
+    def analyze(filename, file_lines, threshold=0.01, **kwargs):
+        filepath = str(tmpdir.join(filename))
+        with open(filepath, "w") as f:
+            f.write("\n".join(file_lines) + "\n")
+        lid = license_identifier.LicenseIdentifier(
+            license_library=lib, threshold=threshold, run_in_parallel=False,
+            **kwargs)
+        return lid.analyze_file(filepath)
+
+    def regions(results):
+        return [(r["matched_license"], r["start_line_ind"], r["end_line_ind"],
+                 r["start_offset"], r["end_offset"]) for r in results]
+
+    # A license in the header is found without reading the whole file
+    file_lines = ["# " + line for line in lic_lines] + code
+    with patch.object(util, 'read_lines_offsets') as read_lines_offsets:
+        results = analyze("a.py", file_lines, header_lines=30)
+    assert not read_lines_offsets.called
+    assert regions(results) == regions(analyze("a.py", file_lines))
+    assert regions(results) == [("L0", 0, 20, 0, 270)]
+
+    # One that runs to the end of the header is looked for in the whole file
+    assert regions(analyze("a.py", file_lines, header_lines=10)) == \
+        regions(results)
+
+    # So is one cut off by the header, even scoring below the threshold there
+    file_lines = code + ["# " + line for line in lic_lines] + code
+    header = file_lines[:58]
+    assert analyze("a.py", header, threshold=0.5) == []
+    assert regions(analyze("a.py", file_lines, threshold=0.5,
+                           header_lines=58)) == \
+        regions(analyze("a.py", file_lines, threshold=0.5))
+    assert regions(analyze("a.py", file_lines, threshold=0.5,
+                           header_lines=58))[0][:3] == ("L0", 50, 70)
+
+    # Bare comment markers at the end of the header do not hide a license
+    # that goes on past it
+    file_lines = ["# " + line for line in lic_lines[:8]] + ["#"] * 5 + \
+        ["# " + line for line in lic_lines[8:]] + code
+    assert regions(analyze("a.py", file_lines, header_lines=13)) == \
+        regions(analyze("a.py", file_lines))
+    assert regions(analyze("a.py", file_lines,
+                           header_lines=13))[0][:3] == ("L0", 0, 25)
+
+    # A file that fits in the header is analyzed whole
+    file_lines = ["# " + line for line in lic_lines] + code
+    assert regions(analyze("a.py", file_lines, header_kb=1)) == \
+        regions(results)
+
+    # Past the header, a license is only found in a license file
+    file_lines = code + lic_lines
+    assert analyze("a.py", file_lines, header_lines=30) == []
+    assert regions(analyze("COPYING.txt", file_lines, header_lines=30)) == \
+        [("L0", 50, 70, 430, 660)]
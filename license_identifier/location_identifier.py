@@ -30,6 +30,7 @@
 import argparse
 import sys
 
+from . import alignment
 from . import location_result
 from . import prep
 from . import scores
@@ -43,6 +44,19 @@ DEFAULT_STRATEGY = "one_line_then_expand"
 DEFAULT_SIMILARITY = "edit_weighted"
 DEFAULT_VERBOSITY = 0
 DEFAULT_PUNCT_WEIGHT = 0.01
+DEFAULT_ALIGNER = alignment.DEFAULT_ALIGNER
+
+# Score bounds are compared with this much slack, so that rounding cannot
+# prune a region that ties with the best one
+BOUND_SLACK = 1e-12
+
+# Number of likely regions scored to get a good score to beat before
+# the windowed exhaustive search
+WINDOWED_SEED_REGIONS = 3
+
+# Width below which galloping expansion scores every line of the range left
+# to search instead of narrowing it further
+GALLOP_SCAN_LINES = 4
 
 
 def main(argv):
@@ -62,6 +76,8 @@ def main(argv):
                         default=DEFAULT_PENALTY_ONLY_LICENSE)
     parser.add_argument("--punct_weight", type=float,
                         default=DEFAULT_PUNCT_WEIGHT)
+    parser.add_argument("--aligner", choices=alignment.ALIGNERS,
+                        default=DEFAULT_ALIGNER)
     args = parser.parse_args(argv)
 
     if args.pickled_license_library is not None:
@@ -79,6 +95,7 @@ def main(argv):
                                overshoot=args.overshoot,
                                similarity=args.similarity,
                                strategy=args.strategy,
+                               aligner=args.aligner,
                                verbosity=args.verbosity)
 
     license = prep.License.from_filepath(args.license_file)
@@ -98,6 +115,7 @@ class Location_Finder(object):
                  overshoot=DEFAULT_OVERSHOOT,
                  strategy=DEFAULT_STRATEGY,
                  similarity=DEFAULT_SIMILARITY,
+                 aligner=DEFAULT_ALIGNER,
                  verbosity=DEFAULT_VERBOSITY):
 
         self.context_lines = context_lines
@@ -108,6 +126,7 @@ class Location_Finder(object):
         self.overshoot = overshoot
         self.strategy = Location_Finder._check_strategy(strategy)
         self.similarity = Location_Finder._check_similarity(similarity)
+        self.aligner = alignment.check_aligner(aligner)
         self.verbosity = verbosity
         self.similarity_obj = self._similarity_factory()
 
@@ -122,7 +141,9 @@ class Location_Finder(object):
 
     @staticmethod
     def _check_strategy(strategy):
-        allowed = ['exhaustive', 'one_line_then_expand', 'full_text_only']
+        allowed = ['exhaustive', 'windowed_exhaustive',
+                   'one_line_then_expand', 'anchor_then_expand',
+                   'galloping_expand', 'full_text_only']
         unrecognized = 'Unrecognized strategy: {}'.format(strategy)
 
         assert strategy in allowed, unrecognized
@@ -136,7 +157,8 @@ class Location_Finder(object):
             similarity_obj = scores.EditWeightedSimilarity(
                 penalty_only_source=self.penalty_only_source,
                 penalty_only_license=self.penalty_only_license,
-                punct_weight=self.punct_weight)
+                punct_weight=self.punct_weight,
+                aligner=self.aligner)
         elif self.similarity == 'ngram':
             similarity_obj = scores.NgramSimilarity(
                 universe_n_grams=self.universe_n_grams)
@@ -147,9 +169,18 @@ class Location_Finder(object):
         if self.strategy == 'exhaustive':
             start_line, end_line = \
                 self.best_region_exhaustive(lic, src)
+        elif self.strategy == 'windowed_exhaustive':
+            start_line, end_line = \
+                self.best_region_windowed(lic, src)
         elif self.strategy == 'one_line_then_expand':
             start_line, end_line = \
                 self.one_line_then_expand(lic, src)
+        elif self.strategy == 'anchor_then_expand':
+            start_line, end_line = \
+                self.anchor_then_expand(lic, src)
+        elif self.strategy == 'galloping_expand':
+            start_line, end_line = \
+                self.galloping_expand(lic, src)
         elif self.strategy == 'full_text_only':
             start_line = 0
             end_line = len(src.lines)
@@ -164,7 +195,8 @@ class Location_Finder(object):
         # n-gram score for the resulting region
         ngram_similarity_obj = scores.NgramSimilarity(
                 universe_n_grams=self.universe_n_grams)
-        ngram_score = ngram_similarity_obj.score_and_rationale(lic, src.subset(start_line_orig, end_line_orig), False)
+        ngram_score = ngram_similarity_obj.region_scorer(lic, src).score(
+            start_line_orig, end_line_orig)
         if self.verbosity >= 1:
             print("n-gram score for best region: {}".format(ngram_score))
 
@@ -178,16 +210,16 @@ class Location_Finder(object):
                                               end_line=end_line,
                                               start_offset=start_offset,
                                               end_offset=end_offset,
-                                              score=ngram_score['score'],
+                                              score=ngram_score,
                                               start_line_orig=start_line_orig,
                                               end_line_orig=end_line_orig)
 
     def best_region_exhaustive(self, lic, src):
+        region_scorer = self.similarity_obj.region_scorer(lic, src)
         results = []
         for start_line in range(len(src.lines)):
             for end_line in range(start_line + 1, len(src.lines) + 1):
-                src_subset = src.subset(start_line, end_line)
-                score = self.similarity_obj.score(lic, src_subset)
+                score = region_scorer.score(start_line, end_line)
                 results.append((start_line, end_line, score))
 
         if self.verbosity >= 1:  # pragma: no cover
@@ -201,12 +233,61 @@ class Location_Finder(object):
 
         return start_line, end_line
 
+    def best_region_windowed(self, lic, src):
+        """
+        Same result as best_region_exhaustive without scoring every region.
+
+        The best of the region found by anchor_then_expand and a few likely
+        regions sets the score to beat.  Then, for each start line, the end
+        line only grows while some region from that start could still beat
+        it; that bounds the windows to a size comparable to the license.
+        Regions whose own score bound cannot beat it are not scored.
+        """
+        region_scorer = self.similarity_obj.region_scorer(lic, src)
+        if not src.lines or region_scorer.region_score_bound(0, 1) is None:
+            return self.best_region_exhaustive(lic, src)
+
+        seeds = [self.anchor_then_expand(lic, src,
+                                         region_scorer=region_scorer)]
+        seeds.extend(region_scorer.likely_regions(WINDOWED_SEED_REGIONS))
+        best_score, best_start_line, best_end_line = \
+            max((region_scorer.score(start_line, end_line),
+                 -start_line, -end_line) for start_line, end_line in seeds)
+        best_start_line, best_end_line = -best_start_line, -best_end_line
+
+        num_lines = len(src.lines)
+        for start_line in range(num_lines):
+            for end_line in range(start_line + 1, num_lines + 1):
+                threshold = best_score - BOUND_SLACK
+                if region_scorer.extended_score_bound(
+                        start_line, end_line) < threshold:
+                    break
+                if region_scorer.region_score_bound(
+                        start_line, end_line) < threshold:
+                    continue
+
+                # Ties go to the first region in exhaustive order
+                score = region_scorer.score(start_line, end_line)
+                if score > best_score or (score == best_score and (
+                        start_line, end_line) <
+                        (best_start_line, best_end_line)):
+                    best_start_line, best_end_line = start_line, end_line
+                    best_score = score
+
+        if self.verbosity >= 1:  # pragma: no cover
+            print("Best region: {}-{}: score = {:.06f}".format(
+                best_start_line, best_end_line, best_score))
+            print("=" * 40)
+
+        return best_start_line, best_end_line
+
     def one_line_then_expand(self, lic, src):
+        region_scorer = self.similarity_obj.region_scorer(lic, src)
+
         # First, find best single line
         results = []
         for line_index in range(len(src.lines)):
-            src_subset = src.subset(line_index, line_index + 1)
-            score = self.similarity_obj.score(lic, src_subset)
+            score = region_scorer.score(line_index, line_index + 1)
             results.append((line_index, line_index + 1, score))
 
         if self.verbosity >= 1:  # pragma: no cover
@@ -216,6 +297,79 @@ class Location_Finder(object):
             print("=" * 40)
 
         start_line, end_line, best_score = max(results, key=lambda x: x[2])
+
+        return self._expand_alternately(lic, src, start_line, end_line,
+                                        best_score, region_scorer)
+
+    def anchor_then_expand(self, lic, src, region_scorer=None):
+        """
+        Same result as one_line_then_expand, but the best single line is
+        found without scoring every line: lines are scored in order of an
+        upper bound on their score (from the tokens they share with the
+        license) until no remaining line can beat the best one found.
+        """
+        if region_scorer is None:
+            region_scorer = self.similarity_obj.region_scorer(lic, src)
+        bounds = region_scorer.line_score_bounds()
+        if bounds is None or not src.lines:
+            return self.one_line_then_expand(lic, src)
+
+        best_line, best_score = self._best_line(bounds, region_scorer)
+
+        return self._expand_alternately(lic, src, best_line, best_line + 1,
+                                        best_score, region_scorer)
+
+    def galloping_expand(self, lic, src):
+        """
+        Starts from the same line as anchor_then_expand, but expands the
+        region with gallop() rather than a line at a time.
+        """
+        region_scorer = self.similarity_obj.region_scorer(lic, src)
+        bounds = region_scorer.line_score_bounds()
+        if bounds is None or not src.lines:
+            results = [(line_index, region_scorer.score(line_index,
+                                                        line_index + 1))
+                       for line_index in range(len(src.lines))]
+            best_line, best_score = max(results, key=lambda x: x[1])
+        else:
+            best_line, best_score = self._best_line(bounds, region_scorer)
+
+        return self._expand_alternately(lic, src, best_line, best_line + 1,
+                                        best_score, region_scorer,
+                                        expand=self.gallop)
+
+    def _best_line(self, bounds, region_scorer):
+        """
+        Return the first of the best-scoring single lines and its score,
+        scoring lines in order of their score bounds until no remaining
+        line can beat it.
+        """
+        # Every score is at least 0, and max() in one_line_then_expand picks
+        # the first line when they are all 0
+        best_line, best_score = 0, 0.0
+        for bound, line_index in sorted(
+                zip(bounds, range(len(bounds))), key=lambda x: (-x[0], x[1])):
+            if bound < best_score:
+                break
+            if bound == best_score and line_index > best_line:
+                continue
+
+            score = region_scorer.score(line_index, line_index + 1)
+            if score > best_score or \
+                    (score == best_score and line_index < best_line):
+                best_line, best_score = line_index, score
+
+        if self.verbosity >= 1:  # pragma: no cover
+            print("Best line: {}: score = {:.06f}".format(best_line,
+                                                          best_score))
+            print("=" * 40)
+
+        return best_line, best_score
+
+    def _expand_alternately(self, lic, src, start_line, end_line, best_score,
+                            region_scorer, expand=None):
+        if expand is None:
+            expand = self.expand
         prev_start_line, prev_end_line = None, None
 
         # Alternate between expanding region upward and downward
@@ -225,15 +379,17 @@ class Location_Finder(object):
                 print("Current region: {}-{}".format(start_line, end_line))
 
             # Expand region upward
-            start_line, end_line, best_score = self.expand(
-                lic, src, start_line, end_line, best_score, top=True)
+            start_line, end_line, best_score = expand(
+                lic, src, start_line, end_line, best_score, top=True,
+                region_scorer=region_scorer)
 
             if self.verbosity >= 1:  # pragma: no cover
                 print("Current region: {}-{}".format(start_line, end_line))
 
             # Expand region downward
-            start_line, end_line, best_score = self.expand(
-                lic, src, start_line, end_line, best_score, top=False)
+            start_line, end_line, best_score = expand(
+                lic, src, start_line, end_line, best_score, top=False,
+                region_scorer=region_scorer)
 
             if start_line == prev_start_line and end_line == prev_end_line:
                 break
@@ -243,7 +399,11 @@ class Location_Finder(object):
 
         return start_line, end_line
 
-    def expand(self, lic, src, start_line, end_line, score_to_beat, top):
+    def expand(self, lic, src, start_line, end_line, score_to_beat, top,
+               region_scorer=None):
+        if region_scorer is None:
+            region_scorer = self.similarity_obj.region_scorer(lic, src)
+
         if top:
             def update(x, y):
                 return x - 1, y
@@ -267,8 +427,7 @@ class Location_Finder(object):
             if end_line > len(src.lines):
                 break
 
-            src_subset = src.subset(start_line, end_line)
-            score = self.similarity_obj.score(lic, src_subset)
+            score = region_scorer.score(start_line, end_line)
 
             current_result = (start_line, end_line, score)
             results.append(current_result)
@@ -290,6 +449,98 @@ class Location_Finder(object):
 
         return best_start_line, best_end_line, best_score
 
+    def gallop(self, lic, src, start_line, end_line, score_to_beat, top,
+               region_scorer=None):
+        """
+        Expand the region like expand(), in fewer scores.
+
+        The boundary moves 1, 2, 4, ... lines out for as long as the score
+        keeps up.  The best boundary within the last step is then found by
+        binary search on the slope of the score, rather than by scoring
+        every line of the license.  Past it, up to `overshoot` + 1 lines are
+        tried one at a time, so that lines which dip the score are stepped
+        over as expand() does; galloping starts again from any that keeps
+        up.
+        """
+        if region_scorer is None:
+            region_scorer = self.similarity_obj.region_scorer(lic, src)
+
+        # Regions are measured in lines added to the given one
+        if top:
+            max_added = start_line
+
+            def score(added):
+                return region_scorer.score(start_line - added, end_line)
+        else:
+            max_added = len(src.lines) - end_line
+
+            def score(added):
+                return region_scorer.score(start_line, end_line + added)
+
+        best_added, best_score = 0, score_to_beat
+        while True:
+            origin = previous = high = best_added
+            step = 1
+            while high < max_added:
+                high = min(origin + step, max_added)
+                added_score = score(high)
+                if added_score < best_score:
+                    break
+
+                previous = best_added
+                best_added, best_score = high, added_score
+                step *= 2
+
+            # The score peaks somewhere past the boundary before the last one
+            # that kept up, and before the first one that did not
+            best_added, best_score = self._refine(
+                score, previous, high, best_added, best_score)
+
+            if self.verbosity >= 1:  # pragma: no cover
+                print("Galloped (top = {}) to {} added lines: score = {}".
+                      format(top, best_added, best_score))
+
+            for added in range(best_added + 1,
+                               min(best_added + self.overshoot + 1,
+                                   max_added) + 1):
+                added_score = score(added)
+                if added_score >= best_score:
+                    best_added, best_score = added, added_score
+                    break
+            else:
+                break
+
+        if top:
+            return start_line - best_added, end_line, best_score
+        return start_line, end_line + best_added, best_score
+
+    @staticmethod
+    def _refine(score, low, high, best_added, best_score):
+        """
+        Return the best number of added lines in [low, high] and its score,
+        given the best one known so far.
+
+        Scores are compared a third of the range apart, so that small bumps
+        in the score (a line of code that happens to share a word with the
+        license) do not steer the search away from the peak.  Ties go to
+        the larger region, as in expand().
+        """
+        while high - low > GALLOP_SCAN_LINES:
+            left = low + (high - low) // 3
+            right = high - (high - low) // 3
+            if score(left) <= score(right):
+                low = left + 1
+            else:
+                high = right - 1
+
+        for added in range(low, high + 1):
+            added_score = score(added)
+            if added_score > best_score or \
+                    (added_score == best_score and added > best_added):
+                best_added, best_score = added, added_score
+
+        return best_added, best_score
+
     def determine_offsets(self, start_line, end_line, src_lines, src_offsets):
         if self.context_lines:
             end_line = end_line + self.context_lines
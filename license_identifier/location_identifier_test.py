@@ -93,6 +93,17 @@ def test_main_process_exhaustive():
     assert loc_result == (0, 3, 0, 29, 1.0, 1, 2)
 
 
+def test_main_process_hunt_szymanski():
+    lcs_file = join(get_license_dir(), 'test_license.txt')
+    input_file = join(BASE_DIR, 'data', 'test', 'data', 'test1.py')
+    loc_id_obj = loc_id.Location_Finder(aligner="hunt_szymanski")
+    assert loc_id_obj.similarity_obj.aligner == "hunt_szymanski"
+    lic = prep.License.from_filepath(lcs_file)
+    src = prep.Source.from_filepath(input_file)
+    loc_result = loc_id_obj.main_process(lic, src)
+    assert loc_result == (1, 2, 5, 24, 1.0, 1, 2)
+
+
 def test_main_process_full_text_only():
     lcs_file = join(get_license_dir(), 'test_license.txt')
     input_file = join(BASE_DIR, 'data', 'test', 'data', 'test1.py')
@@ -176,6 +187,81 @@ def test_one_line_then_expand_edge_cases():
     assert result == (0, 3)
 
 
+def test_anchor_then_expand():
+    lic = prep.License.from_lines(["a b c", "d e f"])
+    sources = [
+        ["x", "x", "a", "x", "x", "", "b y", "d e", "x", "f", "x", "x"],
+        ["x", "x", "b c d e", "x", "x", "a b", "c d", "e f", "x", "x"],
+        ["x", "x", "a b", "c d e f"],
+        ["a b c d", "e f", "x", "x"],
+        ["a b c d e f"],
+        # No line shares a token with the license
+        ["x", "y", "z"],
+        # Ties between single lines go to the first one
+        ["x", "d e", "x", "x", "x", "x", "x", "x", "d e", "x"],
+    ]
+
+    for overshoot in [0, 5]:
+        loc_id_obj = loc_id.Location_Finder(
+            similarity="edit_weighted",
+            overshoot=overshoot,
+            penalty_only_source=2.0,
+            penalty_only_license=3.0)
+        for lines in sources:
+            src = prep.Source.from_lines(lines)
+            assert loc_id_obj.anchor_then_expand(lic, src) == \
+                loc_id_obj.one_line_then_expand(lic, src)
+
+    loc_id_obj = loc_id.Location_Finder(strategy="anchor_then_expand")
+    src = prep.Source.from_lines(sources[1])
+    assert loc_id_obj.main_process(lic, src) == \
+        loc_id.Location_Finder().main_process(lic, src)
+
+    # Similarities without line bounds score every line
+    loc_id_obj = loc_id.Location_Finder(similarity="ngram", overshoot=0)
+    src = prep.Source.from_lines(sources[0])
+    assert loc_id_obj.anchor_then_expand(lic, src) == \
+        loc_id_obj.one_line_then_expand(lic, src)
+
+
+def test_galloping_expand():
+    lic = prep.License.from_lines(["a b c", "d e f"])
+    sources = [
+        ["x", "x", "a", "x", "x", "", "b y", "d e", "x", "f", "x", "x"],
+        ["x", "x", "b c d e", "x", "x", "a b", "c d", "e f", "x", "x"],
+        ["x", "x", "a b", "c d e f"],
+        ["a b c d", "e f", "x", "x"],
+        ["a b c d e f"],
+        ["a b", "c d", "e f"],
+        ["x", "y", "z"],
+    ]
+
+    for similarity in ["edit_weighted", "ngram"]:
+        for overshoot in [0, 5]:
+            loc_id_obj = loc_id.Location_Finder(
+                similarity=similarity,
+                overshoot=overshoot,
+                penalty_only_source=2.0,
+                penalty_only_license=3.0)
+            for lines in sources:
+                src = prep.Source.from_lines(lines)
+                assert loc_id_obj.galloping_expand(lic, src) == \
+                    loc_id_obj.one_line_then_expand(lic, src)
+
+    # A long license is found in far fewer scores than line by line
+    lic_lines = ["word{} word{}".format(i, i + 1) for i in range(200)]
+    lic = prep.License.from_lines(lic_lines)
+    lines = ["x"] * 50 + lic_lines + ["x"] * 50
+    misses = {}
+    for strategy in ["one_line_then_expand", "galloping_expand"]:
+        loc_id_obj = loc_id.Location_Finder(strategy=strategy)
+        src = prep.Source.from_lines(lines)
+        assert loc_id_obj.main_process(lic, src).start_line == 50
+        assert loc_id_obj.main_process(lic, src).end_line == 250
+        misses[strategy] = src.file_cache.region_score_misses
+    assert misses["galloping_expand"] * 5 < misses["one_line_then_expand"]
+
+
 def test_exhaustive():
     loc_id_obj = loc_id.Location_Finder(
         similarity="edit_weighted",
@@ -190,6 +276,38 @@ def test_exhaustive():
     assert result == (5, 8)
 
 
+def test_windowed_exhaustive():
+    lic = prep.License.from_lines(["a b c", "d e f"])
+    sources = [
+        ["x", "x", "b c d e", "x", "x", "a b", "c d", "e f", "x", "x"],
+        ["x", "x", "a", "x", "x", "", "b y", "d e", "x", "f", "x", "x"],
+        ["a b c d e f"],
+        ["x", "y", "z"],
+        # Equally good regions: the first one wins, as in exhaustive
+        ["a b c", "d e f", "x", "a b c", "d e f"],
+    ]
+
+    for penalty_only_license in [3.0, 50.0]:
+        loc_id_obj = loc_id.Location_Finder(
+            similarity="edit_weighted",
+            penalty_only_source=2.0,
+            penalty_only_license=penalty_only_license)
+        for lines in sources:
+            src = prep.Source.from_lines(lines)
+            assert loc_id_obj.best_region_windowed(lic, src) == \
+                loc_id_obj.best_region_exhaustive(lic, src)
+
+    loc_id_obj = loc_id.Location_Finder(strategy="windowed_exhaustive")
+    src = prep.Source.from_lines(sources[0])
+    assert loc_id_obj.main_process(lic, src) == \
+        loc_id.Location_Finder(strategy="exhaustive").main_process(lic, src)
+
+    # Similarities without region bounds fall back to exhaustive
+    loc_id_obj = loc_id.Location_Finder(similarity="ngram")
+    assert loc_id_obj.best_region_windowed(lic, src) == \
+        loc_id_obj.best_region_exhaustive(lic, src)
+
+
 def test_determine_offsets():
     src_lines = ["", "", "", "", ""]
     src_offsets = [0, 10, 20, 30, 40, 50]
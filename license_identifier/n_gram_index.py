@@ -0,0 +1,258 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import array
+
+from future.utils import iteritems
+
+from . import n_grams as ng
+
+_UINT32 = 'I'
+
+
+def counters(n_grams):
+    return (n_grams.unigram_count, n_grams.bigram_count,
+            n_grams.trigram_count)
+
+
+def combine_level_scores(uni_score, bi_score, tri_score):
+    # Same weighting as NGrams.measure_jaccard_index
+    return (uni_score + (bi_score * 6.0) + (tri_score * 8.0)) / 15.0
+
+
+intersection_size = ng.intersection_size
+
+
+def _jaccard(intersection, union):
+    if union > 0:
+        return float(intersection) / union
+    return 0.0
+
+
+class NGramIndex(object):
+    """
+    Inverted index from n-gram to the licenses that contain it.
+
+    For every n-gram level the index keeps postings of (license position,
+    count) plus the total count of each license.  Since
+    sum(max(a, b)) == sum(a) + sum(b) - sum(min(a, b)), the Jaccard score of
+    a source against every license follows from the intersection sizes
+    alone, and those only need the postings of the source's own n-grams.
+    """
+
+    def __init__(self, names, totals, postings, posting_licenses,
+                 posting_counts, vocabulary):
+        # License names in library order
+        self.names = names
+        # Per level: total n-gram count of each license
+        self.totals = totals
+        # Per level: n-gram -> (start, end) range into the posting arrays
+        self.postings = postings
+        self.posting_licenses = posting_licenses
+        self.posting_counts = posting_counts
+        # n-gram keys are those of this vocabulary
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def from_license_n_grams(cls, license_n_grams, vocabulary=None):
+        """
+        Build an index from (name, n_grams) pairs.  n-grams are keyed on the
+        given vocabulary, by default that of the first license.
+        """
+        names = []
+        totals = [array.array(_UINT32) for _ in range(3)]
+        by_gram = [dict() for _ in range(3)]
+
+        for position, (name, n_grams) in enumerate(license_n_grams):
+            if vocabulary is None:
+                vocabulary = n_grams.vocabulary
+            n_grams = n_grams.with_vocabulary(vocabulary)
+
+            names.append(name)
+            for level, counter in enumerate(counters(n_grams)):
+                level_by_gram = by_gram[level]
+                for gram, count in iteritems(counter):
+                    if count > 0:
+                        level_by_gram.setdefault(gram, []).append(
+                            (position, count))
+                totals[level].append(sum(counter.values()))
+
+        postings = []
+        posting_licenses = []
+        posting_counts = []
+        for level_by_gram in by_gram:
+            level_postings = dict()
+            licenses = array.array(_UINT32)
+            counts = array.array(_UINT32)
+            for gram, entries in iteritems(level_by_gram):
+                start = len(licenses)
+                for position, count in entries:
+                    licenses.append(position)
+                    counts.append(count)
+                level_postings[gram] = (start, len(licenses))
+
+            postings.append(level_postings)
+            posting_licenses.append(licenses)
+            posting_counts.append(counts)
+
+        if vocabulary is None:
+            vocabulary = ng.DEFAULT_VOCABULARY
+
+        return cls(names, totals, postings, posting_licenses, posting_counts,
+                   vocabulary)
+
+    def posting_range(self, level, gram):
+        """
+        Return the (start, end) range of an n-gram's postings within
+        posting_licenses[level] and posting_counts[level], or None.
+        """
+        return self.postings[level].get(gram)
+
+    def iter_postings(self, level):
+        """Iterate over (n-gram, licenses) for every n-gram of a level."""
+        licenses = self.posting_licenses[level]
+        for gram, (start, end) in iteritems(self.postings[level]):
+            yield gram, licenses[start:end]
+
+    def lookup(self, level, gram):
+        """Return the (licenses, counts) postings of an n-gram, or None."""
+        found = self.posting_range(level, gram)
+        if found is None:
+            return None
+
+        start, end = found
+        return (self.posting_licenses[level][start:end],
+                self.posting_counts[level][start:end])
+
+    def intersection_sizes(self, level, counter):
+        """
+        sum(min(source count, license count)) over the n-grams of one level,
+        for every license.
+        """
+        sizes = [0] * len(self.names)
+        for gram, count in iteritems(counter):
+            found = self.lookup(level, gram)
+            if found is None:
+                continue
+
+            for position, lic_count in zip(*found):
+                sizes[position] += count if count < lic_count else lic_count
+
+        return sizes
+
+    def similarities(self, src_n_grams):
+        """
+        n-gram similarity of the source to every license, in library order.
+        Scores are identical to NGrams.measure_similarity.
+        """
+        src_n_grams = src_n_grams.with_vocabulary(self.vocabulary)
+        level_scores = []
+        for level, counter in enumerate(counters(src_n_grams)):
+            src_total = sum(counter.values())
+            level_scores.append([
+                _jaccard(intersection, src_total + lic_total - intersection)
+                for intersection, lic_total in zip(
+                    self.intersection_sizes(level, counter),
+                    self.totals[level])])
+
+        return [combine_level_scores(*scores)
+                for scores in zip(*level_scores)]
+
+    def top_candidates(self, src_n_grams, n_grams_of, threshold,
+                       keep_fraction_of_best):
+        """
+        (position, score) in library order for every license scoring at
+        least max(threshold, best score * keep_fraction_of_best), exactly
+        as if `similarities` had scored the whole library.
+
+        Trigram intersections come from the index.  For unigrams and
+        bigrams, intersection <= min(S, T) and union >= max(S, T) bound a
+        license's score from its totals alone, so licenses are scored in
+        decreasing order of that bound until it drops below the cutoff.
+        `n_grams_of(name)` returns a license's n-grams for the exact unigram
+        and bigram intersections.
+        """
+        src_n_grams = src_n_grams.with_vocabulary(self.vocabulary)
+        intersect = self._license_intersector(src_n_grams, n_grams_of)
+        src_counters = counters(src_n_grams)
+        src_totals = [sum(counter.values()) for counter in src_counters]
+        uni_totals, bi_totals, tri_totals = self.totals
+
+        tri_scores = [
+            _jaccard(intersection, src_totals[2] + lic_total - intersection)
+            for intersection, lic_total in zip(
+                self.intersection_sizes(2, src_counters[2]), tri_totals)]
+
+        bounds = []
+        for position, tri_score in enumerate(tri_scores):
+            uni_bound = _jaccard(min(src_totals[0], uni_totals[position]),
+                                 max(src_totals[0], uni_totals[position]))
+            bi_bound = _jaccard(min(src_totals[1], bi_totals[position]),
+                                max(src_totals[1], bi_totals[position]))
+            bounds.append(
+                (combine_level_scores(uni_bound, bi_bound, tri_score),
+                 position))
+        bounds.sort(key=lambda bound: -bound[0])
+
+        cutoff = threshold
+        scores = dict()
+        for bound, position in bounds:
+            if bound < cutoff:
+                break
+
+            level_scores = []
+            for level in range(2):
+                intersection = intersect(level, position)
+                level_scores.append(_jaccard(
+                    intersection,
+                    src_totals[level] + self.totals[level][position] -
+                    intersection))
+
+            score = combine_level_scores(
+                level_scores[0], level_scores[1], tri_scores[position])
+            scores[position] = score
+            cutoff = max(cutoff, score * keep_fraction_of_best)
+
+        return [(position, scores[position]) for position in sorted(scores)
+                if scores[position] >= cutoff]
+
+    def _license_intersector(self, src_n_grams, n_grams_of):
+        """
+        Return a function of (level, license position) giving the source's
+        intersection size with that one license.  The source is keyed on the
+        index vocabulary.
+        """
+        src_counters = counters(src_n_grams)
+
+        def intersect(level, position):
+            lic_counters = counters(n_grams_of(
+                self.names[position]).with_vocabulary(self.vocabulary))
+            return intersection_size(src_counters[level], lic_counters[level])
+
+        return intersect
@@ -0,0 +1,109 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+from collections import OrderedDict
+
+from . import n_gram_index as ngi
+from . import n_grams as ng
+from . import prep
+
+
+license_lines = OrderedDict([
+    ("L0", ["a b c d", "a b"]),
+    ("L1", ["b c d e f", "g"]),
+    ("L2", ["x y z"]),
+    ("L3", []),
+])
+
+src_lines_list = [["a b c d", "a b"], ["b c d"], ["q"], [],
+                  ["a a a b b c d e f g x y"]]
+
+
+def make_index():
+    return ngi.NGramIndex.from_license_n_grams(
+        (name, ng.NGrams(lines)) for name, lines in license_lines.items())
+
+
+def test_similarities_match_measure_similarity():
+    index = make_index()
+    assert index.names == list(license_lines.keys())
+
+    for src_lines in src_lines_list:
+        src_ng = ng.NGrams(src_lines)
+        expected = [ng.NGrams(lines).measure_similarity(src_ng)
+                    for lines in license_lines.values()]
+        assert index.similarities(src_ng) == expected
+
+
+def test_lookup():
+    index = make_index()
+
+    key = index.vocabulary.key
+
+    licenses, counts = index.lookup(0, key("a"))
+    assert list(licenses) == [0]
+    assert list(counts) == [2]
+
+    licenses, counts = index.lookup(1, key(("c", "b")))
+    assert list(licenses) == [0, 1]
+    assert list(counts) == [1, 1]
+
+    assert index.lookup(2, key(("a", "b", "c"))) is None
+    assert index.lookup(0, key("a") + key("z") + 1) is None
+
+
+def test_library_index():
+    lib = prep.LicenseLibrary.from_licenses([
+        prep.License.from_lines(lines, name=name)
+        for name, lines in license_lines.items()])
+
+    assert lib.n_gram_index.names == list(license_lines.keys())
+    assert lib.n_gram_index.totals[0][0] == 6
+
+
+def test_top_candidates_match_similarities():
+    index = make_index()
+    n_grams_by_name = dict((name, ng.NGrams(lines))
+                           for name, lines in license_lines.items())
+
+    for src_lines in src_lines_list + [["b c d e", "x y"]]:
+        src_ng = ng.NGrams(src_lines)
+        similarities = index.similarities(src_ng)
+
+        for threshold, keep_fraction_of_best in ((0.06, 0.9), (0.0, 0.0),
+                                                 (0.2, 0.5), (1.0, 1.0)):
+            cutoff = max(threshold,
+                         max(similarities) * keep_fraction_of_best)
+            expected = [(position, score)
+                        for position, score in enumerate(similarities)
+                        if score >= cutoff]
+
+            assert index.top_candidates(
+                src_ng, n_grams_by_name.get, threshold,
+                keep_fraction_of_best) == expected
@@ -0,0 +1,149 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Optional NumPy engine for scoring sources against a whole license library.
+
+The postings of an n_gram_index.NGramIndex are the library's licenses x
+n-grams count matrices in compressed sparse column form: for each n-gram,
+the licenses (row indices) containing it and their counts.  NGramMatrix
+gathers the columns of one or more sources' n-grams and computes the
+per-level min sums for every license in one vectorized pass; the max sums
+follow from the per-license totals.
+"""
+
+from future.utils import iteritems
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from . import n_gram_index as ngi
+
+
+def is_available():
+    return numpy is not None
+
+
+class NGramMatrix(object):
+
+    def __init__(self, n_gram_index):
+        if numpy is None:  # pragma: no cover
+            raise ImportError("Vectorized scoring requires numpy")
+
+        self.index = n_gram_index
+        self.names = n_gram_index.names
+        self.totals = [numpy.asarray(totals, dtype=numpy.float64)
+                       for totals in n_gram_index.totals]
+        self.row_indices = [
+            numpy.frombuffer(licenses, dtype=numpy.uint32)
+            for licenses in n_gram_index.posting_licenses]
+        self.data = [numpy.frombuffer(counts, dtype=numpy.uint32)
+                     for counts in n_gram_index.posting_counts]
+
+    def similarities(self, src_n_grams):
+        """
+        n-gram similarity of one source to every license, in library
+        order.  Scores are identical to NGrams.measure_similarity.
+        """
+        return self.similarities_batch([src_n_grams])[0]
+
+    def similarities_batch(self, src_n_grams_list):
+        """
+        Score a batch of sources at once.  Returns one list of scores per
+        source, in the order given.
+        """
+        src_n_grams_list = [
+            src_n_grams.with_vocabulary(self.index.vocabulary)
+            for src_n_grams in src_n_grams_list]
+        num_sources = len(src_n_grams_list)
+        num_licenses = len(self.names)
+
+        level_scores = []
+        for level in range(3):
+            counters = [ngi.counters(src_n_grams)[level]
+                        for src_n_grams in src_n_grams_list]
+            intersections = self._min_sums(level, counters).reshape(
+                num_sources, num_licenses)
+
+            src_totals = numpy.array(
+                [sum(counter.values()) for counter in counters],
+                dtype=numpy.float64)
+            unions = src_totals[:, numpy.newaxis] + self.totals[level] - \
+                intersections
+
+            scores = numpy.zeros_like(intersections)
+            numpy.divide(intersections, unions, out=scores,
+                         where=unions > 0)
+            level_scores.append(scores)
+
+        uni_scores, bi_scores, tri_scores = level_scores
+        scores = (uni_scores + bi_scores * 6.0 + tri_scores * 8.0) / 15.0
+
+        return scores.tolist()
+
+    def _min_sums(self, level, counters):
+        """
+        sum(min(source count, license count)) for each (source, license),
+        flattened in source-major order.
+        """
+        num_licenses = len(self.names)
+        starts, ends, src_counts, sources = [], [], [], []
+
+        for source, counter in enumerate(counters):
+            for gram, count in iteritems(counter):
+                found = self.index.posting_range(level, gram)
+                if found is not None:
+                    starts.append(found[0])
+                    ends.append(found[1])
+                    src_counts.append(count)
+                    sources.append(source)
+
+        size = len(counters) * num_licenses
+        if not starts:
+            return numpy.zeros(size, dtype=numpy.float64)
+
+        starts = numpy.array(starts, dtype=numpy.int64)
+        lengths = numpy.array(ends, dtype=numpy.int64) - starts
+
+        # Positions of every posting of every gathered column
+        column_offsets = numpy.cumsum(lengths) - lengths
+        positions = numpy.arange(lengths.sum(), dtype=numpy.int64) + \
+            numpy.repeat(starts - column_offsets, lengths)
+
+        mins = numpy.minimum(
+            self.data[level][positions],
+            numpy.repeat(numpy.array(src_counts, dtype=numpy.uint32),
+                         lengths))
+        cells = numpy.repeat(
+            numpy.array(sources, dtype=numpy.int64) * num_licenses,
+            lengths) + self.row_indices[level][positions]
+
+        return numpy.bincount(cells, weights=mins, minlength=size)
@@ -0,0 +1,74 @@
+# Copyright (c) 2017, The Linux Foundation. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of The Linux Foundation nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+from . import library_format
+from . import n_grams as ng
+from . import prep
+from .n_gram_index_test import license_lines, make_index, src_lines_list
+
+n_gram_matrix = pytest.importorskip("license_identifier.n_gram_matrix")
+
+
+def test_similarities_match_index():
+    index = make_index()
+    matrix = n_gram_matrix.NGramMatrix(index)
+    assert matrix.names == index.names
+
+    for src_lines in src_lines_list:
+        src_ng = ng.NGrams(src_lines)
+        assert matrix.similarities(src_ng) == index.similarities(src_ng)
+
+
+def test_similarities_batch():
+    index = make_index()
+    matrix = n_gram_matrix.NGramMatrix(index)
+    src_n_grams_list = [ng.NGrams(lines) for lines in src_lines_list]
+
+    assert matrix.similarities_batch(src_n_grams_list) == \
+        [index.similarities(src_ng) for src_ng in src_n_grams_list]
+    assert matrix.similarities_batch([]) == []
+
+
+@pytest.mark.skipif(not library_format.AVAILABLE,
+                    reason="The binary library format needs Python 3")
+def test_packed_index(tmpdir):
+    library = prep.LicenseLibrary.from_licenses(
+        [prep.License.from_lines(lines, name=name)
+         for name, lines in license_lines.items()])
+    filename = str(tmpdir.join("lib" + library_format.FILE_EXTENSION))
+    library.serialize(filename)
+    loaded = prep.LicenseLibrary.deserialize(filename)
+
+    matrix = n_gram_matrix.NGramMatrix(loaded.n_gram_index)
+    for src_lines in src_lines_list:
+        src_ng = ng.NGrams(src_lines)
+        assert matrix.similarities(src_ng) == \
+            library.n_gram_index.similarities(src_ng)
@@ -27,15 +27,146 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import bisect
 import six
 from collections import Counter
 
 from . import util
 
 
+# Each word id takes this many bits of a packed n-gram key, so that a trigram
+# fits in a single unsigned 64-bit integer.
+ID_BITS = 21
+MAX_VOCABULARY_SIZE = 1 << ID_BITS
+_ID_MASK = MAX_VOCABULARY_SIZE - 1
+
+# The id that source words missing from a vocabulary are counted under, so
+# that scoring source text never grows the vocabulary.  No word is interned
+# with it, so nothing keyed on a vocabulary matches an n-gram that has it.
+UNKNOWN_ID = _ID_MASK
+
+
+class VocabularyFull(Exception):
+    pass
+
+
+def pack_key(ids):
+    key = 0
+    for word_id in ids:
+        key = (key << ID_BITS) | word_id
+    return key
+
+
+def unpack_key(key, n):
+    ids = []
+    for _ in range(n):
+        ids.append(key & _ID_MASK)
+        key >>= ID_BITS
+    ids.reverse()
+    return ids
+
+
+class Vocabulary(object):
+    """
+    Interns words as small integer ids.  NGrams key unigrams on word ids and
+    bigrams and trigrams on the ids packed into one integer (see pack_key),
+    so counting an n-gram needs neither a tuple nor any string hashing.
+    """
+
+    def __init__(self, words=()):
+        self.words = []
+        self.ids = {}
+        for word in words:
+            self.intern(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getstate__(self):
+        return self.words
+
+    def __setstate__(self, words):
+        self.__init__(words)
+
+    def intern(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            if word_id >= UNKNOWN_ID:
+                raise VocabularyFull(
+                    "Vocabulary exceeds {} words".format(UNKNOWN_ID))
+            self.ids[word] = word_id
+            self.words.append(word)
+        return word_id
+
+    def key(self, gram):
+        """
+        The key of a word or of a tuple of words, or None if any word is not
+        in the vocabulary.
+        """
+        if not isinstance(gram, tuple):
+            return self.ids.get(gram)
+
+        key = 0
+        for word in gram:
+            word_id = self.ids.get(word)
+            if word_id is None:
+                return None
+            key = (key << ID_BITS) | word_id
+        return key
+
+    def decode(self, key, n):
+        """
+        The word (n == 1) or tuple of words for a key, with None for
+        UNKNOWN_ID.
+        """
+        if n == 1:
+            return self._word(key)
+        return tuple(self._word(word_id) for word_id in unpack_key(key, n))
+
+    def _word(self, word_id):
+        if word_id == UNKNOWN_ID:
+            return None
+        return self.words[word_id]
+
+
+def intersection_size(counter, other):
+    """sum(min(a, b)) over the n-grams of two counters."""
+    if len(counter) > len(other):
+        counter, other = other, counter
+
+    size = 0
+    for gram, count in six.iteritems(counter):
+        other_count = other.get(gram)
+        if other_count:
+            size += count if count < other_count else other_count
+
+    return size
+
+
+def words_by_line(lines):
+    """
+    The words that n-grams are made of, per line: the line's
+    whitespace-separated words, except those that are all punctuation.
+    """
+    is_punctuation = util.PUNCTUATION.issuperset
+    return [[word for word in line.split() if not is_punctuation(word)]
+            for line in lines]
+
+
+# Shared by all NGrams built without an explicit vocabulary, so that license
+# n-grams and the universe of a library are keyed alike.  Source text is only
+# looked up in it (see LineNGrams), so it holds just the words of licenses.
+DEFAULT_VOCABULARY = Vocabulary()
+
+
 class NGrams(object):
 
-    def __init__(self, text=None):
+    def __init__(self, text=None, vocabulary=None):
+        if vocabulary is None:
+            vocabulary = DEFAULT_VOCABULARY
+
+        self.vocabulary = vocabulary
         self.unigram_count = Counter()
         self.bigram_count = Counter()
         self.trigram_count = Counter()
@@ -49,43 +180,165 @@ class NGrams(object):
     def __str__(self):
         return 'n_grams'
 
+    def __setstate__(self, state):
+        vocabulary = state.get('vocabulary')
+        self.__dict__.update(state)
+
+        if vocabulary is None:
+            # Pickled before n-grams were keyed on word ids
+            self.vocabulary = DEFAULT_VOCABULARY
+            self.unigram_count, self.bigram_count, self.trigram_count = [
+                Counter(dict((self._intern_key(gram), count)
+                             for gram, count in six.iteritems(counter)))
+                for counter in self._counters()]
+
+    def _counters(self):
+        return self.unigram_count, self.bigram_count, self.trigram_count
+
+    def _intern_key(self, gram):
+        if isinstance(gram, six.string_types):
+            return self.vocabulary.intern(gram)
+        return pack_key(self.vocabulary.intern(word) for word in gram)
+
+    def word_counts(self):
+        """
+        The unigram, bigram and trigram Counters keyed on words and tuples of
+        words (most recent word first) instead of on packed ids.
+        """
+        return tuple(
+            Counter(dict((self.vocabulary.decode(key, n), count)
+                         for key, count in six.iteritems(counter)))
+            for n, counter in enumerate(self._counters(), 1))
+
+    def with_vocabulary(self, vocabulary):
+        """
+        These n-grams keyed on the given vocabulary, which is left unchanged.
+        Returns self when it already is.  n-grams with words missing from the
+        vocabulary get distinct negative keys: they still count towards
+        totals and unions, but cannot match anything keyed on it.
+        """
+        if vocabulary is self.vocabulary:
+            return self
+
+        result = NGrams(vocabulary=vocabulary)
+        unknown_key = 0
+        for n, (counter, result_counter) in enumerate(
+                zip(self._counters(), result._counters()), 1):
+            for key, count in six.iteritems(counter):
+                result_key = vocabulary.key(self.vocabulary.decode(key, n))
+                if result_key is None:
+                    unknown_key -= 1
+                    result_key = unknown_key
+                result_counter[result_key] = count
+
+        return result
+
     def parse_text_list_items(self, list_text_line, universe_ng=None):
-        prev2_word = ''
-        prev_word = ''
-        curr_word = ''
+        self.parse_words(
+            (word for words in words_by_line(list_text_line)
+             for word in words), universe_ng)
 
-        for line in list_text_line:
-            words = line.split()
-            for word in words:
-                if util.is_punctuation(word):
-                    continue
-                prev2_word = prev_word
-                prev_word = curr_word
-                curr_word = word
-                if universe_ng is None:
-                    self.insert_ngrams(curr_word, prev_word, prev2_word)
-                else:
-                    self.insert_ng_within_universe(curr_word, prev_word,
-                                                   prev2_word, universe_ng)
+    def parse_words(self, words, universe_ng=None):
+        """
+        Count the n-grams of a sequence of words, such as the words of
+        words_by_line() run together.
+        """
+        if universe_ng is not None:
+            self._use_vocabulary(universe_ng.vocabulary)
+            self._parse_within_universe(words, universe_ng)
+            return
+
+        word_ids = self.vocabulary.ids
+        intern = self.vocabulary.intern
+        unigram_count = self.unigram_count
+        bigram_count = self.bigram_count
+        trigram_count = self.trigram_count
+        prev2_id = None
+        prev_id = None
+
+        for word in words:
+            curr_id = word_ids.get(word)
+            if curr_id is None:
+                curr_id = intern(word)
+            unigram_count[curr_id] += 1
+            if prev_id is not None:
+                bigram_key = (curr_id << ID_BITS) | prev_id
+                bigram_count[bigram_key] += 1
+                if prev2_id is not None:
+                    trigram_count[(bigram_key << ID_BITS) | prev2_id] += 1
+
+            prev2_id = prev_id
+            prev_id = curr_id
+
+    def _parse_within_universe(self, words, universe_ng):
+        # Words the universe has never seen get no id; n-grams containing
+        # them cannot be in the universe either.
+        word_ids = self.vocabulary.ids
+        universe_unigrams = universe_ng.unigram_count
+        universe_bigrams = universe_ng.bigram_count
+        universe_trigrams = universe_ng.trigram_count
+        unigram_count = self.unigram_count
+        bigram_count = self.bigram_count
+        trigram_count = self.trigram_count
+        prev2_id = None
+        prev_id = None
+
+        for word in words:
+            curr_id = word_ids.get(word)
+            if curr_id is not None:
+                if universe_unigrams.get(curr_id, 0) > 0:
+                    unigram_count[curr_id] += 1
+                if prev_id is not None:
+                    bigram_key = (curr_id << ID_BITS) | prev_id
+                    if universe_bigrams.get(bigram_key, 0) > 0:
+                        bigram_count[bigram_key] += 1
+                    if prev2_id is not None:
+                        trigram_key = (bigram_key << ID_BITS) | prev2_id
+                        if universe_trigrams.get(trigram_key, 0) > 0:
+                            trigram_count[trigram_key] += 1
+
+            prev2_id = prev_id
+            prev_id = curr_id
+
+    def _use_vocabulary(self, vocabulary):
+        if vocabulary is self.vocabulary:
+            return
+
+        keyed = NGrams(vocabulary=vocabulary)
+        for n, (counter, keyed_counter) in enumerate(
+                zip(self._counters(), keyed._counters()), 1):
+            for key, count in six.iteritems(counter):
+                keyed_counter[keyed._intern_key(
+                    self.vocabulary.decode(key, n))] = count
+
+        self.vocabulary = vocabulary
+        self.unigram_count, self.bigram_count, self.trigram_count = \
+            keyed._counters()
 
     def parse_text_str(self, text_str, universe_ng=None):
         self.parse_text_list_items(text_str.split(), universe_ng)
 
     def insert_ngrams(self, first, second, third):
         if len(first) > 0:
-            self.unigram_count[first] += 1
+            self.unigram_count[self._intern_key(first)] += 1
         if len(second) > 0:
-            self.bigram_count[first, second] += 1
+            self.bigram_count[self._intern_key((first, second))] += 1
         if len(third) > 0:
-            self.trigram_count[first, second, third] += 1
+            self.trigram_count[self._intern_key((first, second, third))] += 1
 
     def insert_ng_within_universe(self, first, second, third, universe_ng):
-        if universe_ng.unigram_count[first] > 0:
-            self.unigram_count[first] += 1
-        if universe_ng.bigram_count[first, second] > 0:
-            self.bigram_count[first, second] += 1
-        if universe_ng.trigram_count[first, second, third] > 0:
-            self.trigram_count[first, second, third] += 1
+        self._use_vocabulary(universe_ng.vocabulary)
+        vocabulary = self.vocabulary
+
+        key = vocabulary.key(first)
+        if universe_ng.unigram_count.get(key, 0) > 0:
+            self.unigram_count[key] += 1
+        key = vocabulary.key((first, second))
+        if universe_ng.bigram_count.get(key, 0) > 0:
+            self.bigram_count[key] += 1
+        key = vocabulary.key((first, second, third))
+        if universe_ng.trigram_count.get(key, 0) > 0:
+            self.trigram_count[key] += 1
 
     def measure_similarity(self, other_n_grams):
         return self.measure_jaccard_index(other_n_grams)
@@ -94,29 +347,117 @@ class NGrams(object):
         """
         |A intersection B| / |A union B|
         """
-        uni_intersect = other_n_grams.unigram_count & self.unigram_count
-        bi_intersect = other_n_grams.bigram_count & self.bigram_count
-        tri_intersect = other_n_grams.trigram_count & self.trigram_count
+        other_n_grams = other_n_grams.with_vocabulary(self.vocabulary)
 
-        uni_union = other_n_grams.unigram_count | self.unigram_count
-        bi_union = other_n_grams.bigram_count | self.bigram_count
-        tri_union = other_n_grams.trigram_count | self.trigram_count
+        # The counters may be read-only mappings rather than Counters, so
+        # the union follows from the intersection and the totals
+        scores = []
+        for counter, other_counter in zip(self._counters(),
+                                          other_n_grams._counters()):
+            intersection = intersection_size(counter, other_counter)
+            union = sum(counter.values()) + sum(other_counter.values()) - \
+                intersection
+            if union > 0:
+                scores.append(float(intersection) / union)
+            else:
+                scores.append(0.0)
+        uni_score, bi_score, tri_score = scores
 
-        if sum(uni_union.values()) > 0:
-            uni_score = \
-                float(sum(uni_intersect.values())) / sum(uni_union.values())
-        else:
-            uni_score = 0.0
+        return (uni_score + (bi_score * 6.0) + (tri_score * 8.0)) / 15.0
 
-        if sum(bi_union.values()) > 0:
-            bi_score = \
-                float(sum(bi_intersect.values())) / sum(bi_union.values())
-        else:
-            bi_score = 0.0
-        if sum(tri_union.values()) > 0:
-            tri_score = \
-                float(sum(tri_intersect.values())) / sum(tri_union.values())
+
+class LineNGrams(object):
+    """
+    The n-grams of a list of lines, recorded once so that the n-grams of any
+    range of the lines follow without parsing them again.
+
+    Per n-gram level, the keys are kept in text order along with the lines
+    each n-gram starts and ends on.  Both only grow along that order, so the
+    n-grams that lie within lines [start, end) are a contiguous slice,
+    keys[level][starting[level][start]:ending[level][end]].  N-grams that
+    span line boundaries are included, exactly as parse_text_list_items
+    counts them for the range.
+    """
+
+    def __init__(self, words_by_line, universe_ng=None, vocabulary=None):
+        """
+        Without `universe_ng`, the n-grams are keyed on `vocabulary`, by
+        default DEFAULT_VOCABULARY, which is left unchanged: words missing
+        from it are counted as UNKNOWN_ID.
+        """
+        # The same walk over the words as parse_words, which also notes the
+        # line each n-gram starts on
+        universe_unigrams = universe_bigrams = universe_trigrams = None
+        if universe_ng is not None:
+            self.vocabulary = universe_ng.vocabulary
+            universe_unigrams = universe_ng.unigram_count
+            universe_bigrams = universe_ng.bigram_count
+            universe_trigrams = universe_ng.trigram_count
+            unknown_id = None
         else:
-            tri_score = 0.0
+            if vocabulary is None:
+                vocabulary = DEFAULT_VOCABULARY
+            self.vocabulary = vocabulary
+            unknown_id = UNKNOWN_ID
+        word_ids = self.vocabulary.ids
 
-        return (uni_score + (bi_score * 6.0) + (tri_score * 8.0)) / 15.0
+        self.keys = unigram_keys, bigram_keys, trigram_keys = [], [], []
+        # A unigram starts on the line it ends on
+        bigram_lines, trigram_lines = [], []
+        # ending[level][line] is the number of n-grams that end before line
+        self.ending = ([0], [0], [0])
+        prev2_id = prev_id = None
+        prev2_line = prev_line = None
+
+        for line_index, words in enumerate(words_by_line):
+            for word in words:
+                curr_id = word_ids.get(word, unknown_id)
+                if curr_id is not None:
+                    if universe_unigrams is None or \
+                            universe_unigrams.get(curr_id, 0) > 0:
+                        unigram_keys.append(curr_id)
+                    if prev_id is not None:
+                        bigram_key = (curr_id << ID_BITS) | prev_id
+                        if universe_bigrams is None or \
+                                universe_bigrams.get(bigram_key, 0) > 0:
+                            bigram_keys.append(bigram_key)
+                            bigram_lines.append(prev_line)
+                        if prev2_id is not None:
+                            trigram_key = (bigram_key << ID_BITS) | prev2_id
+                            if universe_trigrams is None or \
+                                    universe_trigrams.get(trigram_key, 0) > 0:
+                                trigram_keys.append(trigram_key)
+                                trigram_lines.append(prev2_line)
+
+                prev2_id, prev2_line = prev_id, prev_line
+                prev_id, prev_line = curr_id, line_index
+
+            for level_ending, level_keys in zip(self.ending, self.keys):
+                level_ending.append(len(level_keys))
+
+        # starting[level][line] is the number of n-grams that start before
+        # line
+        self.starting = (self.ending[0],) + tuple(
+            [bisect.bisect_left(level_lines, line_index)
+             for line_index in range(len(words_by_line) + 1)]
+            for level_lines in (bigram_lines, trigram_lines))
+
+    def key_range(self, level, start_line, end_line):
+        """
+        Return the (begin, end) slice of keys[level] holding the n-grams
+        within lines [start_line, end_line).
+        """
+        begin = self.starting[level][start_line]
+        return begin, max(begin, self.ending[level][end_line])
+
+    def n_grams(self, start_line, end_line):
+        """
+        Return the NGrams of lines [start_line, end_line), equal to parsing
+        their words with parse_words.
+        """
+        result = NGrams(vocabulary=self.vocabulary)
+        for level, counter in enumerate(result._counters()):
+            begin, end = self.key_range(level, start_line, end_line)
+            counter.update(self.keys[level][begin:end])
+
+        return result
@@ -27,6 +27,7 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import pickle
 from collections import Counter
 
 from . import n_grams as ng
@@ -44,9 +45,8 @@ trigram_counter = Counter([('three', 'two', 'one'), ('four', 'three', 'two')])
 def test_init_list_input():
     n_grams_obj = ng.NGrams(text_list)
 
-    assert n_grams_obj.unigram_count == unigram_counter
-    assert n_grams_obj.bigram_count == bigram_counter
-    assert n_grams_obj.trigram_count == trigram_counter
+    assert n_grams_obj.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
 
 
 def test_to_string():
@@ -58,17 +58,15 @@ def test_to_string():
 def test_init_text_input():
     n_grams_obj = ng.NGrams(text_line)
 
-    assert n_grams_obj.unigram_count == unigram_counter
-    assert n_grams_obj.bigram_count == bigram_counter
-    assert n_grams_obj.trigram_count == trigram_counter
+    assert n_grams_obj.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
 
 
 def test_init_text_input_with_crlf():
     n_grams_obj = ng.NGrams(text_line_crlf)
 
-    assert n_grams_obj.unigram_count == unigram_counter
-    assert n_grams_obj.bigram_count == bigram_counter
-    assert n_grams_obj.trigram_count == trigram_counter
+    assert n_grams_obj.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
 
 
 def test_insert_ngrams():
@@ -94,18 +92,16 @@ def test_parse_text_items():
     n_grams_obj = ng.NGrams()
 
     n_grams_obj.parse_text_list_items(text_list)
-    assert n_grams_obj.unigram_count == unigram_counter
-    assert n_grams_obj.bigram_count == bigram_counter
-    assert n_grams_obj.trigram_count == trigram_counter
+    assert n_grams_obj.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
 
 
 def test_parse_text_str():
     n_grams_obj = ng.NGrams()
 
     n_grams_obj.parse_text_str(text_line)
-    assert n_grams_obj.unigram_count == unigram_counter
-    assert n_grams_obj.bigram_count == bigram_counter
-    assert n_grams_obj.trigram_count == trigram_counter
+    assert n_grams_obj.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
 
 
 def test_measure_jaccard_index():
@@ -128,3 +124,118 @@ def test_measure_jaccard_index():
 def test_measure_jaccard_index_zero_denom():
     ng0 = ng.NGrams("")
     assert ng0.measure_jaccard_index(ng0) == 0.0
+
+
+def test_pack_key():
+    key = ng.pack_key([3, 0, 7])
+    assert ng.unpack_key(key, 3) == [3, 0, 7]
+
+    largest = ng.MAX_VOCABULARY_SIZE - 1
+    key = ng.pack_key([largest] * 3)
+    assert key < 2 ** 64
+    assert ng.unpack_key(key, 3) == [largest] * 3
+
+
+def test_vocabulary():
+    vocabulary = ng.Vocabulary(["one", "two"])
+
+    assert vocabulary.intern("two") == 1
+    assert vocabulary.intern("three") == 2
+    assert len(vocabulary) == 3
+    assert vocabulary.key(("three", "one")) == ng.pack_key([2, 0])
+    assert vocabulary.key(("three", "four")) is None
+    assert vocabulary.decode(vocabulary.key(("two", "one", "three")), 3) == \
+        ("two", "one", "three")
+    assert pickle.loads(pickle.dumps(vocabulary)).ids == vocabulary.ids
+
+
+def test_separate_vocabularies():
+    n_grams_obj = ng.NGrams(text_list, vocabulary=ng.Vocabulary())
+    n_grams_obj2 = ng.NGrams(['zero', 'one', 'two', 'five'],
+                             vocabulary=ng.Vocabulary(['five']))
+    expected = ng.NGrams(text_list).measure_similarity(
+        ng.NGrams(['zero', 'one', 'two', 'five']))
+
+    assert n_grams_obj.measure_similarity(n_grams_obj2) == expected
+    assert n_grams_obj2.measure_similarity(n_grams_obj) == expected
+
+    rekeyed = n_grams_obj2.with_vocabulary(n_grams_obj.vocabulary)
+    assert sum(rekeyed.unigram_count.values()) == 4
+    assert "zero" not in n_grams_obj.vocabulary.ids
+
+
+def test_parse_within_universe():
+    universe = ng.NGrams(text_list, vocabulary=ng.Vocabulary())
+    n_grams_obj = ng.NGrams()
+    n_grams_obj.parse_text_list_items(['two three five', 'four one'],
+                                      universe_ng=universe)
+
+    assert n_grams_obj.vocabulary is universe.vocabulary
+    assert n_grams_obj.word_counts() == (
+        Counter(['two', 'three', 'four', 'one']),
+        Counter([('three', 'two')]),
+        Counter())
+
+    n_grams_obj2 = ng.NGrams()
+    n_grams_obj2.insert_ng_within_universe('three', 'two', 'one', universe)
+    n_grams_obj2.insert_ng_within_universe('five', 'three', 'two', universe)
+    assert n_grams_obj2.word_counts() == (
+        Counter(['three']),
+        Counter([('three', 'two')]),
+        Counter([('three', 'two', 'one')]))
+
+
+def test_line_n_grams():
+    lines = ['# one two', '', 'three , four', 'five one', 'two three five']
+    universe = ng.NGrams(text_list, vocabulary=ng.Vocabulary())
+    # Put all the words in the default vocabulary
+    ng.NGrams(lines)
+
+    for universe_ng in (None, universe):
+        line_n_grams = ng.LineNGrams(ng.words_by_line(lines), universe_ng)
+        for start_line in range(len(lines) + 1):
+            for end_line in range(start_line, len(lines) + 1):
+                expected = ng.NGrams()
+                expected.parse_text_list_items(lines[start_line:end_line],
+                                               universe_ng=universe_ng)
+
+                n_grams_obj = line_n_grams.n_grams(start_line, end_line)
+                assert n_grams_obj.vocabulary is expected.vocabulary
+                assert n_grams_obj.word_counts() == expected.word_counts()
+
+
+def test_line_n_grams_unknown_words():
+    vocabulary = ng.Vocabulary()
+    lic_n_grams = ng.NGrams(['one two three', 'four'], vocabulary=vocabulary)
+    lines = ['zero one two', 'three six four', 'seven one']
+
+    line_n_grams = ng.LineNGrams(ng.words_by_line(lines),
+                                 vocabulary=vocabulary)
+    n_grams_obj = line_n_grams.n_grams(0, len(lines))
+    assert len(vocabulary) == 4
+    assert n_grams_obj.unigram_count[ng.UNKNOWN_ID] == 3
+    assert n_grams_obj.word_counts()[0][None] == 3
+
+    expected = lic_n_grams.measure_similarity(
+        ng.NGrams(lines, vocabulary=ng.Vocabulary()))
+    assert lic_n_grams.measure_similarity(n_grams_obj) == expected
+    assert n_grams_obj.measure_similarity(lic_n_grams) == expected
+
+
+def test_words_by_line():
+    assert ng.words_by_line(['# one two', '', 'three , four.']) == \
+        [['one', 'two'], [], ['three', 'four.']]
+
+
+def test_unpickle_word_keyed_n_grams():
+    n_grams_obj = ng.NGrams(text_list)
+    state = dict(unigram_count=unigram_counter,
+                 bigram_count=bigram_counter,
+                 trigram_count=trigram_counter)
+
+    legacy = ng.NGrams.__new__(ng.NGrams)
+    legacy.__setstate__(state)
+    assert legacy.vocabulary is ng.DEFAULT_VOCABULARY
+    assert legacy.word_counts() == \
+        (unigram_counter, bigram_counter, trigram_counter)
+    assert legacy.measure_similarity(n_grams_obj) == 1.0
@@ -27,20 +27,35 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
+import array
+import hashlib
+import operator
 import os.path
 import pickle
+import re
 from collections import namedtuple, OrderedDict
+from itertools import chain, islice
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # pragma: no cover
+    from collections import Sequence
 
-import nltk
 import six
 
+from . import keyword_gate
 from . import util
 from . import n_grams as ng
+from . import n_gram_index as ngi
 
 
 DEFAULT_PICKLE_PROTOCOL_VERSION = 2
 
-_nltk_tokenizer = nltk.tokenize.WordPunctTokenizer()
+_UINT32 = 'I'
+
+# Tokens are runs of word characters and runs of other non-whitespace
+# characters, the same tokens as nltk's WordPunctTokenizer
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]+', re.UNICODE)
 
 
 def _span_tokenize(text):
@@ -48,47 +63,244 @@ def _span_tokenize(text):
         # Interpret text as a list of lines
         text = '\n'.join(text)
 
-    return list(_nltk_tokenizer.span_tokenize(text))
+    return [match.span() for match in _TOKEN_PATTERN.finditer(text)]
 
 
-def _tokens_and_positions_by_line(lines):
-    tokens_by_line, token_positions_by_line = [], []
+def _n_gram_words_by_line(lines, token_spans):
+    """
+    The words of each line that n-grams are made of, the same as
+    `ng.words_by_line` gives, found from the line's token spans (a
+    `TokenSpans`): tokens with no space between them make up one word, and
+    words that are all punctuation are left out.
+    """
+    is_punctuation = util.PUNCTUATION.issuperset
+    spans = token_spans.spans
+    line_starts = token_spans.line_starts
+    words_by_line = []
+
+    for line_index, line in enumerate(lines):
+        words = []
+        positions = iter(spans[2 * line_starts[line_index]:
+                               2 * line_starts[line_index + 1]])
+        word_start = word_end = None
+        for start, end in zip(positions, positions):
+            if start != word_end:
+                if word_end is not None:
+                    words.append(line[word_start:word_end])
+                word_start = start
+            word_end = end
+        if word_end is not None:
+            words.append(line[word_start:word_end])
+
+        words_by_line.append([word for word in words
+                              if not is_punctuation(word)])
+
+    return words_by_line
+
+
+def text_digest(tokens):
+    """
+    Digest of the words among the given tokens, lower-cased, so that texts
+    differing only in case, whitespace, line breaks or punctuation (such as
+    comment markers) have the same digest.
+    """
+    words = [token.lower() for token in tokens
+             if not util.is_punctuation(token)]
 
-    for line in lines:
-        token_positions = _span_tokenize(line)
-        line_tokens = [line[start:end] for start, end in token_positions]
+    return hashlib.sha1(u' '.join(words).encode('utf-8')).hexdigest()
 
-        tokens_by_line.append(line_tokens)
-        token_positions_by_line.append(token_positions)
 
-    return tokens_by_line, token_positions_by_line
+def _lines_text(lines):
+    """The text of the lines, each one followed by a newline."""
+    if not lines:
+        return u''
+    return u'\n'.join(lines) + u'\n'
 
 
-def _get_ignored_strings(lines, token_positions_by_line):
+def _ignored_spans(lines, token_positions_by_line):
     """
-    Extracts the "ignored" text (generally whitespace) that appears between
-    (or before/after) tokens.
+    Locates the "ignored" text (generally whitespace) that appears between
+    (or before/after) tokens, as (start, end) offsets into
+    `_lines_text(lines)`.
 
-    If there are n tokens, then this generator will yield n+1 strings. The
-    first string will be the initial whitespace (before any tokens), and the
-    final string will be the trailing whitespace after the final token.
+    If there are n tokens, then this generator will yield n+1 pairs. The
+    first pair will be the initial whitespace (before any tokens), and the
+    final pair will be the trailing whitespace after the final token.
     """
-    ignored_text = ''
+    line_start = 0
+    ignored_start = 0
 
     for line, token_positions in zip(lines, token_positions_by_line):
-        char_index = 0
-
         for start, end in token_positions:
-            ignored_text += line[char_index:start]
-            yield ignored_text
-
-            ignored_text = ''
-            char_index = end
+            yield ignored_start, line_start + start
+            ignored_start = line_start + end
 
-        ignored_text += line[char_index:] + '\n'
+        line_start += len(line) + 1
 
     # Produce any trailing ignored text
-    yield ignored_text
+    yield ignored_start, line_start
+
+
+def _get_ignored_strings(lines, token_positions_by_line):
+    """The text that `_ignored_spans` locates."""
+    text = _lines_text(lines)
+    for start, end in _ignored_spans(lines, token_positions_by_line):
+        yield text[start:end]
+
+
+class _LineSequence(Sequence):
+    """
+    A per-line sequence that is viewed or computed rather than stored as a
+    list.  It compares equal to a list of the same items, and its slices
+    are lists.
+    """
+
+    __slots__ = ()
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("line index out of range")
+        return index
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, _LineSequence)):
+            return NotImplemented
+        return len(self) == len(other) and \
+            all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class _LineView(_LineSequence):
+    """
+    Items [start, end) of a per-line sequence of a file, such as a
+    subset's lines, without copying them.
+    """
+
+    __slots__ = ('_items', '_start', '_end')
+
+    def __init__(self, items, start, end):
+        self._items = items
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step < 0:
+                return self._items[self._start:self._end][index]
+            return self._items[self._start + start:self._start + stop:step]
+
+        return self._items[self._start + self._index(index)]
+
+    def __iter__(self):
+        return iter(self._items[self._start:self._end])
+
+
+class _TokensByLine(_LineSequence):
+    """The tokens of every line, taken from the line's text when asked for."""
+
+    __slots__ = ('_lines',)
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._tokens(self._lines[index]))
+        return _TOKEN_PATTERN.findall(self._lines[index])
+
+    def __iter__(self):
+        return self._tokens(self._lines)
+
+    @staticmethod
+    def _tokens(lines):
+        return six.moves.map(_TOKEN_PATTERN.findall, lines)
+
+    def __reduce__(self):
+        # Python 2's default pickle protocol cannot save __slots__
+        return (_TokensByLine, (self._lines,))
+
+
+class TokenSpans(_LineSequence):
+    """
+    The (start, end) positions of the tokens of every line, kept as two
+    arrays: the positions of all tokens, flattened, and the index of the
+    first token of every line (followed by the number of tokens).
+    """
+
+    __slots__ = ('spans', 'line_starts')
+
+    def __init__(self, spans, line_starts):
+        self.spans = spans
+        self.line_starts = line_starts
+
+    @classmethod
+    def from_lines(cls, lines):
+        spans = array.array(_UINT32)
+        line_starts = array.array(_UINT32, [0])
+        finditer = _TOKEN_PATTERN.finditer
+        span_of = operator.methodcaller('span')
+
+        for line in lines:
+            spans.extend(chain.from_iterable(
+                six.moves.map(span_of, finditer(line))))
+            line_starts.append(len(spans) // 2)
+
+        return cls(spans, line_starts)
+
+    def __len__(self):
+        return len(self.line_starts) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(self._lines(start, max(start, stop)))
+
+        index = self._index(index)
+        spans = self.spans[2 * self.line_starts[index]:
+                           2 * self.line_starts[index + 1]]
+        return list(zip(spans[::2], spans[1::2]))
+
+    def __iter__(self):
+        return self._lines(0, len(self))
+
+    def _lines(self, start, end):
+        line_starts = self.line_starts
+        positions = iter(self.spans[2 * line_starts[start]:
+                                    2 * line_starts[end]])
+        pairs = six.moves.zip(positions, positions)
+        for index in range(start, end):
+            yield list(islice(pairs, line_starts[index + 1] -
+                              line_starts[index]))
+
+    def __reduce__(self):
+        return (TokenSpans, (self.spans, self.line_starts))
+
+
+def _n_grams_from_tokens(lines, token_spans):
+    n_grams = ng.NGrams()
+    n_grams.parse_words(
+        word for words in _n_gram_words_by_line(lines, token_spans)
+        for word in words)
+    return n_grams
 
 
 LicenseBase = namedtuple('License', ['name',
@@ -97,7 +309,8 @@ LicenseBase = namedtuple('License', ['name',
                                      'offsets_by_line',
                                      'tokens',
                                      'token_positions_by_line',
-                                     'n_grams'])
+                                     'n_grams',
+                                     'punctuation_counts'])
 
 
 class License(LicenseBase):
@@ -105,52 +318,149 @@ class License(LicenseBase):
     # memory-saving hack
     __slots__ = ()
 
+    def __new__(cls, name, filepath, lines, offsets_by_line, tokens,
+                token_positions_by_line, n_grams, punctuation_counts=None):
+        # punctuation_counts is derived from the tokens; licenses pickled
+        # before it existed get it here
+        if punctuation_counts is None:
+            punctuation_counts = util.punctuation_prefix_sums(tokens)
+
+        return super(License, cls).__new__(
+            cls, name, filepath, lines, offsets_by_line, tokens,
+            token_positions_by_line, n_grams, punctuation_counts)
+
     @classmethod
     def from_filepath(cls, filepath):
         name, ext = os.path.splitext(os.path.basename(filepath))
         lines, offsets_by_line = util.read_lines_offsets(filepath)
-        tokens_by_line, token_positions_by_line = \
-            _tokens_and_positions_by_line(lines)
-        tokens = [token for tokens in tokens_by_line for token in tokens]
-        n_grams = ng.NGrams(lines)
 
-        return cls(name=name,
-                   filepath=filepath,
-                   lines=lines,
-                   offsets_by_line=offsets_by_line,
-                   tokens=tokens,
-                   token_positions_by_line=token_positions_by_line,
-                   n_grams=n_grams)
+        return cls._from_lines_and_offsets(name, filepath, lines,
+                                           offsets_by_line)
 
     @classmethod
     def from_lines(cls, lines, name="<from_lines>"):
         lines, offsets_by_line = util.get_lines_and_line_offsets(lines)
-        tokens_by_line, token_positions_by_line = \
-            _tokens_and_positions_by_line(lines)
-        tokens = [token for tokens in tokens_by_line for token in tokens]
-        n_grams = ng.NGrams(lines)
+
+        return cls._from_lines_and_offsets(name, None, lines, offsets_by_line)
+
+    @classmethod
+    def _from_lines_and_offsets(cls, name, filepath, lines, offsets_by_line):
+        # Alignments compare every token of a license, so its token text is
+        # kept, unlike that of a source
+        tokens = _TOKEN_PATTERN.findall(u'\n'.join(lines))
+        token_positions_by_line = TokenSpans.from_lines(lines)
+        n_grams = _n_grams_from_tokens(lines, token_positions_by_line)
 
         return cls(name=name,
-                   filepath=None,
+                   filepath=filepath,
                    lines=lines,
                    offsets_by_line=offsets_by_line,
                    tokens=tokens,
                    token_positions_by_line=token_positions_by_line,
                    n_grams=n_grams)
 
+    def get_ignored_spans(self):
+        return _ignored_spans(self.lines, self.token_positions_by_line)
+
     def get_ignored_strings(self):
         return _get_ignored_strings(self.lines, self.token_positions_by_line)
 
 
+class FileCache(object):
+    """
+    The lines, offsets and tokens of a whole source file, along with data
+    derived from them, shared by the file's `Source` and every subset of it.
+
+    Token positions are kept in arrays and token text is taken from the
+    lines when needed, a few bytes per token rather than a tuple and a
+    string.
+    """
+
+    def __init__(self, lines, offsets_by_line=None, truncated=False):
+        if offsets_by_line is None:
+            _, offsets_by_line = util.get_lines_and_line_offsets(
+                line + '\n' for line in lines)
+
+        self.lines = lines
+        self.offsets_by_line = offsets_by_line
+        # Whether the lines are only the beginning of the file
+        self.truncated = truncated
+        self.token_positions_by_line = TokenSpans.from_lines(lines)
+        self.tokens_by_line = _TokensByLine(lines)
+        self._line_n_grams = {}
+        self._region_scores = {}
+        # Lookups in the region score cache, to show how well it does
+        self.region_score_hits = 0
+        self.region_score_misses = 0
+
+    def tokens(self, start_line, end_line):
+        """The tokens of lines [start_line, end_line) in one list."""
+        # No token spans lines, so the lines can be tokenized together
+        return _TOKEN_PATTERN.findall(
+            u'\n'.join(self.lines[start_line:end_line]))
+
+    def line_token_starts(self):
+        """
+        The index of the first token of every line among the tokens of the
+        file, followed by the number of tokens.
+        """
+        return self.token_positions_by_line.line_starts
+
+    def line_n_grams(self, universe_ng=None, vocabulary=None):
+        """
+        Per-line n-gram records of the file within `universe_ng`, or else
+        keyed on `vocabulary` (see `ng.LineNGrams`).
+        """
+        if universe_ng is not None:
+            vocabulary = None
+        key = (id(universe_ng), id(vocabulary))
+        cached = self._line_n_grams.get(key)
+        if cached is None or cached[0] is not universe_ng or \
+                cached[1] is not vocabulary:
+            # The words come from the file's tokens rather than from
+            # splitting its lines a second time
+            words_by_line = _n_gram_words_by_line(
+                self.lines, self.token_positions_by_line)
+            cached = (universe_ng, vocabulary,
+                      ng.LineNGrams(words_by_line, universe_ng, vocabulary))
+            self._line_n_grams[key] = cached
+
+        return cached[2]
+
+    def region_scores(self, similarity, lic):
+        """
+        Scores of regions of the file against `lic` under `similarity`, a
+        dict keyed by (start, end) line numbers of the whole file.
+        """
+        key = (type(similarity), similarity, lic.name)
+        cached = self._region_scores.get(key)
+        if cached is None or (cached[0] is not lic.lines and
+                              cached[0] != lic.lines):
+            # Not scored yet, or another license of the same name
+            cached = (lic.lines, {})
+            self._region_scores[key] = cached
+
+        return cached[1]
+
+    def __getstate__(self):
+        # Caches are rebuilt on demand rather than pickled
+        state = self.__dict__.copy()
+        state.update(_line_n_grams={}, _region_scores={})
+        return state
+
+
 SourceBase = namedtuple('Source', ['filepath',
-                                   'lines',
-                                   'original_line_offset',
-                                   'offsets_by_line',
-                                   'token_positions_by_line',
-                                   'tokens_by_line'])
+                                   'file_cache',
+                                   'start_line',
+                                   'end_line'])
 
 
 class Source(SourceBase):
+    """
+    Lines [start_line, end_line) of a source file.  The file's data is kept
+    once in `file_cache`, so a subset is only a new pair of bounds, and its
+    per-line attributes are views of the file's lists.
+    """
 
     # memory-saving hack
     __slots__ = ()
@@ -158,56 +468,144 @@ class Source(SourceBase):
     @classmethod
     def from_filepath(cls, filepath):
         lines, offsets_by_line = util.read_lines_offsets(filepath)
-        tokens_by_line, token_positions_by_line = \
-            _tokens_and_positions_by_line(lines)
+
+        return cls.from_lines_and_offsets(lines, offsets_by_line, filepath)
+
+    @classmethod
+    def from_lines_and_offsets(cls, lines, offsets_by_line, filepath=None,
+                               truncated=False):
+        """
+        Build a source from lines already split by
+        `util.read_lines_offsets`, or from the first lines of a file read by
+        `util.read_header_lines_offsets` if it is truncated.
+        """
+        file_cache = FileCache(lines, offsets_by_line, truncated)
 
         return cls(filepath=filepath,
-                   lines=lines,
-                   original_line_offset=0,
-                   offsets_by_line=offsets_by_line,
-                   token_positions_by_line=token_positions_by_line,
-                   tokens_by_line=tokens_by_line)
+                   file_cache=file_cache,
+                   start_line=0,
+                   end_line=len(lines))
 
     @classmethod
     def from_lines(cls, lines):
         lines, offsets_by_line = util.get_lines_and_line_offsets(lines)
-        tokens_by_line, token_positions_by_line = \
-            _tokens_and_positions_by_line(lines)
 
-        return cls(filepath=None,
-                   lines=lines,
-                   original_line_offset=0,
-                   offsets_by_line=offsets_by_line,
-                   token_positions_by_line=token_positions_by_line,
-                   tokens_by_line=tokens_by_line)
+        return cls.from_lines_and_offsets(lines, offsets_by_line)
 
     def subset(self, start, end):
-        lines = self.lines[start:end]
-        original_line_offset = self.original_line_offset + start
-        offsets_by_line = self.offsets_by_line[start:end]
-        token_positions_by_line = self.token_positions_by_line[start:end]
-        tokens_by_line = self.tokens_by_line[start: end]
+        # The same lines as slicing the source's lines would give
+        start, end, _ = slice(start, end).indices(
+            self.end_line - self.start_line)
+        end = max(start, end)
 
         return Source(filepath=self.filepath,
-                      lines=lines,
-                      original_line_offset=original_line_offset,
-                      offsets_by_line=offsets_by_line,
-                      token_positions_by_line=token_positions_by_line,
-                      tokens_by_line=tokens_by_line)
+                      file_cache=self.file_cache,
+                      start_line=self.start_line + start,
+                      end_line=self.start_line + end)
+
+    def _view(self, items, extra=0):
+        if self.start_line == 0 and self.end_line + extra == len(items):
+            return items
+        return _LineView(items, self.start_line, self.end_line + extra)
+
+    @property
+    def original_line_offset(self):
+        return self.start_line
+
+    @property
+    def lines(self):
+        return self._view(self.file_cache.lines)
+
+    @property
+    def offsets_by_line(self):
+        """
+        Offsets of the start of every line, followed by the offset of the
+        end of the last line.
+        """
+        return self._view(self.file_cache.offsets_by_line, extra=1)
+
+    @property
+    def tokens_by_line(self):
+        return self._view(self.file_cache.tokens_by_line)
+
+    @property
+    def token_positions_by_line(self):
+        return self._view(self.file_cache.token_positions_by_line)
+
+    def tokens(self):
+        """The tokens of the source's lines in one list."""
+        return self.file_cache.tokens(self.start_line, self.end_line)
+
+    def token_line_starts(self):
+        """
+        The index in `tokens()` of the first token of every line of the
+        source, followed by the number of tokens.
+        """
+        line_starts = self.file_cache.line_token_starts()
+        first = line_starts[self.start_line]
+        return [start - first
+                for start in line_starts[self.start_line:self.end_line + 1]]
+
+    def n_grams(self, universe_ng=None, vocabulary=None):
+        """
+        The n-grams of the source's lines, scoring the same as parsing them
+        with `ng.NGrams.parse_text_list_items` but taken from the file's
+        cached per-line records.
+        """
+        return self.file_cache.line_n_grams(universe_ng, vocabulary).n_grams(
+            self.start_line, self.end_line)
+
+    def get_ignored_spans(self):
+        return _ignored_spans(self.lines, self.token_positions_by_line)
 
     def get_ignored_strings(self):
         return _get_ignored_strings(self.lines, self.token_positions_by_line)
 
+    def text_digest(self):
+        """`text_digest` of the source's tokens."""
+        return text_digest(self.tokens())
+
+    def is_whole_file(self):
+        """Whether the source covers its whole file, not just a subset."""
+        return self.start_line == 0 and \
+            self.end_line == len(self.file_cache.lines) and \
+            not self.file_cache.truncated
+
     def relative_line_index(self, ind):
-        return ind - self.original_line_offset
+        return ind - self.start_line
 
     def get_lines_original_indexing(self, start, end):
         return self.lines[
             self.relative_line_index(start):self.relative_line_index(end)]
 
 
+def _n_grams_of(licenses, name):
+    n_grams_of = getattr(licenses, 'n_grams', None)
+    if n_grams_of is not None:
+        return n_grams_of(name)
+
+    return licenses[name].n_grams
+
+
+def _license_n_grams(licenses):
+    for name in licenses:
+        yield name, _n_grams_of(licenses, name)
+
+
+def _text_digests(licenses):
+    # Licenses with the same text go to the first one, which is also the one
+    # a region search would report
+    digests = dict()
+    for name in licenses:
+        digests.setdefault(text_digest(licenses[name].tokens), name)
+
+    return digests
+
+
 LicenseLibraryBase = namedtuple('LicenseLibrary',
-                                ['licenses', 'universe_n_grams'])
+                                ['licenses', 'universe_n_grams',
+                                 'n_gram_index', 'trigger_phrases',
+                                 'text_digests'])
 
 
 class LicenseLibrary(LicenseLibraryBase):
@@ -215,6 +613,24 @@ class LicenseLibrary(LicenseLibraryBase):
     # memory-saving hack
     __slots__ = ()
 
+    def __new__(cls, licenses, universe_n_grams, n_gram_index=None,
+                trigger_phrases=None, text_digests=None):
+        # Also covers libraries pickled before the index existed
+        if n_gram_index is None:
+            vocabulary = None
+            if universe_n_grams is not None:
+                vocabulary = universe_n_grams.vocabulary
+            n_gram_index = ngi.NGramIndex.from_license_n_grams(
+                _license_n_grams(licenses), vocabulary)
+        if trigger_phrases is None:
+            trigger_phrases = keyword_gate.trigger_phrases(n_gram_index)
+        if text_digests is None:
+            text_digests = _text_digests(licenses)
+
+        return super(LicenseLibrary, cls).__new__(
+            cls, licenses, universe_n_grams, n_gram_index, trigger_phrases,
+            text_digests)
+
     @classmethod
     def from_path(cls, path):
         assert isinstance(path, six.string_types)
@@ -243,8 +659,28 @@ class LicenseLibrary(LicenseLibraryBase):
         return cls(licenses=licenses_by_name,
                    universe_n_grams=universe_n_grams)
 
+    def license_n_grams(self):
+        """
+        Iterate over (name, n_grams) for every license.  Libraries that load
+        license region data on demand are not made to load it.
+        """
+        return _license_n_grams(self.licenses)
+
+    def n_grams_of(self, name):
+        """n-grams of one license, without loading its region data."""
+        return _n_grams_of(self.licenses, name)
+
     @classmethod
     def deserialize(cls, filename):
+        """
+        Load a library saved by `serialize`, in either the binary library
+        format or the legacy pickle format.
+        """
+        from . import library_format
+
+        if library_format.is_library_file(filename):
+            return library_format.load(filename)
+
         with open(filename, 'rb') as f:
             result = pickle.load(f)
 
@@ -254,5 +690,15 @@ class LicenseLibrary(LicenseLibraryBase):
         return result
 
     def serialize(self, filename):
+        """
+        Save the library.  Filenames ending in `library_format.FILE_EXTENSION`
+        get the compact binary format; anything else is pickled.
+        """
+        from . import library_format
+
+        if filename.endswith(library_format.FILE_EXTENSION):
+            library_format.dump(self, filename)
+            return
+
         with open(filename, 'wb') as f:
             pickle.dump(self, f, protocol=DEFAULT_PICKLE_PROTOCOL_VERSION)
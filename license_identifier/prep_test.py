@@ -28,8 +28,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import os
+import pickle
 
+import pytest
+
+from . import n_grams as ng
 from . import prep
+from . import util
 
 BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
 
@@ -43,10 +48,54 @@ def test_span_tokenize():
     assert result == expected
 
 
-def test_tokens_and_positions_by_line():
-    tok, pos = prep._tokens_and_positions_by_line(["a bc", "de f"])
-    assert tok == [["a", "bc"], ["de", "f"]]
-    assert pos == [[(0, 1), (2, 4)], [(0, 2), (3, 4)]]
+def test_span_tokenize_matches_nltk():
+    nltk = pytest.importorskip("nltk")
+    tokenizer = nltk.tokenize.WordPunctTokenizer()
+
+    # The test data and the license texts the library is built from
+    test_dirs = [os.path.join(BASE_DIR, "data", "test"),
+                 os.path.join(os.path.dirname(__file__), "data",
+                              "license_dir")]
+    for test_dir in test_dirs:
+        for filepath in util.files_from_path(test_dir):
+            lines, _ = util.read_lines_offsets(filepath)
+            positions = prep.TokenSpans.from_lines(lines)
+            assert positions == [list(tokenizer.span_tokenize(line))
+                                 for line in lines]
+
+    text = u"caf\u00e9 na\u00efve--\u00bfs\u00ed? \u4f60\u597d_x \t(c) 2017"
+    assert prep._span_tokenize(text) == list(tokenizer.span_tokenize(text))
+
+
+def test_tokens_and_spans_by_line():
+    lines = ["a bc", "", "de f"]
+    tok = prep._TokensByLine(lines)
+    assert tok == [["a", "bc"], [], ["de", "f"]]
+    assert tok[-1] == ["de", "f"]
+    assert tok[1:] == [[], ["de", "f"]]
+
+    pos = prep.TokenSpans.from_lines(lines)
+    assert pos == [[(0, 1), (2, 4)], [], [(0, 2), (3, 4)]]
+    assert list(pos.spans) == [0, 1, 2, 4, 0, 2, 3, 4]
+    assert list(pos.line_starts) == [0, 2, 2, 4]
+    assert pos[-1] == [(0, 2), (3, 4)]
+    assert pos[:2] == [[(0, 1), (2, 4)], []]
+    assert pickle.loads(pickle.dumps(pos)) == pos
+
+    with pytest.raises(IndexError):
+        pos[3]
+
+
+def test_n_gram_words_by_line():
+    lines = ["# a-b, c", "", u"(d) -- e\u00e9\tf.g", "x;y ;;"]
+    pos = prep.TokenSpans.from_lines(lines)
+    assert prep._n_gram_words_by_line(lines, pos) == ng.words_by_line(lines)
+
+    for filepath in util.files_from_path(os.path.join(BASE_DIR, "data")):
+        lines, _ = util.read_lines_offsets(filepath)
+        pos = prep.TokenSpans.from_lines(lines)
+        assert prep._n_gram_words_by_line(lines, pos) == \
+            ng.words_by_line(lines)
 
 
 def test_prep_license():
@@ -60,6 +109,16 @@ def test_prep_license():
         "  ", " ", "", "", "", "  \n\t\n   ", "   \n"]
 
 
+def test_license_punctuation_counts():
+    lic = prep.License.from_lines(["ab c,d.", "ef"])
+    assert lic.tokens == ["ab", "c", ",", "d", ".", "ef"]
+    assert lic.punctuation_counts == [0, 0, 0, 1, 1, 2, 2]
+
+    # Licenses pickled without the field get it when they are rebuilt
+    lic = prep.License(*lic[:-1])
+    assert lic.punctuation_counts == [0, 0, 0, 1, 1, 2, 2]
+
+
 def test_prep_source():
     path = os.path.join(BASE_DIR, "data", "test", "data", "test1.py")
     src = prep.Source.from_filepath(path)
@@ -78,6 +137,38 @@ def test_prep_source():
     assert src_subset_3.original_line_offset == 4
 
 
+def test_source_subset_views():
+    src = prep.Source.from_lines(["a b\n", "c,\n", "\n", "d e f\n"])
+    assert src.offsets_by_line == [0, 4, 7, 8, 14]
+
+    src_subset = src.subset(1, 4).subset(0, 2)
+    assert (src_subset.start_line, src_subset.end_line) == (1, 3)
+    assert src_subset.lines == ["c,", ""]
+    assert src_subset.lines[-1:] == [""]
+    assert list(src_subset.lines) == ["c,", ""]
+    assert src_subset.offsets_by_line == [4, 7, 8]
+    assert src_subset.tokens_by_line == [["c", ","], []]
+    assert src_subset.token_positions_by_line == [[(0, 1), (1, 2)], []]
+    assert src_subset.tokens() == ["c", ","]
+    assert src_subset.token_line_starts() == [0, 2, 2]
+    assert src.subset(3, 4).token_line_starts() == [0, 3]
+
+    # The same lines as slicing the source's lines
+    for start, end in [(2, 10), (3, 1), (0, -1), (-2, 4)]:
+        assert src.subset(start, end).lines == src.lines[start:end]
+
+    with pytest.raises(IndexError):
+        src_subset.lines[2]
+
+
+def test_pickle_source_subset():
+    src_subset = prep.Source.from_lines(["a", "b c", "d"]).subset(1, 2)
+    src_copy = pickle.loads(pickle.dumps(src_subset))
+    assert src_copy.lines == ["b c"]
+    assert src_copy.original_line_offset == 1
+    assert src_copy.tokens() == ["b", "c"]
+
+
 def test_source_tokens_by_line():
     src = prep.Source.from_lines(["  ab  cd  ", "", "   ef   "])
     assert src.tokens_by_line == [["ab", "cd"], [], ["ef"]]
@@ -97,6 +188,32 @@ def test_source_get_ignored_strings():
     assert src.tokens_by_line == [["ab", "c", ",", "d", "."], [], ["ef"]]
     expected = ["  ", " ", "", "", "", "  \n\t\n   ", "   \n"]
     assert list(src.get_ignored_strings()) == expected
+    assert list(src.get_ignored_spans()) == [
+        (0, 2), (4, 5), (6, 6), (7, 7), (8, 8), (9, 17), (19, 23)]
+
+    src_subset = src.subset(1, 3)
+    assert list(src_subset.get_ignored_strings()) == ["\t\n   ", "   \n"]
+    assert list(src_subset.get_ignored_spans()) == [(0, 5), (7, 11)]
+
+
+def test_source_text_digest():
+    src = prep.Source.from_lines(["# Some License,", "#  text."])
+    assert src.text_digest() == \
+        prep.Source.from_lines(["some license text"]).text_digest()
+    assert src.text_digest() == prep.text_digest(["Some", "LICENSE", "text"])
+    assert src.text_digest() != \
+        prep.Source.from_lines(["some license"]).text_digest()
+
+    assert src.is_whole_file()
+    assert not src.subset(0, 1).is_whole_file()
+    assert not src.subset(1, 2).is_whole_file()
+    assert src.subset(0, 2).is_whole_file()
+
+    # The first lines of a longer file
+    lines, offsets_by_line = util.get_lines_and_line_offsets(["a\n", "b\n"])
+    header = prep.Source.from_lines_and_offsets(lines, offsets_by_line,
+                                                truncated=True)
+    assert not header.is_whole_file()
 
 
 def test_source_original_indexing():
@@ -113,6 +230,48 @@ def test_source_original_indexing():
     assert src2.relative_line_index(42) == 2
 
 
+def test_source_n_grams():
+    src = prep.Source.from_lines(["zero one", "two three", "four"])
+    src_subset = src.subset(1, 3).subset(0, 1)
+    assert src_subset.file_cache is src.file_cache
+
+    expected = ng.NGrams(src.lines)
+    assert src.n_grams().word_counts() == expected.word_counts()
+    expected = ng.NGrams(["two three"])
+    assert src_subset.n_grams().word_counts() == expected.word_counts()
+
+
+def test_source_n_grams_leave_vocabulary_alone():
+    src = prep.Source.from_lines(["unlicensed wording", "not seen before"])
+    vocabulary_size = len(ng.DEFAULT_VOCABULARY)
+
+    assert sum(src.n_grams().unigram_count.values()) == 5
+    assert len(ng.DEFAULT_VOCABULARY) == vocabulary_size
+
+    vocabulary = ng.Vocabulary(["seen", "before"])
+    n_grams_obj = src.n_grams(vocabulary=vocabulary)
+    assert n_grams_obj.vocabulary is vocabulary
+    assert n_grams_obj.bigram_count[vocabulary.key(("before", "seen"))] == 1
+    assert len(vocabulary) == 2
+
+
+def test_file_cache_region_scores():
+    file_cache = prep.FileCache(["a b", "c"])
+    lic = prep.License.from_lines(["a b c"], name="lic")
+    region_scores = file_cache.region_scores("similarity", lic)
+    region_scores[(0, 1)] = 0.5
+
+    assert file_cache.region_scores("similarity", lic) is region_scores
+    assert file_cache.region_scores(
+        "similarity", prep.License.from_lines(["a b c"], name="lic")) \
+        is region_scores
+    assert file_cache.region_scores("other", lic) == {}
+
+    # A different license under the same name does not see those scores
+    assert file_cache.region_scores(
+        "similarity", prep.License.from_lines(["a b"], name="lic")) == {}
+
+
 def test_license_library():
     license_dir = os.path.join(BASE_DIR, "data", "test", "license")
     license_library = prep.LicenseLibrary.from_path(license_dir)
@@ -131,3 +290,18 @@ def test_license_library_from_list():
     assert license_library.licenses["L1"].lines == ["a"]
     assert license_library.licenses["L2"].lines == ["b"]
     assert license_library.licenses["L3"].lines == ["c"]
+
+
+def test_license_library_text_digests():
+    licenses = [
+        prep.License.from_lines(["a b"], name="L1"),
+        prep.License.from_lines(["c"], name="L2"),
+        prep.License.from_lines(["A,", "b"], name="L3"),
+    ]
+    license_library = prep.LicenseLibrary.from_licenses(licenses)
+
+    # Licenses with the same text go to the first of them
+    assert license_library.text_digests == {
+        prep.text_digest(["a", "b"]): "L1",
+        prep.text_digest(["c"]): "L2",
+    }
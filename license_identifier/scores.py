@@ -27,11 +27,10 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 
-import difflib
+import bisect
 from collections import Counter, namedtuple
-import string
 
-from . import n_grams as ng
+from . import alignment
 from . import util
 
 
@@ -43,6 +42,80 @@ class Similarity(object):
     def score_and_rationale(self, lic, src, extras):  # pragma: no cover
         raise NotImplementedError
 
+    def region_scorer(self, lic, src):
+        return RegionScorer(self, lic, src)
+
+
+class RegionScorer(object):
+    """
+    Scores regions (line ranges) of one source against one license.
+
+    Location strategies evaluate many overlapping regions of the same
+    source; similarities that can reuse work between them return a
+    subclass from region_scorer(), which implements _score_region().
+
+    Scores are memoized in the source file's cache under whole-file line
+    numbers, so regions scored for a source are not scored again for any
+    other subset of the same file.
+    """
+
+    # Memoized scores for one license are dropped past this many entries
+    MAX_CACHED_SCORES = 1 << 20
+
+    def __init__(self, similarity, lic, src):
+        self.similarity = similarity
+        self.lic = lic
+        self.src = src
+        self.line_offset = src.original_line_offset
+        self.file_cache = src.file_cache
+        self.cached_scores = src.file_cache.region_scores(similarity, lic)
+
+    def score(self, start_line, end_line):
+        key = (self.line_offset + start_line, self.line_offset + end_line)
+        score = self.cached_scores.get(key)
+        if score is None:
+            self.file_cache.region_score_misses += 1
+            score = self._score_region(start_line, end_line)
+            if len(self.cached_scores) >= self.MAX_CACHED_SCORES:
+                self.cached_scores.clear()
+            self.cached_scores[key] = score
+        else:
+            self.file_cache.region_score_hits += 1
+
+        return score
+
+    def _score_region(self, start_line, end_line):
+        return self.similarity.score(self.lic,
+                                     self.src.subset(start_line, end_line))
+
+    def line_score_bounds(self):
+        """
+        Return, for every line of the source, an upper bound on the score of
+        that line alone, or None if the similarity has no cheap bound.
+        """
+        return None
+
+    def region_score_bound(self, start_line, end_line):
+        """
+        Return an upper bound on score(start_line, end_line), or None if the
+        similarity has no cheap bound.
+        """
+        return None
+
+    def extended_score_bound(self, start_line, end_line):
+        """
+        Return an upper bound on score(start_line, e) for every
+        e >= end_line, or None if the similarity has no cheap bound.
+        """
+        return None
+
+    def likely_regions(self, count):
+        """
+        Return up to count (start_line, end_line) regions that are likely
+        to score well, for searches that want a good score to beat early.
+        """
+        return []
+
 
 NgramSimilarityBase = namedtuple('NgramSimilarity', ['universe_n_grams'])
 
@@ -50,50 +123,150 @@ NgramSimilarityBase = namedtuple('NgramSimilarity', ['universe_n_grams'])
 class NgramSimilarity(Similarity, NgramSimilarityBase):
 
     def score_and_rationale(self, lic, src, extras):
-        src_ngrams = ng.NGrams()
-        src_ngrams.parse_text_list_items(src.lines,
-                                         universe_ng=self.universe_n_grams)
+        src_ngrams = src.n_grams(universe_ng=self.universe_n_grams,
+                                 vocabulary=lic.n_grams.vocabulary)
 
         similarity = lic.n_grams.measure_similarity(src_ngrams)
 
         return {'score': similarity}
 
+    def region_scorer(self, lic, src):
+        return NgramRegionScorer(self, lic, src)
+
+
+class NgramRegionScorer(RegionScorer):
+    """
+    Scores regions with the same Jaccard index as
+    NGrams.measure_jaccard_index, keeping the intersection with the license
+    up to date as lines are added to or removed from the current region.
+
+    The n-grams of a region come from the per-line records cached on the
+    source file, so moving from one region to an overlapping one touches
+    only the n-grams of the lines that differ.
+    """
+
+    # Weight of each n-gram level in the combined score
+    LEVEL_WEIGHTS = (1.0, 6.0, 8.0)
+
+    def __init__(self, similarity, lic, src):
+        super(NgramRegionScorer, self).__init__(similarity, lic, src)
+
+        self.records = src.file_cache.line_n_grams(
+            similarity.universe_n_grams, lic.n_grams.vocabulary)
+        lic_n_grams = lic.n_grams.with_vocabulary(self.records.vocabulary)
+        self.lic_counts = lic_n_grams._counters()
+        self.lic_totals = [sum(counter.values())
+                           for counter in self.lic_counts]
+
+        # Per level, the key range of the current region, the counts of its
+        # n-grams and the size of their intersection with the license
+        self.ranges = [(0, 0)] * 3
+        self.region_counts = [Counter() for _ in range(3)]
+        self.intersections = [0] * 3
+
+    def _score_region(self, start_line, end_line):
+        start = self.line_offset + start_line
+        end = self.line_offset + max(start_line, end_line)
+
+        total = 0.0
+        for level, weight in enumerate(self.LEVEL_WEIGHTS):
+            self._move_to(level, self.records.key_range(level, start, end))
+
+            begin, end_key = self.ranges[level]
+            union = self.lic_totals[level] + (end_key - begin) - \
+                self.intersections[level]
+            if union > 0:
+                total += weight * (
+                    float(self.intersections[level]) / union)
+
+        return total / 15.0
+
+    def _move_to(self, level, key_range):
+        begin, end = self.ranges[level]
+        new_begin, new_end = key_range
+        if (begin, end) == (new_begin, new_end):
+            return
+
+        keys = self.records.keys[level]
+        changed = abs(new_begin - begin) + abs(new_end - end)
+        if new_end <= begin or end <= new_begin or \
+                changed > new_end - new_begin:
+            # Little or nothing is shared with the current region
+            self.region_counts[level] = Counter()
+            self.intersections[level] = 0
+            self._add(level, keys[new_begin:new_end])
+        else:
+            if new_begin < begin:
+                self._add(level, keys[new_begin:begin])
+            else:
+                self._remove(level, keys[begin:new_begin])
+            if new_end > end:
+                self._add(level, keys[end:new_end])
+            else:
+                self._remove(level, keys[new_end:end])
+
+        self.ranges[level] = key_range
+
+    def _add(self, level, keys):
+        region_count = self.region_counts[level]
+        lic_count = self.lic_counts[level]
+        matched = 0
+        for key in keys:
+            if region_count[key] < lic_count.get(key, 0):
+                matched += 1
+            region_count[key] += 1
+        self.intersections[level] += matched
+
+    def _remove(self, level, keys):
+        region_count = self.region_counts[level]
+        lic_count = self.lic_counts[level]
+        matched = 0
+        for key in keys:
+            region_count[key] -= 1
+            if region_count[key] < lic_count.get(key, 0):
+                matched += 1
+        self.intersections[level] -= matched
+
 
 EditWeightedSimilarityBase = namedtuple(
     'EditWeightedSimilary',
-    ['penalty_only_source', 'penalty_only_license', 'punct_weight'])
+    ['penalty_only_source', 'penalty_only_license', 'punct_weight',
+     'aligner'])
 
 
 class EditWeightedSimilarity(Similarity, EditWeightedSimilarityBase):
 
+    def __new__(cls, penalty_only_source, penalty_only_license, punct_weight,
+                aligner=alignment.DEFAULT_ALIGNER):
+        return super(EditWeightedSimilarity, cls).__new__(
+            cls, penalty_only_source, penalty_only_license, punct_weight,
+            alignment.check_aligner(aligner))
+
     def score_and_rationale(self, lic, src, extras):
-        src_tokens = []
-        for token_list in src.tokens_by_line:
-            src_tokens.extend(token_list)
+        src_tokens = src.tokens()
 
-        matcher = difflib.SequenceMatcher(isjunk=None,
-                                          a=src_tokens,
-                                          b=lic.tokens,
-                                          autojunk=False)
+        opcodes = alignment.get_opcodes(src_tokens, lic.tokens, self.aligner)
+        src_punct = util.punctuation_prefix_sums(src_tokens)
+        lic_punct = lic.punctuation_counts
 
         diff_chunks = []
 
-        ignored_strings_src = src.get_ignored_strings()
-        ignored_strings_lic = lic.get_ignored_strings()
-
         result = dict()
 
         if extras:
+            # Only a rationale needs the text between tokens
+            ignored_strings_src = src.get_ignored_strings()
+            ignored_strings_lic = lic.get_ignored_strings()
             result["init_ignored_src"] = next(ignored_strings_src)
             result["init_ignored_lic"] = next(ignored_strings_lic)
 
         total_counts = Counter()
-        for op, ts1, te1, ts2, te2 in matcher.get_opcodes():
+        for op, ts1, te1, ts2, te2 in opcodes:
             num_tokens_src = te1 - ts1
             num_tokens_lic = te2 - ts2
 
-            num_punct_src = self._count_punctuation(src_tokens[ts1:te1])
-            num_punct_lic = self._count_punctuation(lic.tokens[ts2:te2])
+            num_punct_src = src_punct[te1] - src_punct[ts1]
+            num_punct_lic = lic_punct[te2] - lic_punct[ts2]
 
             local_counts = Counter()
 
@@ -160,6 +333,301 @@ class EditWeightedSimilarity(Similarity, EditWeightedSimilarityBase):
 
         return result
 
-    def _count_punctuation(self, tokens):
-        count = lambda l1,l2: sum([1 for x in l1 if x in l2])
-        return count(tokens,set(string.punctuation))
+    def region_scorer(self, lic, src):
+        if self.aligner == alignment.HUNT_SZYMANSKI:
+            return HuntSzymanskiRegionScorer(self, lic, src)
+        return EditWeightedRegionScorer(self, lic, src)
+
+
+class EditWeightedRegionScorer(RegionScorer):
+    """
+    Gives the same scores as EditWeightedSimilarity.score, reusing the
+    alignment work between regions.
+
+    The score only depends on which tokens difflib matches: everything
+    outside the matching blocks is only_src or only_lic.  The blocks are
+    found with the same recursion as SequenceMatcher.get_matching_blocks
+    (with autojunk=False and no junk, find_longest_match is a plain
+    longest common substring scan), but in coordinates of the whole source,
+    so sub-alignments shared by overlapping regions are computed once and a
+    scan is resumed rather than restarted when a region grows at the bottom.
+    """
+
+    # Memoized alignments are dropped past this many entries
+    MAX_MEMO_SIZE = 1 << 20
+
+    def __init__(self, similarity, lic, src):
+        super(EditWeightedRegionScorer, self).__init__(similarity, lic, src)
+
+        self.src_tokens = src.tokens()
+        self.line_starts = src.token_line_starts()
+
+        # punct_before[i] is the number of punctuation tokens before index i
+        self.punct_before = util.punctuation_prefix_sums(self.src_tokens)
+
+        self.lic_length = len(lic.tokens)
+        self.lic_punct = lic.punctuation_counts[-1]
+        self._index_license(lic)
+        self._reset_memos()
+
+        # Only needed for the region bounds, built on first use
+        self._matchable_before = None
+        self._matchable_punct_before = None
+
+    def _index_license(self, lic):
+        self.b2j = {}
+        for j, token in enumerate(lic.tokens):
+            self.b2j.setdefault(token, []).append(j)
+
+    def _reset_memos(self):
+        self._longest = {}
+        self._scans = {}
+        self._blocks = {}
+
+    def _score_region(self, start_line, end_line):
+        alo = self.line_starts[start_line]
+        ahi = self.line_starts[end_line]
+        if len(self._longest) > self.MAX_MEMO_SIZE:
+            self._reset_memos()
+        matched, matched_punct = self._matched(alo, ahi, 0, self.lic_length)
+        return self._similarity(alo, ahi, matched, matched_punct)
+
+    def line_score_bounds(self):
+        # Whatever the alignment, a token can only be matched as many times
+        # as it occurs in both the line and the license, and the score only
+        # grows with the matched counts
+        lic_counts = Counter(self.lic.tokens)
+        punctuation = util.PUNCTUATION
+        bounds = []
+        for line_index, tokens in enumerate(self.src.tokens_by_line):
+            matched = matched_punct = 0
+            for token, count in Counter(tokens).items():
+                common = min(count, lic_counts[token])
+                matched += common
+                if token in punctuation:
+                    matched_punct += common
+            bounds.append(self._similarity(self.line_starts[line_index],
+                                           self.line_starts[line_index + 1],
+                                           matched, matched_punct))
+
+        return bounds
+
+    def region_score_bound(self, start_line, end_line):
+        # No more tokens can be matched than occur in the license at all,
+        # nor more than the license has of each kind
+        alo = self.line_starts[start_line]
+        ahi = self.line_starts[end_line]
+        matchable, matchable_punct = self._matchable(alo, ahi)
+        lic_non_punct = self.lic_length - self.lic_punct
+        matched_punct = min(matchable_punct, self.lic_punct)
+        matched = min(matchable - matchable_punct, lic_non_punct) + \
+            matched_punct
+
+        return self._similarity(alo, ahi, matched, matched_punct)
+
+    def extended_score_bound(self, start_line, end_line):
+        # Growing the region can at best match the whole license, and never
+        # lowers the number of source tokens left unmatched below what they
+        # must be here
+        alo = self.line_starts[start_line]
+        ahi = self.line_starts[end_line]
+        matchable, matchable_punct = self._matchable(alo, ahi)
+        src_punct = self.punct_before[ahi] - self.punct_before[alo]
+        src_non_punct = ahi - alo - src_punct
+        lic_non_punct = self.lic_length - self.lic_punct
+
+        only_src_non_punct = max(
+            src_non_punct - (matchable - matchable_punct),
+            src_non_punct - lic_non_punct)
+        only_src_punct = max(src_punct - matchable_punct,
+                             src_punct - self.lic_punct)
+
+        return self._score(lic_non_punct, self.lic_punct,
+                           only_src_non_punct, only_src_punct, 0, 0)
+
+    def likely_regions(self, count):
+        # Runs of lines whose words mostly occur in the license (lines
+        # without words don't break a run), most matchable first
+        runs = []
+        run_start = run_end = None
+        for line_index in range(len(self.line_starts) - 1):
+            alo = self.line_starts[line_index]
+            ahi = self.line_starts[line_index + 1]
+            matchable, matchable_punct = self._matchable(alo, ahi)
+            words = ahi - alo - \
+                (self.punct_before[ahi] - self.punct_before[alo])
+            if words == 0:
+                continue
+            if 2 * (matchable - matchable_punct) >= words:
+                if run_start is None:
+                    run_start = line_index
+                run_end = line_index + 1
+            elif run_start is not None:
+                runs.append((run_start, run_end))
+                run_start = None
+        if run_start is not None:
+            runs.append((run_start, run_end))
+
+        def matchable_count(run):
+            return self._matchable(self.line_starts[run[0]],
+                                   self.line_starts[run[1]])[0]
+
+        return sorted(runs, key=matchable_count, reverse=True)[:count]
+
+    def _matchable(self, alo, ahi):
+        """
+        Return the number of tokens in src_tokens[alo:ahi] that occur in the
+        license, and how many of those are punctuation.
+        """
+        if self._matchable_before is None:
+            lic_tokens = set(self.lic.tokens)
+            punctuation = util.PUNCTUATION
+            self._matchable_before = [0]
+            self._matchable_punct_before = [0]
+            matchable = matchable_punct = 0
+            for token in self.src_tokens:
+                if token in lic_tokens:
+                    matchable += 1
+                    if token in punctuation:
+                        matchable_punct += 1
+                self._matchable_before.append(matchable)
+                self._matchable_punct_before.append(matchable_punct)
+
+        return (self._matchable_before[ahi] - self._matchable_before[alo],
+                self._matchable_punct_before[ahi] -
+                self._matchable_punct_before[alo])
+
+    def _similarity(self, alo, ahi, matched, matched_punct):
+        src_punct = self.punct_before[ahi] - self.punct_before[alo]
+        return self._score(
+            matched - matched_punct,
+            matched_punct,
+            (ahi - alo - matched) - (src_punct - matched_punct),
+            src_punct - matched_punct,
+            (self.lic_length - matched) - (self.lic_punct - matched_punct),
+            self.lic_punct - matched_punct)
+
+    def _score(self, both_non_punct, both_punct, only_src_non_punct,
+               only_src_punct, only_lic_non_punct, only_lic_punct):
+        sim = self.similarity
+
+        # Same arithmetic as EditWeightedSimilarity.score_and_rationale, so
+        # the floats come out identical
+        unchanged = both_non_punct + sim.punct_weight * both_punct
+        only_src = only_src_non_punct + sim.punct_weight * only_src_punct
+        only_lic = only_lic_non_punct + sim.punct_weight * only_lic_punct
+
+        denom = float(unchanged +
+                      sim.penalty_only_source * only_src +
+                      sim.penalty_only_license * only_lic)
+
+        if denom == 0.0:
+            return 0.0
+        return unchanged / denom
+
+    def _matched(self, alo, ahi, blo, bhi):
+        """
+        Return (number of matched tokens, number of those that are
+        punctuation) for the alignment of src_tokens[alo:ahi] and
+        lic.tokens[blo:bhi].
+        """
+        blocks = self._blocks
+        top = (alo, ahi, blo, bhi)
+        stack = [top]
+        while stack:
+            key = stack[-1]
+            if key in blocks:
+                stack.pop()
+                continue
+
+            alo, ahi, blo, bhi = key
+            i, j, k = self._longest_match(alo, ahi, blo, bhi)
+            children = []
+            if k:
+                if alo < i and blo < j:
+                    children.append((alo, i, blo, j))
+                if i + k < ahi and j + k < bhi:
+                    children.append((i + k, ahi, j + k, bhi))
+
+            pending = [child for child in children if child not in blocks]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            matched = k
+            matched_punct = self.punct_before[i + k] - self.punct_before[i]
+            for child in children:
+                child_matched, child_punct = blocks[child]
+                matched += child_matched
+                matched_punct += child_punct
+            blocks[key] = (matched, matched_punct)
+
+        return blocks[top]
+
+    def _longest_match(self, alo, ahi, blo, bhi):
+        """
+        Equivalent to difflib.SequenceMatcher.find_longest_match without
+        junk.  The scan goes row by row over the source, so its state after
+        row ahi - 1 is kept to continue from for a larger ahi.
+        """
+        key = (alo, ahi, blo, bhi)
+        result = self._longest.get(key)
+        if result is not None:
+            return result
+
+        scan = self._scans.get((alo, blo, bhi))
+        if scan is None or scan[0] > ahi:
+            scan = [alo, {}, alo, blo, 0]
+            self._scans.setdefault((alo, blo, bhi), scan)
+        row, j2len, besti, bestj, bestsize = scan
+
+        a = self.src_tokens
+        b2j = self.b2j
+        nothing = []
+        for i in range(row, ahi):
+            j2lenget = j2len.get
+            newj2len = {}
+            indices = b2j.get(a[i], nothing)
+            for index in range(bisect.bisect_left(indices, blo),
+                               len(indices)):
+                j = indices[index]
+                if j >= bhi:
+                    break
+                k = newj2len[j] = j2lenget(j - 1, 0) + 1
+                if k > bestsize:
+                    besti, bestj, bestsize = i - k + 1, j - k + 1, k
+            j2len = newj2len
+
+        scan[:] = [ahi, j2len, besti, bestj, bestsize]
+        result = self._longest[key] = (besti, bestj, bestsize)
+        return result
+
+
+class HuntSzymanskiRegionScorer(EditWeightedRegionScorer):
+    """
+    Scores regions like EditWeightedSimilarity with the 'hunt_szymanski'
+    aligner.  The license token index is built once, and the scan of a
+    region is extended rather than redone when the region grows at the
+    bottom.
+    """
+
+    def _index_license(self, lic):
+        self.index = alignment.TokenIndex(lic.tokens)
+        self.src_ids = self.index.token_ids(self.src_tokens)
+
+    def _matched(self, alo, ahi, blo, bhi):
+        # Only ever called for the whole license, so blo and bhi are fixed
+        scan = self._scans.get(alo)
+        if scan is None or alo + scan.length > ahi:
+            scan = alignment.HuntSzymanskiScan(self.index)
+            self._scans.setdefault(alo, scan)
+        scan.extend(self.src_ids[alo + scan.length:ahi])
+
+        matched = matched_punct = 0
+        for i, j, k in scan.blocks():
+            matched += k
+            matched_punct += \
+                self.punct_before[alo + i + k] - self.punct_before[alo + i]
+
+        return matched, matched_punct
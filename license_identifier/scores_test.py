@@ -71,6 +71,27 @@ def test_edit_weighted_similarity():
     assert "diff_chunks" not in result.keys()
 
 
+def test_edit_weighted_similarity_aligners():
+    difflib_scorer = scores.EditWeightedSimilarity(penalty_only_source=1.0,
+                                                   penalty_only_license=1.0,
+                                                   punct_weight=0.5)
+    lcs_scorer = scores.EditWeightedSimilarity(penalty_only_source=1.0,
+                                               penalty_only_license=1.0,
+                                               punct_weight=0.5,
+                                               aligner="hunt_szymanski")
+    assert difflib_scorer.aligner == "difflib"
+
+    # difflib settles on the first longest block, "c", and can't match
+    # anything around it; the longest common subsequence is "b c"
+    lic = mklic(["b a c"])
+    src = mksrc(["c b c"])
+    assert difflib_scorer.score(lic, src) == 1/5.
+    assert lcs_scorer.score(lic, src) == 1/2.
+
+    assert lcs_scorer.score(mklic(["a b"]), mksrc(["a b"])) == 1.0
+    assert lcs_scorer.score(mklic([". c"]), mksrc([". b"])) == 1/5.
+
+
 def test_edit_weighted_similarity_rationale():
     scorer = scores.EditWeightedSimilarity(
         penalty_only_source=2.0,
@@ -126,6 +147,150 @@ def test_edit_weighted_similarity_rationale():
     assert chunks[5]["ignored_lic"] == []
 
 
+def test_region_scorer():
+    lic = mklic(["a b , c", "d . a b", "e f"])
+    src = mksrc(["x a b", ", c d", ". a", "b e f", "a b , c", "y"])
+    similarities = [
+        scores.NgramSimilarity(universe_n_grams=None),
+        scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                      penalty_only_license=3.0,
+                                      punct_weight=0.5),
+        scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                      penalty_only_license=3.0,
+                                      punct_weight=0.5,
+                                      aligner="hunt_szymanski"),
+    ]
+
+    for similarity in similarities:
+        region_scorer = similarity.region_scorer(lic, src)
+        # Grow regions at the top and the bottom, and revisit some, the way
+        # the location strategies do
+        regions = [(2, 3), (1, 3), (0, 3), (0, 4), (0, 5), (1, 5), (2, 3),
+                   (1, 6), (0, 6), (5, 6), (4, 6), (3, 4)]
+        for start_line, end_line in regions:
+            assert region_scorer.score(start_line, end_line) == \
+                similarity.score(lic, src.subset(start_line, end_line))
+
+
+def test_edit_weighted_region_scorer_all_regions():
+    scorer = scores.EditWeightedSimilarity(penalty_only_source=1.0,
+                                           penalty_only_license=50.0,
+                                           punct_weight=0.01)
+    lic = mklic(["a b a", "b , a", "c a b ."])
+    src = mksrc(["b a b", "a , b", "", "c a", "b . a b a"])
+
+    region_scorer = scorer.region_scorer(lic, src)
+    assert isinstance(region_scorer, scores.EditWeightedRegionScorer)
+    for end_line in range(1, len(src.lines) + 1):
+        for start_line in range(end_line - 1, -1, -1):
+            assert region_scorer.score(start_line, end_line) == \
+                scorer.score(lic, src.subset(start_line, end_line))
+
+
+def test_ngram_region_scorer_all_regions():
+    lic = mklic(["a b a", "b , a", "c a b ."])
+    src = mksrc(["b a b", "a , b", "", "c a x", "b . a b a"])
+    universe = ng.NGrams(["a b a c", "a b x"], vocabulary=ng.Vocabulary())
+
+    for universe_n_grams in (None, universe):
+        scorer = scores.NgramSimilarity(universe_n_grams=universe_n_grams)
+        region_scorer = scorer.region_scorer(lic, src.subset(1, 5))
+        assert isinstance(region_scorer, scores.NgramRegionScorer)
+        for start_line in range(4):
+            for end_line in range(start_line + 1, 5):
+                assert region_scorer.score(start_line, end_line) == \
+                    scorer.score(lic, src.subset(start_line + 1,
+                                                 end_line + 1))
+
+
+def test_region_scores_cached():
+    similarity = scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                               penalty_only_license=3.0,
+                                               punct_weight=0.5)
+    lic = mklic(["a b , c", "d . a b"])
+    src = mksrc(["x a b", ", c d", ". a b", "y"])
+    file_cache = src.file_cache
+
+    expected = similarity.region_scorer(lic, src).score(1, 3)
+    assert (file_cache.region_score_hits,
+            file_cache.region_score_misses) == (0, 1)
+
+    # The same lines of the file, through a subset of it
+    region_scorer = similarity.region_scorer(lic, src.subset(1, 4))
+    assert region_scorer.score(0, 2) == expected
+    assert (file_cache.region_score_hits,
+            file_cache.region_score_misses) == (1, 1)
+
+    # Other parameters are scored afresh
+    other = scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                          penalty_only_license=3.0,
+                                          punct_weight=0.25)
+    other.region_scorer(lic, src).score(1, 3)
+    assert (file_cache.region_score_hits,
+            file_cache.region_score_misses) == (1, 2)
+
+
+def test_line_score_bounds():
+    scorer = scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                           penalty_only_license=3.0,
+                                           punct_weight=0.5)
+    lic = mklic(["a b , c", "d . a"])
+    src = mksrc(["c , b a", "x", "a a a .", "a b , c d"])
+
+    bounds = scorer.region_scorer(lic, src).line_score_bounds()
+    assert len(bounds) == len(src.lines)
+    for line_index, bound in enumerate(bounds):
+        assert bound >= scorer.score(lic, src.subset(line_index,
+                                                     line_index + 1))
+    assert bounds[1] == 0.0
+    assert bounds[3] == scorer.score(lic, src.subset(3, 4))
+
+    ngram_scorer = scores.NgramSimilarity(universe_n_grams=None)
+    assert ngram_scorer.region_scorer(lic, src).line_score_bounds() is None
+
+
+def test_region_score_bounds():
+    scorer = scores.EditWeightedSimilarity(penalty_only_source=2.0,
+                                           penalty_only_license=3.0,
+                                           punct_weight=0.5)
+    lic = mklic(["a b , c", "d . a"])
+    src = mksrc(["c , b a", "x y", "a b , c", "d . a", "x", ". ."])
+    region_scorer = scorer.region_scorer(lic, src)
+
+    num_lines = len(src.lines)
+    for start_line in range(num_lines):
+        for end_line in range(start_line + 1, num_lines + 1):
+            score = region_scorer.score(start_line, end_line)
+            assert region_scorer.region_score_bound(start_line,
+                                                    end_line) >= score
+            for shorter_end_line in range(start_line + 1, end_line + 1):
+                assert region_scorer.extended_score_bound(
+                    start_line, shorter_end_line) >= score
+
+    assert region_scorer.region_score_bound(2, 4) == \
+        region_scorer.score(2, 4) == 1.0
+    assert region_scorer.region_score_bound(1, 2) == 0.0
+
+    ngram_scorer = scores.NgramSimilarity(universe_n_grams=None)
+    ngram_region_scorer = ngram_scorer.region_scorer(lic, src)
+    assert ngram_region_scorer.region_score_bound(0, 1) is None
+    assert ngram_region_scorer.extended_score_bound(0, 1) is None
+
+
+def test_likely_regions():
+    scorer = scores.EditWeightedSimilarity(penalty_only_source=1.0,
+                                           penalty_only_license=50.0,
+                                           punct_weight=0.01)
+    lic = mklic(["a b c d", "e f g"])
+    src = mksrc(["x y", "a b", "", "c d e", "x y z", "f x", "z", "g"])
+    region_scorer = scorer.region_scorer(lic, src)
+
+    assert region_scorer.likely_regions(3) == [(1, 4), (5, 6), (7, 8)]
+    assert region_scorer.likely_regions(1) == [(1, 4)]
+    assert scores.NgramSimilarity(universe_n_grams=None).region_scorer(
+        lic, src).likely_regions(3) == []
+
+
 def mklic(lines):
     return prep.License.from_lines(lines)
 
@@ -37,6 +37,8 @@ import string
 from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE, BOM_UTF32_BE, BOM_UTF32_LE
 
 
+PUNCTUATION = frozenset(string.punctuation)
+
 BOMS = (
         (BOM_UTF8, "UTF-8"),
         (BOM_UTF32_BE, "UTF-32-BE"),
@@ -74,6 +76,43 @@ def read_with_detected_encoder(filename):
     return lines, line_offsets
 
 
+def read_header_lines_offsets(filename, max_lines=None, max_bytes=None):
+    """
+    Like read_lines_offsets, but read no more than the first max_lines lines
+    of the file, and no more lines than it takes to reach max_bytes bytes of
+    the file as encoded.  Also return whether the file goes on past those
+    lines.
+    """
+    encoding = detect_utf(filename)
+    while True:
+        try:
+            with codecs.open(filename, 'rb', encoding=encoding,
+                             errors='replace') as fp:
+                header, truncated = _header_lines(fp, encoding, max_lines,
+                                                  max_bytes)
+                break
+        except LookupError:
+            encoding = 'utf-8'
+
+    lines, line_offsets = get_lines_and_line_offsets(header)
+    return lines, line_offsets, truncated
+
+
+def _header_lines(fp, encoding, max_lines, max_bytes):
+    header = []
+    num_bytes = 0
+
+    for line in fp:
+        if (max_lines is not None and len(header) >= max_lines) or \
+                (max_bytes is not None and num_bytes >= max_bytes):
+            return header, True
+        header.append(line)
+        if max_bytes is not None:
+            num_bytes += len(line.encode(encoding, 'replace'))
+
+    return header, False
+
+
 def get_lines_and_line_offsets(lines):
     lines_stripped = []
     line_offsets = [0]
@@ -86,7 +125,23 @@ def get_lines_and_line_offsets(lines):
 
 
 def is_punctuation(input_value):
-    return not any(c not in string.punctuation for c in input_value)
+    return PUNCTUATION.issuperset(input_value)
+
+
+def punctuation_prefix_sums(tokens):
+    """
+    Return a list whose element i is the number of punctuation tokens
+    (single punctuation characters) among the first i tokens, so that
+    counting them in any slice takes two lookups.
+    """
+    sums = [0]
+    total = 0
+    for token in tokens:
+        if token in PUNCTUATION:
+            total += 1
+        sums.append(total)
+
+    return sums
 
 
 def get_user_date_time_str():
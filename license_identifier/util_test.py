@@ -64,6 +64,36 @@ def test_read_lines_offsets():
     assert lines[1].find('\ufffd') #Python replacment character
 
 
+def test_read_header_lines_offsets():
+    input_fp = os.path.join(os.getcwd(), '../data/test/data/test1.py')
+    lines, offsets, truncated = util.read_header_lines_offsets(
+        input_fp, max_lines=2)
+    assert lines == ["zero", "one two three four"]
+    assert offsets == [0, 5, 24]
+    assert truncated
+
+    # The line that reaches max_bytes is read whole
+    lines, offsets, truncated = util.read_header_lines_offsets(
+        input_fp, max_bytes=6)
+    assert lines == ["zero", "one two three four"]
+    assert truncated
+
+    lines, offsets, truncated = util.read_header_lines_offsets(
+        input_fp, max_lines=5, max_bytes=1000)
+    assert (lines, offsets) == util.read_lines_offsets(input_fp)
+    assert not truncated
+
+
+def test_read_header_lines_offsets_counts_bytes(tmpdir):
+    # Each line is two characters but three bytes in UTF-8
+    input_fp = tmpdir.join("a.txt")
+    input_fp.write_binary(u"\u00e9\n".encode("utf-8") * 10)
+    lines, offsets, truncated = util.read_header_lines_offsets(
+        str(input_fp), max_bytes=7)
+    assert lines == [u"\u00e9"] * 3
+    assert truncated
+
+
 def test_get_lines_and_line_offsets():
     lines, offsets = util.get_lines_and_line_offsets(
         ["a b c\n", "d e\n", "f\n", "g h i j\n"])
@@ -89,6 +119,12 @@ def test_is_punctuation():
     assert util.is_punctuation("abc123") is False
 
 
+def test_punctuation_prefix_sums():
+    assert util.punctuation_prefix_sums([]) == [0]
+    assert util.punctuation_prefix_sums(["a", ",", "//", "b", "."]) == \
+        [0, 0, 1, 1, 1, 2]
+
+
 def test_files_from_path():
     # Process a directory
     input_dir = os.path.join(os.getcwd(), '../data/test/data')
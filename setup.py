@@ -77,8 +77,15 @@ class CustomInstall(install):
             self.install_lib,
             'license_identifier/data/license_n_gram_lib.pickle'
         )
+        binary_file_path = os.path.join(
+            self.install_lib,
+            'license_identifier/data/license_n_gram_lib.lidlib'
+        )
         library = LicenseLibrary.from_path(license_dir)
         library.serialize(pickle_file_path)
+        # The binary format needs Python 3; Python 2 uses the pickle
+        if sys.version_info >= (3, 3):
+            library.serialize(binary_file_path)
 
 
 setup(
@@ -95,21 +102,23 @@ setup(
         ],
     },
     setup_requires=[
-        "nltk",
         "PyYAML",
     ],
     install_requires=[
         "chardet",
         "comment-filter @ https://github.com/codeauroraforum/comment-filter/tarball/v1.0.0",
         "future",
-        "nltk<4",
         "pyyaml",
         "rdflib",
         "six",
     ],
+    extras_require={
+        'numpy': ["numpy"],
+    },
     package_data={
         'license_identifier': [
             'data/license_n_gram_lib.pickle',
+            'data/license_n_gram_lib.lidlib',
             'data/license_dir/*.txt',
             'data/license_dir/custom/*.txt',
             'data/license_dir/headers/*.txt',